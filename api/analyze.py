@@ -0,0 +1,260 @@
+# analyze.py
+# Análisis de PDFs completos con map-reduce: las páginas se extraen por tandas en un proceso worker,
+# se agrupan en fragmentos que caben en el contexto del modelo y cada fragmento se resume (o se buscan
+# en él los datos de la pregunta) en paralelo a través del planificador. Los resultados parciales se
+# combinan en una respuesta final que se genera en streaming.
+
+import os
+import json
+import hashlib
+import asyncio
+import tempfile
+from contextlib import aclosing
+
+import ingest
+import metrics
+import ollama
+import pdf_cache
+import residency
+import scheduler
+from pdf_extract import count_pages, extract_page_range
+
+# Ventana de contexto (num_ctx) que se pide a Ollama en cada llamada del análisis
+ANALYZE_CONTEXT_TOKENS = int(os.getenv("ANALYZE_CONTEXT_TOKENS", 8192))
+# Tokens de cada llamada reservados para las instrucciones y la respuesta
+RESERVED_TOKENS = 1536
+CHUNK_TOKENS = max(512, ANALYZE_CONTEXT_TOKENS - RESERVED_TOKENS)
+# Fragmentos de un mismo análisis que se generan a la vez (el planificador sigue limitando el total)
+ANALYZE_MAP_PARALLEL = int(os.getenv("ANALYZE_MAP_PARALLEL", 2))
+# Páginas que extrae el proceso worker en cada tanda
+PAGE_BATCH = 8
+NO_INFO = "SIN INFORMACIÓN"
+
+OPTIONS = {"num_ctx": ANALYZE_CONTEXT_TOKENS}
+
+def save_upload(fileobj) -> tuple:
+    """Copia el PDF subido a un archivo temporal y calcula su SHA-256 (bloqueante: ejecutar en el threadpool)."""
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        while block := fileobj.read(1024 * 1024):
+            digest.update(block)
+            tmp.write(block)
+        return tmp.name, digest.hexdigest()
+
+async def _in_process(fn, *args):
+    # pypdf es CPU puro: en un proceso worker no bloquea el event loop ni compite por el GIL
+    return await asyncio.get_running_loop().run_in_executor(ingest.get_process_pool(), fn, *args)
+
+def _split(text: str) -> list:
+    # Una página que no cabe sola en un fragmento se corta por caracteres (~4 por token)
+    size = CHUNK_TOKENS * 4
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+async def _chunks(path: str, sha256: str, pages: int, cached):
+    """Fragmentos (primera página, última página, texto) que caben en CHUNK_TOKENS, a medida que se extraen.
+    Si el texto no estaba en la caché de PDFs, se guarda al terminar la extracción."""
+    parts, used, first, last = [], 0, 0, 0
+    extracted = []
+    for start in range(0, pages, PAGE_BATCH):
+        if cached is not None:
+            texts = cached[start:start + PAGE_BATCH]
+        else:
+            texts = await _in_process(extract_page_range, path, start, start + PAGE_BATCH)
+            extracted.extend(texts)
+        for number, text in enumerate(texts, start + 1):
+            if not text.strip():
+                continue
+            for piece in _split(text):
+                piece = f"[Página {number}]\n{piece}"
+                cost = ollama.estimate_tokens(piece)
+                if parts and used + cost > CHUNK_TOKENS:
+                    yield first, last, "\n\n".join(parts)
+                    parts, used = [], 0
+                if not parts:
+                    first = number
+                parts.append(piece)
+                used += cost
+                last = number
+    if cached is None:
+        await asyncio.to_thread(pdf_cache.put, sha256, extracted)
+    if parts:
+        yield first, last, "\n\n".join(parts)
+
+def _single_prompt(text: str, query) -> str:
+    if query:
+        return f"Basado únicamente en el siguiente texto, responde a la pregunta: '{query}'. Si la respuesta no está en el texto, indícalo.\n\nTEXTO:\n{text}"
+    return f"Analiza el siguiente documento y lista los 5 temas principales o puntos clave que se tratan en él:\n\nTEXTO:\n{text}"
+
+def _map_prompt(text: str, query) -> str:
+    if query:
+        return (
+            f"Del siguiente fragmento de un documento, extrae solo la información útil para responder a la pregunta: '{query}'. "
+            f"Cita las páginas. Si no hay nada relevante, responde exactamente '{NO_INFO}'.\n\nFRAGMENTO:\n{text}"
+        )
+    return f"Resume los puntos clave del siguiente fragmento de un documento en una lista breve, citando las páginas:\n\nFRAGMENTO:\n{text}"
+
+def _reduce_prompt(notes: list, query, partial: bool) -> str:
+    joined = "\n\n".join(notes)
+    if partial:
+        return f"Combina las siguientes notas de distintas partes de un documento en una sola lista, sin repetir información y conservando las páginas citadas:\n\nNOTAS:\n{joined}"
+    if query:
+        return (
+            f"Las siguientes notas se extrajeron de distintas partes de un documento. Basado únicamente en ellas, "
+            f"responde a la pregunta: '{query}'. Cita las páginas. Si la respuesta no está en las notas, indícalo.\n\nNOTAS:\n{joined}"
+        )
+    return f"Las siguientes notas resumen las distintas partes de un documento. Lista los 5 temas principales o puntos clave del documento completo:\n\nNOTAS:\n{joined}"
+
+async def _map_chunks(chunks, model: str, query, user: str, keep_alive: str):
+    """Genera cada fragmento en cuanto se extrae y emite los resultados según terminan (no en orden)."""
+    queue = asyncio.Queue()
+    # Acota los fragmentos extraídos en memoria a la espera de turno
+    limit = asyncio.Semaphore(ANALYZE_MAP_PARALLEL * 2)
+    tasks = set()
+
+    async def one(index, first, last, text):
+        try:
+            result = await ollama.generate(
+                model, _map_prompt(text, query), user=user, keep_alive=keep_alive,
+                options=OPTIONS, max_active=ANALYZE_MAP_PARALLEL,
+            )
+            await queue.put({"event": "chunk", "index": index, "pages": [first, last], "result": result.strip()})
+        except Exception as e:
+            await queue.put({"event": "error", "detail": f"Fragmento de las páginas {first}-{last}: {e}"})
+        finally:
+            limit.release()
+
+    async def produce():
+        count = 0
+        try:
+            async for first, last, text in chunks:
+                await limit.acquire()
+                task = asyncio.create_task(one(count, first, last, text))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                count += 1
+            await queue.put({"event": "chunks", "total": count})
+        except Exception as e:
+            await queue.put({"event": "error", "detail": f"Error extrayendo el texto del PDF: {e}"})
+
+    producer = asyncio.create_task(produce())
+    try:
+        total, done = None, 0
+        while total is None or done < total:
+            event = await queue.get()
+            if event["event"] == "error":
+                raise RuntimeError(event["detail"])
+            if event["event"] == "chunks":
+                total = event["total"]
+            else:
+                done += 1
+            yield event
+    finally:
+        # Cliente desconectado o error: no seguir ocupando huecos del planificador
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+async def _condense(notes: list, model: str, user: str, keep_alive: str) -> list:
+    """Reducción en árbol: combina notas por grupos hasta que todas quepan en un solo contexto."""
+    while len(notes) > 1 and sum(ollama.estimate_tokens(n) for n in notes) > CHUNK_TOKENS:
+        groups, current, used = [], [], 0
+        for note in notes:
+            cost = ollama.estimate_tokens(note)
+            if len(current) >= 2 and used + cost > CHUNK_TOKENS:
+                groups.append(current)
+                current, used = [], 0
+            current.append(note)
+            used += cost
+        groups.append(current)
+        notes = await asyncio.gather(*(
+            ollama.generate(
+                model, _reduce_prompt(group, None, partial=True), user=user, keep_alive=keep_alive,
+                options=OPTIONS, max_active=ANALYZE_MAP_PARALLEL,
+            )
+            for group in groups
+        ))
+    return notes
+
+async def _stream(model: str, prompt: str, user: str, keep_alive: str):
+    payload = {"model": model, "prompt": prompt, "stream": True, "keep_alive": keep_alive, "options": OPTIONS}
+    async with scheduler.slot(user, model):
+        async with ollama.stream("/api/generate", payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    metrics.record_generation(model, data)
+
+async def run(path: str, sha256: str, model: str, query=None, user: str = scheduler.SYSTEM_USER):
+    """Analiza el PDF en `path` (se borra al terminar). Genera eventos: start, chunks (total de fragmentos),
+    chunk (resultado parcial de cada fragmento), delta (texto de la respuesta final) y done."""
+    try:
+        keep_alive = residency.keep_alive(model)
+        cached = await asyncio.to_thread(pdf_cache.get, sha256)
+        pages = len(cached) if cached is not None else await _in_process(count_pages, path)
+        chunks = _chunks(path, sha256, pages, cached)
+        first = await anext(chunks, None)
+        if first is None:
+            raise ValueError("No se pudo extraer texto del PDF (puede ser una imagen)")
+        second = await anext(chunks, None)
+        yield {"event": "start", "pages": pages, "cached": cached is not None}
+
+        if second is None:
+            # Documento corto: una sola llamada con el texto completo
+            prompt = _single_prompt(first[2], query)
+        else:
+            async def all_chunks():
+                yield first
+                yield second
+                async for chunk in chunks:
+                    yield chunk
+
+            notes = {}
+            async with aclosing(_map_chunks(all_chunks(), model, query, user, keep_alive)) as events:
+                async for event in events:
+                    if event["event"] == "chunk" and not (query and event["result"].startswith(NO_INFO)):
+                        start, end = event["pages"]
+                        notes[event["index"]] = f"[Páginas {start}-{end}]\n{event['result']}"
+                    yield event
+
+            if not notes:
+                result = "No se encontró información sobre la pregunta en el documento."
+                yield {"event": "delta", "text": result}
+                yield {"event": "done", "result": result}
+                return
+            condensed = await _condense([notes[i] for i in sorted(notes)], model, user, keep_alive)
+            prompt = _reduce_prompt(condensed, query, partial=False)
+
+        result = ""
+        async with aclosing(_stream(model, prompt, user, keep_alive)) as tokens:
+            async for text in tokens:
+                result += text
+                yield {"event": "delta", "text": text}
+        yield {"event": "done", "result": result}
+    finally:
+        os.unlink(path)
+
+async def collect(events) -> dict:
+    """Consume los eventos restantes y devuelve el resultado final (modo no-streaming)."""
+    chunks = 1
+    async with aclosing(events):
+        async for event in events:
+            if event["event"] == "chunks":
+                chunks = event["total"]
+            elif event["event"] == "done":
+                return {"result": event["result"], "chunks": chunks}
+    return {"result": "", "chunks": chunks}
+
+async def ndjson(start: dict, events):
+    """El evento inicial y los restantes como NDJSON (una línea por evento). Un fallo a mitad se informa con un evento error."""
+    yield json.dumps(start, ensure_ascii=False) + "\n"
+    try:
+        async with aclosing(events):
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+    except Exception as e:
+        yield json.dumps({"event": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
@@ -0,0 +1,75 @@
+# attachments.py
+# Archivos de /context adjuntos a un mensaje del chat. El cliente envía solo rutas (y rangos opcionales);
+# la API lee los archivos, los empaqueta en el prompt dentro de un presupuesto de tokens y guarda cada
+# contenido una sola vez en content_blobs, direccionado por su SHA-256. El mensaje guarda las referencias
+# (ruta, rango y hash), no una copia del código, así que adjuntar el mismo archivo en cada turno no hace
+# crecer la base de datos.
+
+import hashlib
+from sqlalchemy.dialects.postgresql import insert
+
+import files
+import ollama
+from database import ContentBlob
+
+ATTACHMENTS_MAX_FILES = 50
+# Por debajo de estos tokens libres no se adjunta un archivo recortado
+MIN_PART_TOKENS = 50
+KNOWN_BLOBS_MAX = 10000
+
+_known = set() # Hashes ya guardados en content_blobs por este proceso
+
+def _label(record: dict) -> str:
+    if "start_line" in record:
+        return f"{record['path']} (líneas {record['start_line']}-{record['end_line']})"
+    if "start_byte" in record and (record["start_byte"] > 0 or record["end_byte"] < record["size"]):
+        return f"{record['path']} (bytes {record['start_byte']}-{record['end_byte']})"
+    return record["path"]
+
+async def resolve(specs: list, token_budget: int) -> tuple:
+    """Lee los adjuntos y los empaqueta en orden hasta agotar el presupuesto.
+    Devuelve (contexto para el prompt, referencias para el mensaje, {sha256: contenido})."""
+    # Un hash conocido del cliente no aplica aquí: siempre hace falta el contenido
+    records = await files.read_all([{**spec, "if_none_match": None} for spec in specs], files.FILES_INLINE_MAX_BYTES)
+    parts, refs, blobs, used = [], [], {}, 0
+    for record in records:
+        if "error" in record:
+            refs.append({"path": record["path"], "error": record["error"]})
+            continue
+        content = record["content"].replace('\x00', '')
+        free = token_budget - used - ollama.estimate_tokens(f"--- Archivo: {_label(record)} ---")
+        if free < MIN_PART_TOKENS:
+            refs.append({"path": record["path"], "error": "Sin espacio en el presupuesto de tokens"})
+            continue
+        if ollama.estimate_tokens(content) > free:
+            # Recorte por caracteres (~4 por token) para completar el presupuesto; el rango pasa a ser el adjuntado
+            content = content[:free * 4]
+            record["truncated"] = True
+            if "start_line" in record:
+                record["end_line"] = record["start_line"] + content.rstrip("\n").count("\n")
+            else:
+                record["end_byte"] = record["start_byte"] + len(content.encode("utf-8"))
+        header = f"--- Archivo: {_label(record)} ---"
+        sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        blobs[sha256] = content
+        ref = {k: record[k] for k in ("path", "start_byte", "end_byte", "start_line", "end_line", "truncated") if k in record}
+        refs.append({**ref, "sha256": sha256})
+        parts.append(f"{header}\n{content}")
+        used += ollama.estimate_tokens(parts[-1])
+    context = "Contexto de archivos adjuntos:\n" + "\n\n".join(parts) if parts else ""
+    return context, refs, blobs
+
+async def store(db, blobs: dict):
+    """Guarda los contenidos que aún no están en content_blobs (los repetidos no se escriben)."""
+    new = {sha256: content for sha256, content in blobs.items() if sha256 not in _known}
+    if not new:
+        return
+    await db.execute(
+        insert(ContentBlob)
+        .values([{"sha256": sha256, "content": content, "size": len(content.encode("utf-8"))} for sha256, content in new.items()])
+        .on_conflict_do_nothing(index_elements=["sha256"])
+    )
+    await db.commit()
+    if len(_known) >= KNOWN_BLOBS_MAX:
+        _known.clear()
+    _known.update(new)
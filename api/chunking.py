@@ -0,0 +1,146 @@
+# chunking.py
+# División de documentos en fragmentos acotados con offsets estables (bytes y líneas) sobre el contenido original.
+# El código se corta en límites de funciones/clases; la prosa y los PDFs, en párrafos.
+
+import os
+import re
+from dataclasses import dataclass
+
+# Tamaño máximo de un fragmento en caracteres y solapamiento entre fragmentos de prosa
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 150))
+
+CODE_EXTENSIONS = {'.py', '.js', '.ts', '.sh', '.sql', '.css', '.html', '.go', '.rs', '.java'}
+
+# Líneas (sin indentar) que abren una definición de primer nivel
+_CODE_BOUNDARY = re.compile(
+    r"^(?:"
+    r"(?:async\s+)?def\s|class\s"                                             # Python
+    r"|(?:export\s+)?(?:default\s+)?(?:async\s+)?function[\s*]"                # JS/TS
+    r"|(?:export\s+)?(?:abstract\s+)?class\s|(?:export\s+)?(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:\(|function)"
+    r"|func\s|fn\s|pub\s+fn\s|impl\s|(?:public|private|protected)\s"          # Go/Rust/Java
+    r"|CREATE\s|\w[\w-]*\s*\(\)\s*\{"                                          # SQL / funciones de shell
+    r")",
+    re.IGNORECASE,
+)
+# Prefijos de decoradores y comentarios que se quedan con la definición que sigue
+_ATTACHED_PREFIXES = ("@", "#", "//", "/*", "*", "--")
+
+@dataclass
+class Chunk:
+    text: str
+    start_byte: int # Offset UTF-8 dentro del contenido de la página (inclusivo)
+    end_byte: int   # (exclusivo)
+    start_line: int # 1-based, inclusivo
+    end_line: int
+
+def _is_code(filename: str) -> bool:
+    name = (filename or "").lower()
+    return os.path.splitext(name)[1] in CODE_EXTENSIONS or os.path.basename(name) in {'dockerfile', 'makefile'}
+
+def _segments(lines: list, code: bool, starts: list) -> list:
+    """Bloques [inicio, fin) de líneas: definiciones de primer nivel para código, párrafos para prosa.
+    Solo se corta donde empieza una línea real (`starts`), no en los trozos de una línea partida."""
+    bounds = [0]
+    for i in range(1, len(lines)):
+        if not starts[i]:
+            continue
+        if code:
+            if _CODE_BOUNDARY.match(lines[i]):
+                # Retroceder sobre decoradores/comentarios pegados a la definición
+                j = i
+                while j - 1 > bounds[-1] and lines[j - 1].startswith(_ATTACHED_PREFIXES):
+                    j -= 1
+                bounds.append(j)
+        elif lines[i - 1].strip() == "" and lines[i].strip() != "":
+            bounds.append(i)
+    bounds.append(len(lines))
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+def _size(lines: list, start: int, end: int) -> int:
+    return sum(len(line) for line in lines[start:end])
+
+def _windows(lines: list, start: int, end: int, size: int, overlap: int) -> list:
+    """Parte un bloque demasiado grande en ventanas de líneas que solapan ~overlap caracteres."""
+    windows = []
+    while start < end:
+        stop, used = start, 0
+        while stop < end and (stop == start or used + len(lines[stop]) <= size):
+            used += len(lines[stop])
+            stop += 1
+        windows.append((start, stop))
+        if stop >= end:
+            break
+        back, carried = stop, 0
+        while back - 1 > start and carried + len(lines[back - 1]) <= overlap:
+            back -= 1
+            carried += len(lines[back])
+        start = back
+    return windows
+
+def _split_lines(content: str) -> list:
+    # Solo "\n" termina una línea (como en los editores y en los rangos de /files/content:batch);
+    # splitlines también corta en \x0c, \x1c-\x1e, \x85 y \u2028 y desfasaría los números de línea
+    lines = [line + "\n" for line in content.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+def _split_long_lines(lines: list, size: int) -> tuple:
+    """Parte las líneas de más de `size` caracteres (JS minificado, JSON, páginas de PDF sin saltos) en
+    trozos de `size` caracteres. Devuelve (trozos, número de línea de cada trozo, si empieza una línea)."""
+    pieces, numbers, starts = [], [], []
+    for number, line in enumerate(lines, 1):
+        for offset in range(0, len(line), size):
+            pieces.append(line[offset:offset + size])
+            numbers.append(number)
+            starts.append(offset == 0)
+    return pieces, numbers, starts
+
+def chunk_document(content: str, filename: str = "", size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list:
+    # Se trabaja con trozos de como mucho `size` caracteres: concatenados siguen siendo el contenido
+    # original, así que los offsets en bytes no cambian, y cada fragmento queda acotado
+    lines, line_numbers, starts = _split_long_lines(_split_lines(content), size)
+    if not lines:
+        return []
+    code = _is_code(filename)
+
+    # Agrupar bloques consecutivos hasta llenar el tamaño máximo
+    spans = []
+    current = None
+    for a, b in _segments(lines, code, starts):
+        if _size(lines, a, b) > size:
+            if current:
+                spans.append(current)
+                current = None
+            spans.extend(_windows(lines, a, b, size, overlap))
+        elif current and _size(lines, current[0], b) <= size:
+            current = (current[0], b)
+        else:
+            if current:
+                spans.append(current)
+            current = (a, b)
+    if current:
+        spans.append(current)
+
+    if not code and overlap:
+        # En prosa, cada fragmento arrastra el final del anterior para no perder contexto entre párrafos
+        overlapped = [spans[0]]
+        for (prev_start, _), (a, b) in zip(spans, spans[1:]):
+            back, carried = a, 0
+            while back - 1 > prev_start and carried + len(lines[back - 1]) <= overlap:
+                back -= 1
+                carried += len(lines[back])
+            overlapped.append((back, b))
+        spans = overlapped
+
+    # Offsets en bytes UTF-8 de cada inicio de trozo (al partir por caracteres nunca se corta un carácter)
+    line_bytes = [0]
+    for line in lines:
+        line_bytes.append(line_bytes[-1] + len(line.encode("utf-8")))
+
+    chunks = []
+    for a, b in spans:
+        text = "".join(lines[a:b])
+        if text.strip():
+            chunks.append(Chunk(text=text, start_byte=line_bytes[a], end_byte=line_bytes[b], start_line=line_numbers[a], end_line=line_numbers[b - 1]))
+    return chunks
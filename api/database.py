@@ -0,0 +1,280 @@
+# database.py
+# Conexiones a PostgreSQL (síncrona y asíncrona), Redis y modelos de base de datos.
+
+import os
+import time
+import uuid
+import redis.asyncio as aioredis
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import create_engine, text, Column, Computed, Integer, BigInteger, Float, String, ForeignKey, Text, DateTime, Index
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from sqlalchemy.pool import NullPool
+from datetime import datetime
+
+import metrics
+
+# Conexión a Redis para guardar el historial de conversaciones (cliente asíncrono con pool)
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", 6379))
+redis_client = aioredis.Redis(host=redis_host, port=redis_port, db=0)
+
+# Configuración de Base de Datos (PostgreSQL)
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Pool de conexiones por motor (hay uno síncrono y otro asíncrono por proceso). DB_POOL_SIZE=0 = sin pool propio
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Segundos tras los que se reabre una conexión (evita las que cierra un firewall o el propio servidor)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Comprobar la conexión al sacarla del pool (un round-trip extra, pero sobrevive a reinicios de PostgreSQL)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# PgBouncer en modo transaction: las sentencias preparadas no pueden reutilizarse entre transacciones
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1"
+
+def _pool_options() -> dict:
+    if DB_POOL_SIZE <= 0:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, **_pool_options())
+
+# Esperar a que la base de datos esté lista
+max_retries = 30
+for i in range(max_retries):
+    try:
+        with engine.connect() as conn:
+            print("Conexión a la base de datos exitosa")
+            break
+    except Exception as e:
+        print(f"Esperando a la base de datos... intento {i+1}/{max_retries}")
+        time.sleep(2)
+else:
+    raise Exception("No se pudo conectar a la base de datos después de varios intentos")
+
+# Extensión pgvector para las búsquedas semánticas (requiere la imagen pgvector/pgvector)
+with engine.begin() as conn:
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Motor asíncrono (asyncpg) para el camino caliente del chat: no ocupa hilos del threadpool
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+if DB_PGBOUNCER:
+    # Sin caché de sentencias preparadas y con nombres únicos, como pide PgBouncer en modo transaction
+    _async_connect_args = {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+    }
+else:
+    # asyncpg prepara cada consulta una vez por conexión y reutiliza el plan (búsqueda de usuario, sesiones...)
+    _async_connect_args = {}
+async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=_async_connect_args, **_pool_options())
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+# Tiempo de SQL y Redis por petición (métricas y cabecera Server-Timing) y ocupación de los pools
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+metrics.instrument_redis(redis_client)
+metrics.instrument_pool("sync", engine.pool, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+metrics.instrument_pool("async", async_engine.pool, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+Base = declarative_base()
+
+# --- Modelos de Base de Datos ---
+class UserDB(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, unique=True, index=True)
+    hashed_password = Column(String)
+    sessions = relationship("ChatSession", back_populates="owner")
+
+class ChatSession(Base):
+    __tablename__ = "sessions"
+    id = Column(String, primary_key=True, index=True) # UUID
+    user_id = Column(Integer, ForeignKey("users.id"))
+    description = Column(String)
+    # Resumen acumulado de los mensajes más antiguos y cuántos mensajes (por orden de id) cubre
+    summary = Column(Text)
+    summarized_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    owner = relationship("UserDB", back_populates="sessions")
+    messages = relationship("ChatMessage", back_populates="session")
+
+    __table_args__ = (
+        # Listado paginado de sesiones por usuario (keyset sobre created_at)
+        Index("ix_sessions_user_created", "user_id", "created_at"),
+    )
+
+class ChatMessage(Base):
+    __tablename__ = "messages"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, ForeignKey("sessions.id"))
+    role = Column(String) # user / assistant
+    content = Column(Text)
+    # Id de la entrada en el stream de Redis del log write-behind (evita duplicados al reprocesar)
+    log_id = Column(String)
+    # Archivos adjuntos: [{path, rango, sha256}]; el contenido está en content_blobs (una copia por hash)
+    attachments = Column(JSONB)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    session = relationship("ChatSession", back_populates="messages")
+
+    __table_args__ = (
+        Index("ix_messages_log_id", "log_id", unique=True),
+        # Historial paginado por sesión (keyset sobre created_at)
+        Index("ix_messages_session_created", "session_id", "created_at"),
+    )
+
+class ContentBlob(Base):
+    __tablename__ = "content_blobs"
+    sha256 = Column(String, primary_key=True) # SHA-256 del contenido
+    content = Column(Text)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Vector de búsqueda de texto completo: el corpus mezcla español e inglés, así que se indexan ambos stemmings
+_SEARCH_VECTOR_TEMPLATE = "to_tsvector('spanish', {text}) || to_tsvector('english', {text})"
+SEARCH_VECTOR_SQL = _SEARCH_VECTOR_TEMPLATE.format(text="coalesce(content, '')")
+# Caracteres de cada página que entran en su vector. PostgreSQL rechaza un tsvector de más de 1 MB y con él
+# el INSERT de la página (package-lock.json, un PDF enorme); con 100.000 caracteres ni cuatro bytes por
+# carácter en los dos idiomas llegan al límite. Los fragmentos ya están acotados y se indexan enteros
+SEARCH_TEXT_MAX_CHARS = 100000
+PAGE_SEARCH_VECTOR_SQL = _SEARCH_VECTOR_TEMPLATE.format(text=f"left(coalesce(content, ''), {SEARCH_TEXT_MAX_CHARS})")
+
+class KnowledgePage(Base):
+    __tablename__ = "knowledge_pages"
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, index=True)
+    s3_key = Column(String, index=True)
+    page_number = Column(Integer)
+    content = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Columna generada por PostgreSQL; diferida para no cargarla en cada consulta
+    search_vector = deferred(Column(TSVECTOR, Computed(PAGE_SEARCH_VECTOR_SQL, persisted=True)))
+    chunks = relationship("KnowledgeChunk", back_populates="page", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_knowledge_pages_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+# Dimensión de los embeddings: debe coincidir con EMBED_MODEL (nomic-embed-text = 768)
+EMBED_DIM = int(os.getenv("EMBED_DIM", 768))
+
+class KnowledgeChunk(Base):
+    __tablename__ = "knowledge_chunks"
+    id = Column(Integer, primary_key=True, index=True)
+    page_id = Column(Integer, ForeignKey("knowledge_pages.id", ondelete="CASCADE"), index=True)
+    chunk_index = Column(Integer)
+    content = Column(Text)
+    # Posición exacta del fragmento dentro de KnowledgePage.content (para citas)
+    start_byte = Column(Integer)
+    end_byte = Column(Integer)
+    start_line = Column(Integer)
+    end_line = Column(Integer)
+    embedding = Column(Vector(EMBED_DIM))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True)))
+    page = relationship("KnowledgePage", back_populates="chunks")
+
+    __table_args__ = (
+        Index("ix_knowledge_chunks_search_vector", "search_vector", postgresql_using="gin"),
+        # Índice HNSW con distancia coseno: top-k sin recorrer toda la tabla
+        Index(
+            "ix_knowledge_chunks_embedding_hnsw", embedding,
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id = Column(String, primary_key=True, index=True) # UUID
+    source = Column(String, index=True) # ej: "s3://bucket"
+    status = Column(String) # running / finished / failed / interrupted
+    # Última clave (orden lexicográfico de S3) hasta la que todo está procesado; desde aquí se reanuda
+    checkpoint = Column(String)
+    listed = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    pages = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    removed = Column(Integer, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DocumentManifest(Base):
+    # Última versión indexada de cada documento fuente: permite re-sincronizar solo lo que cambió
+    __tablename__ = "document_manifest"
+    source_key = Column(String, primary_key=True) # Igual a KnowledgePage.s3_key: "s3://bucket/clave" / "local/ruta"
+    source = Column(String, index=True) # "s3://bucket" / "local"
+    etag = Column(String)
+    mtime = Column(Float)
+    size = Column(BigInteger)
+    content_hash = Column(String) # SHA-256 del archivo
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Crear tablas
+Base.metadata.create_all(bind=engine)
+
+# Migraciones idempotentes para bases existentes (create_all no altera tablas ya creadas)
+MIGRATIONS = [
+    # El vector de las páginas pasó a indexar solo los primeros SEARCH_TEXT_MAX_CHARS caracteres. PostgreSQL 15
+    # no puede cambiar la expresión de una columna generada: se borra (con su índice) y se vuelve a crear abajo
+    "DO $$ BEGIN IF EXISTS ("
+    "SELECT 1 FROM pg_attrdef d JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum "
+    "WHERE d.adrelid = 'knowledge_pages'::regclass AND a.attname = 'search_vector' "
+    f"AND pg_get_expr(d.adbin, d.adrelid) NOT LIKE '%left%, {SEARCH_TEXT_MAX_CHARS})%'"
+    ") THEN ALTER TABLE knowledge_pages DROP COLUMN search_vector; END IF; END $$",
+    # Al añadir la columna generada, PostgreSQL calcula el vector de todas las filas existentes
+    f"ALTER TABLE knowledge_pages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({PAGE_SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_pages_search_vector ON knowledge_pages USING gin (search_vector)",
+    f"ALTER TABLE knowledge_chunks ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_chunks_search_vector ON knowledge_chunks USING gin (search_vector)",
+    "ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS removed INTEGER DEFAULT 0",
+    # Fragmentos con rango de bytes/líneas; los antiguos (sin rango) se re-fragmentan en el próximo job de embeddings
+    "ALTER TABLE knowledge_chunks ADD COLUMN IF NOT EXISTS start_byte INTEGER",
+    "ALTER TABLE knowledge_chunks ADD COLUMN IF NOT EXISTS end_byte INTEGER",
+    "ALTER TABLE knowledge_chunks ADD COLUMN IF NOT EXISTS start_line INTEGER",
+    "ALTER TABLE knowledge_chunks ADD COLUMN IF NOT EXISTS end_line INTEGER",
+    "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS summarized_count INTEGER DEFAULT 0",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS log_id VARCHAR",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_messages_log_id ON messages (log_id)",
+    "CREATE INDEX IF NOT EXISTS ix_sessions_user_created ON sessions (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_session_created ON messages (session_id, created_at)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachments JSONB",
+    # Claves de S3 con el bucket (antes la clave sola: dos buckets con la misma clave se pisaban)
+    "UPDATE knowledge_pages p SET s3_key = m.source || '/' || m.source_key FROM document_manifest m "
+    "WHERE p.s3_key = m.source_key AND m.source LIKE 's3://%' AND m.source_key NOT LIKE 's3://%'",
+    "UPDATE document_manifest SET source_key = source || '/' || source_key WHERE source LIKE 's3://%' AND source_key NOT LIKE 's3://%'",
+]
+with engine.begin() as conn:
+    for migration in MIGRATIONS:
+        conn.execute(text(migration))
+    # Jobs de ingesta que quedaron a medias por un reinicio: se reanudan en la próxima sincronización
+    conn.execute(text("UPDATE ingest_jobs SET status = 'interrupted' WHERE status = 'running'"))
+
+# Dependencia para obtener sesión de DB
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependencia para obtener sesión asíncrona de DB
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,130 @@
+# files.py
+# Lectura en lote de archivos de /context: el cliente pide muchas rutas (cada una con un rango de bytes
+# o de líneas opcional) en una sola petición, se leen en paralelo en el threadpool y se devuelven como
+# NDJSON a medida que terminan. Cada registro lleva tamaño, mtime y SHA-256 del archivo completo; si el
+# cliente envía el hash que ya tiene y no ha cambiado, se responde sin contenido.
+
+import os
+import json
+import stat
+import asyncio
+import hashlib
+import threading
+from typing import Optional
+
+import ingest
+
+# Archivos que se leen a la vez en una petición
+FILES_BATCH_CONCURRENCY = int(os.getenv("FILES_BATCH_CONCURRENCY", 8))
+FILES_BATCH_MAX_FILES = 500
+# Bytes de contenido por archivo en la respuesta; para más, GET /file/raw con cabecera Range
+FILES_INLINE_MAX_BYTES = int(os.getenv("FILES_INLINE_MAX_BYTES", 256 * 1024))
+# Archivos mayores no se hashean (el cliente puede comparar tamaño y mtime)
+HASH_MAX_BYTES = 64 * 1024 * 1024
+HASH_CACHE_MAX = 20000
+
+_hashes = {} # ruta -> (tamaño, mtime_ns, sha256)
+_lock = threading.Lock()
+
+def safe_path(path: str) -> Optional[str]:
+    """Ruta absoluta dentro de /context, o None si sale del contexto del proyecto."""
+    base_path = ingest.LOCAL_CONTEXT_PATH
+    resolved = os.path.normpath(os.path.join(base_path, path))
+    if resolved != base_path and not resolved.startswith(base_path + os.sep):
+        return None
+    return resolved
+
+def file_hash(path: str, st: os.stat_result) -> Optional[str]:
+    """SHA-256 del archivo completo, cacheado mientras no cambien tamaño ni mtime."""
+    if st.st_size > HASH_MAX_BYTES:
+        return None
+    cached = _hashes.get(path)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    with _lock:
+        if len(_hashes) >= HASH_CACHE_MAX:
+            _hashes.clear()
+        _hashes[path] = (st.st_size, st.st_mtime_ns, digest.hexdigest())
+    return digest.hexdigest()
+
+def _read_bytes(f, size: int, start: Optional[int], end: Optional[int], limit: int) -> tuple:
+    start = max(0, min(start or 0, size))
+    end = size if end is None else max(start, min(end, size))
+    f.seek(start)
+    data = f.read(min(end - start, limit))
+    return data, {"start_byte": start, "end_byte": start + len(data)}, start + len(data) < end
+
+def _read_lines(f, start: Optional[int], end: Optional[int], limit: int) -> tuple:
+    # Líneas numeradas desde 1, `end_line` incluida
+    start = max(1, start or 1)
+    parts, used, number, truncated = [], 0, 0, False
+    for number, line in enumerate(f, 1):
+        if number < start:
+            continue
+        if end is not None and number > end:
+            number -= 1
+            break
+        if used + len(line) > limit:
+            parts.append(line[:limit - used])
+            truncated = True
+            break
+        parts.append(line)
+        used += len(line)
+    return b"".join(parts), {"start_line": start, "end_line": max(number, start - 1)}, truncated
+
+def read_one(spec: dict, max_bytes: int) -> dict:
+    """Registro de un archivo: metadatos y el rango pedido (o `unchanged` si el hash coincide). Bloqueante."""
+    path = safe_path(spec["path"])
+    if path is None:
+        return {"path": spec["path"], "error": "Acceso denegado: Ruta fuera del contexto del proyecto"}
+    try:
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            return {"path": spec["path"], "error": "La ruta no es un archivo"}
+        record = {"path": spec["path"], "size": st.st_size, "mtime": int(st.st_mtime), "sha256": file_hash(path, st)}
+        if spec.get("if_none_match") and spec["if_none_match"] == record["sha256"]:
+            record["unchanged"] = True
+            return record
+        limit = max(0, min(max_bytes, FILES_INLINE_MAX_BYTES))
+        with open(path, "rb") as f:
+            if spec.get("start_line") is not None or spec.get("end_line") is not None:
+                data, span, truncated = _read_lines(f, spec.get("start_line"), spec.get("end_line"), limit)
+            else:
+                data, span, truncated = _read_bytes(f, st.st_size, spec.get("start_byte"), spec.get("end_byte"), limit)
+    except FileNotFoundError:
+        return {"path": spec["path"], "error": "Archivo no encontrado"}
+    except Exception as e:
+        return {"path": spec["path"], "error": f"Error leyendo archivo: {str(e)}"}
+    # Un corte a mitad de un carácter multibyte se descarta al decodificar
+    record.update(span, truncated=truncated, content=data.decode("utf-8", errors="ignore"))
+    return record
+
+def _reader(max_bytes: int):
+    limit = asyncio.Semaphore(FILES_BATCH_CONCURRENCY)
+
+    async def one(index, spec):
+        async with limit:
+            record = await asyncio.to_thread(read_one, spec, max_bytes)
+        return {"index": index, **record}
+    return one
+
+async def read_all(specs: list, max_bytes: int) -> list:
+    """Registros de todos los archivos, en el orden de la petición."""
+    one = _reader(max_bytes)
+    return await asyncio.gather(*(one(i, spec) for i, spec in enumerate(specs)))
+
+async def read_batch(specs: list, max_bytes: int):
+    """Un registro NDJSON por archivo en orden de finalización; `index` indica su posición en la petición."""
+    one = _reader(max_bytes)
+    tasks = [asyncio.create_task(one(i, spec)) for i, spec in enumerate(specs)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield json.dumps(await task, ensure_ascii=False) + "\n"
+    finally:
+        # Cliente desconectado: no empezar las lecturas pendientes
+        for task in tasks:
+            task.cancel()
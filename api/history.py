@@ -0,0 +1,177 @@
+# history.py
+# Historial de conversación en el servidor: los mensajes se envían a /api/chat como una ventana
+# deslizante dentro de un presupuesto de tokens y lo que queda fuera se condensa en un resumen acumulado.
+
+import os
+import json
+import asyncio
+from redis.exceptions import WatchError
+from sqlalchemy import select, func, update, or_
+
+import ollama
+from database import redis_client, AsyncSessionLocal, ChatSession, ChatMessage
+
+# Tokens aproximados de historial que se envían al modelo en cada turno (sin contar el prompt ni el contexto RAG)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+# Vida de la ventana cacheada en Redis; al expirar se reconstruye desde la base de datos
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", 86400))
+# Modelo para los resúmenes. Vacío = usar el mismo modelo del chat.
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "")
+# Máximo de mensajes sin resumir que se cargan desde la base de datos (sesiones antiguas muy largas)
+HISTORY_LOAD_LIMIT = 200
+# Caracteres por mensaje que entran en el prompt del resumen
+SUMMARY_MESSAGE_CHARS = 2000
+
+_summarizing = set()
+_tasks = set()
+
+def _key(session_id: str) -> str:
+    return f"session:{session_id}:history"
+
+async def _save(session_id: str, state: dict):
+    await redis_client.set(_key(session_id), json.dumps(state), ex=HISTORY_CACHE_TTL)
+
+async def _update(session_id: str, change) -> dict:
+    """Aplica `change(estado cacheado o None)` con compare-and-set (WATCH/MULTI): si otra petición o el
+    resumen escriben el estado entre la lectura y la escritura, se vuelve a aplicar sobre el nuevo.
+    Si `change` devuelve None no se escribe nada."""
+    key = _key(session_id)
+    async with redis_client.pipeline() as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                cached = await pipe.get(key)
+                state = change(json.loads(cached) if cached else None)
+                if state is None:
+                    await pipe.reset()
+                    return None
+                pipe.multi()
+                pipe.set(key, json.dumps(state), ex=HISTORY_CACHE_TTL)
+                await pipe.execute()
+                return state
+            except WatchError:
+                continue
+
+async def _load_from_db(db, session_id: str) -> dict:
+    session = await db.get(ChatSession, session_id)
+    summary = session.summary if session else None
+    summarized = (session.summarized_count or 0) if session else 0
+    total = (await db.execute(
+        select(func.count()).select_from(ChatMessage).where(ChatMessage.session_id == session_id)
+    )).scalar()
+    # Lo que no se alcanza a cargar se da por resumido (queda fuera de la ventana igualmente)
+    summarized = max(summarized, total - HISTORY_LOAD_LIMIT)
+    rows = (await db.execute(
+        select(ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.id)
+        .offset(summarized)
+    )).all()
+    return {
+        "summary": summary,
+        "summarized_count": summarized,
+        "messages": [{"role": role, "content": content} for role, content in rows],
+    }
+
+def empty() -> dict:
+    """Estado de una sesión nueva (sin consultar Redis ni la base de datos)."""
+    return {"summary": None, "summarized_count": 0, "messages": []}
+
+async def load(db, session_id: str) -> dict:
+    """Estado del historial (resumen + mensajes sin resumir). Debe llamarse antes de guardar el mensaje nuevo."""
+    cached = await redis_client.get(_key(session_id))
+    if cached:
+        return json.loads(cached)
+    state = await _load_from_db(db, session_id)
+    await _save(session_id, state)
+    # Contexto opaco de /api/generate que usaban las versiones anteriores
+    await redis_client.delete(f"session:{session_id}:context")
+    return state
+
+def _window(messages: list, budget: int) -> int:
+    """Índice desde el que los mensajes más recientes caben en el presupuesto."""
+    start, used = len(messages), 0
+    while start > 0:
+        cost = ollama.estimate_tokens(messages[start - 1]["content"])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+def context_messages(state: dict) -> list:
+    """Lo que el modelo ve de la conversación: resumen como system y ventana reciente."""
+    messages = []
+    if state.get("summary"):
+        messages.append({"role": "system", "content": f"Resumen de la conversación hasta ahora:\n{state['summary']}"})
+    recent = state["messages"][_window(state["messages"], HISTORY_TOKEN_BUDGET):]
+    messages.extend({"role": m["role"], "content": m["content"]} for m in recent)
+    return messages
+
+def build_messages(state: dict, prompt: str) -> list:
+    """Mensajes para /api/chat: resumen, ventana reciente y el prompt actual."""
+    return context_messages(state) + [{"role": "user", "content": prompt}]
+
+async def record_turn(session_id: str, state: dict, prompt: str, response: str, model: str):
+    """Añade el turno a la ventana cacheada y, si se pasa del presupuesto, resume en segundo plano.
+    `state` es el que se cargó al empezar la petición; el turno se añade al estado actual de Redis, que
+    pudo cambiar mientras se generaba la respuesta (un resumen terminado u otro turno)."""
+    turn = [{"role": "user", "content": prompt}, {"role": "assistant", "content": response}]
+
+    def append(current):
+        current = current or {**state, "messages": list(state["messages"])}
+        current["messages"].extend(turn)
+        return current
+    state = await _update(session_id, append)
+    if _window(state["messages"], HISTORY_TOKEN_BUDGET) > 0 and session_id not in _summarizing:
+        _summarizing.add(session_id)
+        task = asyncio.create_task(_summarize(session_id, SUMMARY_MODEL or model))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+async def _summarize(session_id: str, model: str):
+    try:
+        async with AsyncSessionLocal() as db:
+            state = await load(db, session_id)
+            # Se conserva la mitad del presupuesto para no tener que resumir en cada turno
+            evict = _window(state["messages"], HISTORY_TOKEN_BUDGET // 2)
+            if evict == 0:
+                return
+            transcript = "\n".join(
+                f"{m['role']}: {m['content'][:SUMMARY_MESSAGE_CHARS]}" for m in state["messages"][:evict]
+            )
+            prompt = (
+                "Actualiza el resumen de una conversación entre un usuario y un asistente. "
+                "Conserva los hechos, decisiones, nombres de archivos y preguntas pendientes. "
+                "Responde solo con el resumen, en el idioma de la conversación.\n\n"
+                f"Resumen previo:\n{state.get('summary') or '(vacío)'}\n\nMensajes nuevos:\n{transcript}"
+            )
+            summary = (await ollama.generate(model, prompt)).strip()
+            if not summary:
+                return
+
+            # Durante la generación pudieron llegar turnos nuevos: solo se recortan los mensajes resumidos.
+            # Si otro proceso ya resumió (summarized_count distinto) este resumen se descarta.
+            summarized = state["summarized_count"]
+
+            def trim(current):
+                if current is None or current["summarized_count"] != summarized:
+                    return None
+                current["summary"] = summary
+                current["summarized_count"] += evict
+                current["messages"] = current["messages"][evict:]
+                return current
+            state = await _update(session_id, trim)
+            if state is None:
+                return
+            await db.execute(
+                update(ChatSession)
+                .where(ChatSession.id == session_id)
+                .where(or_(ChatSession.summarized_count.is_(None), ChatSession.summarized_count < state["summarized_count"]))
+                .values(summary=summary, summarized_count=state["summarized_count"])
+            )
+            await db.commit()
+    except Exception as e:
+        print(f"Error resumiendo la sesión {session_id}: {e}")
+    finally:
+        _summarizing.discard(session_id)
@@ -0,0 +1,372 @@
+# ingest.py
+# Ingesta de documentos: S3 en segundo plano (listado paginado, descargas en paralelo,
+# extracción de PDFs en procesos worker, lotes con checkpoint) y proyecto local.
+# Ambas fuentes usan el manifiesto de documentos para re-procesar solo lo que cambió.
+
+import os
+import uuid
+import hashlib
+import multiprocessing
+import boto3
+from anyio import from_thread
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy import insert, delete, or_
+from sqlalchemy.orm import Session
+
+import metrics
+import pdf_cache
+import retrieval
+from database import SessionLocal, IngestJob, KnowledgePage, DocumentManifest
+from pdf_extract import extract_pages
+
+S3_DOWNLOAD_WORKERS = int(os.getenv("S3_DOWNLOAD_WORKERS", 8))
+# pypdf es CPU: un proceso por núcleo para no competir con el GIL del proceso de la API
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", os.cpu_count() or 2))
+# Claves por lote: se descargan y procesan en paralelo y se confirman en una sola transacción
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 32))
+
+# Proyecto local montado en /context
+LOCAL_CONTEXT_PATH = "/context"
+LOCAL_SOURCE = "local"
+# Extensiones de archivos de código y texto a procesar
+ALLOWED_EXTENSIONS = {'.py', '.md', '.txt', '.yml', '.yaml', '.sh', '.json', '.sql', '.js', '.html', '.css', '.env.example', '.dockerfile'}
+ALLOWED_FILENAMES = {'dockerfile', 'makefile', 'requirements.txt'}
+# Directorios a ignorar para no ensuciar el contexto
+IGNORE_DIRS = {'.git', '__pycache__', 'postgres_data', 'redis_data', 'ollama_data', 'venv', 'node_modules', '.idea', '.vscode'}
+# Archivos locales confirmados por transacción
+LOCAL_BATCH_SIZE = 200
+
+_process_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn: un fork copiaría el proceso de la API con sus hilos, su event loop y sus conexiones abiertas
+        # (DB, Redis, httpx); los workers arrancan limpios e importan solo pdf_extract
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+def shutdown():
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+
+def job_status(job: IngestJob) -> dict:
+    return {
+        "job_id": job.id,
+        "source": job.source,
+        "status": job.status,
+        "listed": job.listed,
+        "processed": job.processed,
+        "skipped": job.skipped,
+        "pages": job.pages,
+        "errors": job.errors,
+        "removed": job.removed,
+        "last_error": job.last_error,
+        "checkpoint": job.checkpoint,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+def find_running_job(db: Session, source: str):
+    return db.query(IngestJob).filter(IngestJob.source == source, IngestJob.status == "running").first()
+
+def create_or_resume_job(db: Session, source: str) -> IngestJob:
+    """Reanuda el último job interrumpido/fallido de la misma fuente o crea uno nuevo."""
+    job = (
+        db.query(IngestJob)
+        .filter(IngestJob.source == source, IngestJob.status.in_(["interrupted", "failed"]))
+        .order_by(IngestJob.created_at.desc())
+        .first()
+    )
+    if job is None:
+        job = IngestJob(id=str(uuid.uuid4()), source=source, listed=0, processed=0, skipped=0, pages=0, errors=0, removed=0)
+        db.add(job)
+    job.status = "running"
+    job.last_error = None
+    job.updated_at = datetime.utcnow()
+    db.commit()
+    return job
+
+def _download(s3, bucket: str, key: str) -> tuple:
+    data = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return data, hashlib.sha256(data).hexdigest()
+
+def _replace_pages(db: Session, keys: list, rows: list):
+    # Reemplazo atómico (misma transacción): los fragmentos caen por ON DELETE CASCADE
+    if keys:
+        db.execute(delete(KnowledgePage).where(KnowledgePage.s3_key.in_(keys)))
+    if rows:
+        db.execute(insert(KnowledgePage), rows)
+
+def _remove_sources(db: Session, keys: list) -> int:
+    if not keys:
+        return 0
+    db.execute(delete(KnowledgePage).where(KnowledgePage.s3_key.in_(keys)))
+    db.execute(delete(DocumentManifest).where(DocumentManifest.source_key.in_(keys)))
+    return len(keys)
+
+def s3_key(source: str, key: str) -> str:
+    """Clave de un objeto en el manifiesto y en las páginas: incluye el bucket ("s3://bucket/clave")."""
+    return f"{source}/{key}"
+
+def _process_batch(db: Session, job: IngestJob, s3, bucket: str, objects: list, downloads: ThreadPoolExecutor):
+    keys = [s3_key(job.source, obj["Key"]) for obj in objects]
+    manifest = {m.source_key: m for m in db.query(DocumentManifest).filter(DocumentManifest.source_key.in_(keys))}
+
+    def unchanged(obj):
+        previous = manifest.get(s3_key(job.source, obj["Key"]))
+        return previous is not None and previous.etag == obj["ETag"] and previous.size == obj["Size"]
+
+    # Solo PDFs nuevos o con ETag/tamaño distintos a la última versión indexada
+    todo = [obj for obj in objects if obj["Key"].lower().endswith(".pdf") and not unchanged(obj)]
+    job.skipped += len(objects) - len(todo)
+    metrics.INGEST_DOCUMENTS.labels("s3", "unchanged").inc(len(objects) - len(todo))
+
+    # Descargas en hilos; cada PDF descargado pasa de inmediato al pool de procesos
+    parsing, extracted = {}, []
+    pending_downloads = {downloads.submit(_download, s3, bucket, obj["Key"]): obj for obj in todo}
+    for future in as_completed(pending_downloads):
+        obj = pending_downloads[future]
+        key = s3_key(job.source, obj["Key"])
+        try:
+            data, content_hash = future.result()
+        except Exception as e:
+            job.errors += 1
+            job.last_error = f"{key}: {e}"
+            metrics.INGEST_DOCUMENTS.labels("s3", "error").inc()
+            continue
+        metrics.INGEST_BYTES.labels("s3").inc(len(data))
+        entry = DocumentManifest(source_key=key, source=job.source, etag=obj["ETag"], size=obj["Size"], content_hash=content_hash, updated_at=datetime.utcnow())
+        if key in manifest and manifest[key].content_hash == content_hash:
+            # Mismo contenido con otro ETag (ej: re-subida): solo se actualiza el manifiesto
+            db.merge(entry)
+            job.skipped += 1
+            metrics.INGEST_DOCUMENTS.labels("s3", "unchanged").inc()
+            continue
+        # El mismo PDF ya extraído (en /analyze, otro bucket u otra clave) no vuelve a pasar por pypdf
+        texts = pdf_cache.get(content_hash)
+        if texts is not None:
+            extracted.append((entry, texts))
+            continue
+        parsing[get_process_pool().submit(extract_pages, data)] = entry
+
+    for future in as_completed(parsing):
+        entry = parsing[future]
+        try:
+            texts = future.result()
+        except Exception as e:
+            job.errors += 1
+            job.last_error = f"{entry.source_key}: {e}"
+            metrics.INGEST_DOCUMENTS.labels("s3", "error").inc()
+            continue
+        pdf_cache.put(entry.content_hash, texts)
+        extracted.append((entry, texts))
+
+    replaced, rows = [], []
+    for entry, texts in extracted:
+        filename = entry.source_key.rsplit('/', 1)[-1]
+        rows.extend(
+            {"filename": filename, "s3_key": entry.source_key, "page_number": i + 1, "content": text, "created_at": datetime.utcnow()}
+            for i, text in enumerate(texts) if text.strip()
+        )
+        replaced.append(entry.source_key)
+        db.merge(entry)
+        job.processed += 1
+
+    _replace_pages(db, replaced, rows)
+    job.pages += len(rows)
+    metrics.INGEST_DOCUMENTS.labels("s3", "indexed").inc(len(replaced))
+    metrics.INGEST_PAGES.labels("s3").inc(len(rows))
+    job.checkpoint = objects[-1]["Key"]
+    job.updated_at = datetime.utcnow()
+    # Páginas del lote y checkpoint en la misma transacción: un corte nunca deja el checkpoint adelantado
+    db.commit()
+
+def run_s3_job(job_id: str, aws_access_key_id: str, aws_secret_access_key: str, aws_region: str, bucket: str):
+    """Cuerpo del job (se ejecuta en un hilo del threadpool vía BackgroundTasks)."""
+    s3 = boto3.client('s3',
+                      aws_access_key_id=aws_access_key_id,
+                      aws_secret_access_key=aws_secret_access_key,
+                      region_name=aws_region)
+
+    with SessionLocal() as db:
+        job = db.get(IngestJob, job_id)
+        try:
+            params = {"Bucket": bucket}
+            full_listing = not job.checkpoint
+            if job.checkpoint:
+                params["StartAfter"] = job.checkpoint
+            seen = set()
+            with ThreadPoolExecutor(max_workers=S3_DOWNLOAD_WORKERS) as downloads:
+                batch = []
+                # El paginador sigue los ContinuationToken: no se detiene en las primeras 1.000 claves
+                for listing in s3.get_paginator("list_objects_v2").paginate(**params):
+                    for obj in listing.get("Contents", []):
+                        job.listed += 1
+                        seen.add(s3_key(job.source, obj["Key"]))
+                        batch.append(obj)
+                        if len(batch) >= INGEST_BATCH_SIZE:
+                            _process_batch(db, job, s3, bucket, batch, downloads)
+                            batch = []
+                if batch:
+                    _process_batch(db, job, s3, bucket, batch, downloads)
+
+            # Documentos borrados del bucket (solo se sabe con certeza si se listó desde el principio)
+            if full_listing:
+                indexed = db.query(DocumentManifest.source_key).filter(DocumentManifest.source == job.source).all()
+                removed = _remove_sources(db, [k for (k,) in indexed if k not in seen])
+                job.removed = (job.removed or 0) + removed
+                metrics.INGEST_DOCUMENTS.labels("s3", "removed").inc(removed)
+            job.status = "finished"
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.last_error = str(e)
+        job.updated_at = datetime.utcnow()
+        db.commit()
+
+    # Indexar las páginas nuevas para la búsqueda semántica
+    try:
+        from_thread.run(retrieval.run_embedding_job)
+    except Exception as e:
+        print(f"Error lanzando la indexación semántica: {e}")
+
+def is_indexable(filename: str) -> bool:
+    ext = os.path.splitext(filename)[1].lower()
+    return ext in ALLOWED_EXTENSIONS or filename.lower() in ALLOWED_FILENAMES
+
+def local_key(file_path: str) -> str:
+    return f"local/{os.path.relpath(file_path, LOCAL_CONTEXT_PATH)}"
+
+def is_ignored(path: str) -> bool:
+    """True si la ruta está fuera de /context o dentro de un directorio ignorado."""
+    rel_path = os.path.relpath(path, LOCAL_CONTEXT_PATH)
+    if rel_path.startswith(".."):
+        return True
+    return any(part in IGNORE_DIRS for part in rel_path.split(os.sep))
+
+def _index_local_file(db: Session, file_path: str, st: os.stat_result, previous) -> bool:
+    """Re-indexa un archivo si su contenido cambió. Devuelve True si se reemplazaron sus páginas."""
+    key = local_key(file_path)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    metrics.INGEST_BYTES.labels(LOCAL_SOURCE).inc(len(data))
+    unchanged = previous is not None and previous.content_hash == content_hash
+    db.merge(DocumentManifest(source_key=key, source=LOCAL_SOURCE, mtime=st.st_mtime, size=st.st_size, content_hash=content_hash, updated_at=datetime.utcnow()))
+    if unchanged:
+        # Solo cambió el mtime (ej: checkout de git): no hay que re-extraer
+        return False
+
+    content = data.decode('utf-8', errors='ignore').replace('\x00', '')
+    rows = []
+    if content.strip():
+        # Guardamos el archivo completo como página 1
+        rows.append({"filename": os.path.relpath(file_path, LOCAL_CONTEXT_PATH), "s3_key": key, "page_number": 1, "content": content, "created_at": datetime.utcnow()})
+    _replace_pages(db, [key], rows)
+    metrics.INGEST_PAGES.labels(LOCAL_SOURCE).inc(len(rows))
+    return True
+
+def _index_local_file_safely(db: Session, file_path: str, st: os.stat_result, previous) -> bool:
+    """_index_local_file dentro de un SAVEPOINT: si la base de datos rechaza un archivo se deshace solo
+    ese archivo y la transacción del lote sigue utilizable para los demás."""
+    with db.begin_nested():
+        return _index_local_file(db, file_path, st, previous)
+
+def _record_local(stats: dict):
+    for result, count in stats.items():
+        if result == "errors": # Se cuentan al fallar cada archivo
+            continue
+        metrics.INGEST_DOCUMENTS.labels(LOCAL_SOURCE, result).inc(count)
+
+def run_local_sync(db: Session) -> dict:
+    """Sincroniza /context contra el manifiesto: solo lee archivos cuyo mtime/tamaño cambió."""
+    manifest = {m.source_key: m for m in db.query(DocumentManifest).filter(DocumentManifest.source == LOCAL_SOURCE)}
+    seen, changed = set(), []
+    for root, dirs, files in os.walk(LOCAL_CONTEXT_PATH):
+        # Modificar dirs in-place para saltar directorios ignorados
+        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+        for file in files:
+            if not is_indexable(file):
+                continue
+            file_path = os.path.join(root, file)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            key = local_key(file_path)
+            seen.add(key)
+            previous = manifest.get(key)
+            if previous is not None and previous.mtime == st.st_mtime and previous.size == st.st_size:
+                continue
+            changed.append((file_path, st, previous))
+
+    indexed = errors = 0
+    for i in range(0, len(changed), LOCAL_BATCH_SIZE):
+        for file_path, st, previous in changed[i:i + LOCAL_BATCH_SIZE]:
+            try:
+                indexed += _index_local_file_safely(db, file_path, st, previous)
+            except Exception as e:
+                errors += 1
+                metrics.INGEST_DOCUMENTS.labels(LOCAL_SOURCE, "error").inc()
+                print(f"Error leyendo {file_path}: {e}")
+        db.commit()
+
+    # Archivos borrados: entradas del manifiesto y páginas locales antiguas (sin manifiesto) que ya no existen
+    known = set(manifest) | {k for (k,) in db.query(KnowledgePage.s3_key).filter(KnowledgePage.s3_key.like("local/%")).distinct()}
+    removed = _remove_sources(db, sorted(known - seen))
+    if removed:
+        db.commit()
+    stats = {"indexed": indexed, "unchanged": len(seen) - len(changed), "removed": removed, "errors": errors}
+    _record_local(stats)
+    return stats
+
+def index_local_paths(db: Session, paths: list) -> dict:
+    """Actualiza el índice solo para las rutas indicadas (creadas, modificadas, movidas o borradas)."""
+    files, gone = set(), set()
+    for path in paths:
+        path = os.path.normpath(path)
+        if is_ignored(path):
+            continue
+        if os.path.isdir(path):
+            # Directorio nuevo o movido dentro de /context: indexar su contenido
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+                files.update(os.path.join(root, name) for name in names if is_indexable(name))
+        elif os.path.exists(path):
+            if is_indexable(os.path.basename(path)):
+                files.add(path)
+        else:
+            gone.add(path)
+
+    indexed = errors = 0
+    if files:
+        keys = [local_key(p) for p in files]
+        manifest = {m.source_key: m for m in db.query(DocumentManifest).filter(DocumentManifest.source_key.in_(keys))}
+        for file_path in files:
+            try:
+                st = os.stat(file_path)
+                previous = manifest.get(local_key(file_path))
+                if previous is not None and previous.mtime == st.st_mtime and previous.size == st.st_size:
+                    continue
+                indexed += _index_local_file_safely(db, file_path, st, previous)
+            except Exception as e:
+                errors += 1
+                metrics.INGEST_DOCUMENTS.labels(LOCAL_SOURCE, "error").inc()
+                print(f"Error leyendo {file_path}: {e}")
+
+    removed = 0
+    for path in gone:
+        # Puede ser un archivo o un directorio completo: se quitan la clave y todo lo que cuelga de ella
+        prefix = local_key(path)
+        keys = db.query(DocumentManifest.source_key).filter(
+            DocumentManifest.source == LOCAL_SOURCE,
+            or_(DocumentManifest.source_key == prefix, DocumentManifest.source_key.startswith(prefix + "/", autoescape=True)),
+        ).all()
+        removed += _remove_sources(db, [k for (k,) in keys])
+
+    db.commit()
+    stats = {"indexed": indexed, "removed": removed, "errors": errors}
+    _record_local(stats)
+    return stats
@@ -3,97 +3,67 @@
 
 import os
 import json
-import requests
-import redis
+import math
+import anyio
+import httpx
 import shutil
+import time
 import uuid
-import io
-import boto3
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from passlib.context import CryptContext
 from typing import List, Optional
-from pypdf import PdfReader
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime
-from sqlalchemy import or_
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from datetime import datetime
-
-app = FastAPI()
-
-# Conexión a Redis para guardar el historial de conversaciones
-redis_host = os.getenv("REDIS_HOST", "redis")
-redis_port = int(os.getenv("REDIS_PORT", 6379))
-redis_client = redis.Redis(host=redis_host, port=redis_port, db=0)
-
-# Configuración de Base de Datos (PostgreSQL)
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-
-# Esperar a que la base de datos esté lista
-import time
-max_retries = 30
-for i in range(max_retries):
-    try:
-        with engine.connect() as conn:
-            print("Conexión a la base de datos exitosa")
-            break
-    except Exception as e:
-        print(f"Esperando a la base de datos... intento {i+1}/{max_retries}")
-        time.sleep(2)
-else:
-    raise Exception("No se pudo conectar a la base de datos después de varios intentos")
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# --- Modelos de Base de Datos ---
-class UserDB(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
-    hashed_password = Column(String)
-    sessions = relationship("ChatSession", back_populates="owner")
-
-class ChatSession(Base):
-    __tablename__ = "sessions"
-    id = Column(String, primary_key=True, index=True) # UUID
-    user_id = Column(Integer, ForeignKey("users.id"))
-    description = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    owner = relationship("UserDB", back_populates="sessions")
-    messages = relationship("ChatMessage", back_populates="session")
-
-class ChatMessage(Base):
-    __tablename__ = "messages"
-    id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey("sessions.id"))
-    role = Column(String) # user / assistant
-    content = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    session = relationship("ChatSession", back_populates="messages")
-
-class KnowledgePage(Base):
-    __tablename__ = "knowledge_pages"
-    id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String, index=True)
-    s3_key = Column(String, index=True)
-    page_number = Column(Integer)
-    content = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-# Crear tablas
-Base.metadata.create_all(bind=engine)
-
-# Dependencia para obtener sesión de DB
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import analyze
+import attachments
+import files
+import history
+import ingest
+import message_log
+import metrics
+import ollama
+import pagination
+import pdf_cache
+import rag
+import residency
+import response_cache
+import retrieval
+import scheduler
+import titles
+import tree
+import users
+import watcher
+from database import (
+    redis_client, get_db, get_async_db,
+    UserDB, ChatSession, ChatMessage, ContentBlob, KnowledgePage, IngestJob,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único cliente HTTP con pool para todas las llamadas a Ollama
+    await ollama.start()
+    await message_log.start()
+    await titles.start()
+    await watcher.start()
+    await residency.start()
+    yield
+    await residency.stop()
+    await watcher.stop()
+    await titles.stop()
+    await message_log.stop()
+    ingest.shutdown()
+    await ollama.close()
+    await redis_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Configuración para hashing de contraseñas
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -102,12 +72,28 @@ class User(BaseModel):
     username: str
     password: str
 
+class FileRange(BaseModel):
+    path: str
+    # Rango de bytes [start_byte, end_byte) o de líneas [start_line, end_line] (desde 1); sin rango = desde el inicio
+    start_byte: Optional[int] = Field(None, ge=0)
+    end_byte: Optional[int] = Field(None, ge=0)
+    start_line: Optional[int] = Field(None, ge=1)
+    end_line: Optional[int] = Field(None, ge=1)
+    if_none_match: Optional[str] = None # SHA-256 que ya tiene el cliente: si coincide no se reenvía el contenido
+
 class ChatRequest(BaseModel):
     username: str
     prompt: str
     model: str = "gpt-oss:20b"  # Asegúrate de tener este modelo descargado en Ollama
     session_id: Optional[str] = None # Identificador opcional
     use_kb: bool = False # Usar base de conocimiento
+    kb_k: int = Field(5, ge=1, le=50) # Máximo de fragmentos en el contexto
+    kb_token_budget: int = Field(2000, ge=100, le=32000) # Tokens aproximados reservados al contexto RAG
+    kb_rerank: bool = False # Reordenar candidatos con el cross-encoder local
+    options: Optional[dict] = None # Parámetros de muestreo de Ollama (temperature, top_p, seed...)
+    cache: bool = False # Reutilizar la respuesta de un prompt idéntico (o casi) con el mismo contexto
+    attachments: List[FileRange] = Field(default_factory=list, max_length=attachments.ATTACHMENTS_MAX_FILES) # Archivos de /context (se leen en la API)
+    attachments_token_budget: int = Field(4000, ge=100, le=32000) # Tokens aproximados reservados a los adjuntos
 
 class S3SyncRequest(BaseModel):
     aws_access_key_id: str
@@ -122,6 +108,10 @@ class FileWriteRequest(BaseModel):
 class FileMkdirRequest(BaseModel):
     path: str
 
+class FileBatchRequest(BaseModel):
+    files: List[FileRange]
+    max_bytes: int = Field(files.FILES_INLINE_MAX_BYTES, ge=0) # Bytes de contenido por archivo
+
 @app.get("/")
 def read_root():
     return {"message": "Hola, soy tu asistente de IA personal."}
@@ -138,6 +128,7 @@ def register(user: User, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    users.invalidate(user.username)
     
     return {"message": "Usuario registrado exitosamente"}
 
@@ -149,103 +140,120 @@ def login(user: User, db: Session = Depends(get_db)):
     return {"message": "Login exitoso", "username": user.username}
 
 @app.get("/sessions/{username}")
-def get_sessions(username: str, db: Session = Depends(get_db)):
-    user = db.query(UserDB).filter(UserDB.username == username).first()
-    if not user:
+async def get_sessions(username: str, http_request: Request, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    """Sesiones del usuario, de la más reciente a la más antigua. La página siguiente se pide con X-Next-Cursor."""
+    user_id = await users.get_id(db, username)
+    if user_id is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    return [
+
+    limit = pagination.page_size(limit)
+    query = (
+        select(ChatSession.id, ChatSession.description, ChatSession.created_at)
+        .where(ChatSession.user_id == user_id)
+        .order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(ChatSession.created_at, ChatSession.id) < pagination.decode_cursor(cursor))
+    rows = (await db.execute(query)).all()
+
+    page = rows[:limit]
+    next_cursor = pagination.encode_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+    return pagination.etag_response(http_request, [
         {
             "id": s.id,
-            "description": s.description or "Nueva conversación",
+            "description": s.description or titles.TITLE_PLACEHOLDER,
+            "title_ready": s.description is not None,
             "created_at": s.created_at
         }
-        for s in user.sessions
-    ]
-
-@app.post("/s3/sync")
-def sync_s3(request: S3SyncRequest, db: Session = Depends(get_db)):
-    s3 = boto3.client('s3', 
-                      aws_access_key_id=request.aws_access_key_id, 
-                      aws_secret_access_key=request.aws_secret_access_key, 
-                      region_name=request.aws_region)
-    
-    try:
-        response = s3.list_objects_v2(Bucket=request.bucket_name)
-        if 'Contents' not in response:
-            return {"message": "Bucket vacío o sin acceso"}
-            
-        count = 0
-        for obj in response['Contents']:
-            key = obj['Key']
-            # Solo procesar PDFs por ahora
-            if not key.lower().endswith('.pdf'): continue
-            
-            # Verificar si ya existe alguna página de este documento para no procesarlo de nuevo
-            if db.query(KnowledgePage).filter(KnowledgePage.s3_key == key).first():
-                continue
-                
-            # Descargar y procesar
-            file_obj = io.BytesIO()
-            s3.download_fileobj(request.bucket_name, key, file_obj)
-            file_obj.seek(0)
-            pdf = PdfReader(file_obj)
-            
-            # Procesar página por página
-            for i, page in enumerate(pdf.pages):
-                text = page.extract_text() or ""
-                if text.strip():
-                    doc = KnowledgePage(filename=key.split('/')[-1], s3_key=key, page_number=i+1, content=text)
-                    db.add(doc)
-                    count += 1
-        
-        db.commit()
-        return {"message": f"Sincronizadas {count} páginas nuevas desde S3"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error S3: {str(e)}")
+        for s in page
+    ], next_cursor)
+
+@app.get("/sessions/{session_id}/messages")
+async def get_session_messages(session_id: str, http_request: Request, limit: int = pagination.DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    """Mensajes de una sesión en orden cronológico. La primera página son los más recientes;
+    X-Next-Cursor apunta a los anteriores."""
+    limit = pagination.page_size(limit)
+    query = (
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.attachments, ChatMessage.created_at)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(ChatMessage.created_at, ChatMessage.id) < pagination.decode_cursor(cursor, int))
+    rows = (await db.execute(query)).all()
+    if not rows and not cursor and await db.get(ChatSession, session_id) is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+
+    page = rows[:limit]
+    next_cursor = pagination.encode_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+    return pagination.etag_response(http_request, [
+        {"id": m.id, "role": m.role, "content": m.content, "attachments": m.attachments, "created_at": m.created_at}
+        for m in reversed(page)
+    ], next_cursor)
+
+@app.get("/blobs/{sha256}")
+async def get_blob(sha256: str, db: AsyncSession = Depends(get_async_db)):
+    """Contenido de un adjunto guardado (referenciado por hash en los mensajes). Inmutable."""
+    blob = await db.get(ContentBlob, sha256)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Contenido no encontrado")
+    return Response(blob.content, media_type="text/plain; charset=utf-8", headers={"ETag": f'"{sha256}"', "Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.post("/s3/sync", status_code=202)
+def sync_s3(request: S3SyncRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    source = f"s3://{request.bucket_name}"
+    running = ingest.find_running_job(db, source)
+    if running:
+        raise HTTPException(status_code=409, detail=f"Ya hay una sincronización en curso para este bucket (job {running.id})")
+
+    # La ingesta corre en segundo plano; si hubo un job interrumpido se reanuda desde su checkpoint
+    job = ingest.create_or_resume_job(db, source)
+    background_tasks.add_task(
+        ingest.run_s3_job, job.id,
+        request.aws_access_key_id, request.aws_secret_access_key, request.aws_region, request.bucket_name,
+    )
+    return {"message": "Sincronización con S3 iniciada", "job_id": job.id}
+
+@app.get("/s3/sync/{job_id}")
+def sync_s3_status(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(IngestJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return ingest.job_status(job)
 
 @app.post("/local/sync")
-def sync_local(db: Session = Depends(get_db)):
-    base_path = "/context"
-    if not os.path.exists(base_path):
+def sync_local(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    if not os.path.exists(ingest.LOCAL_CONTEXT_PATH):
         raise HTTPException(status_code=404, detail="Carpeta de contexto no encontrada.")
-    
-    # Extensiones de archivos de código y texto a procesar
-    allowed_extensions = {'.py', '.md', '.txt', '.yml', '.yaml', '.sh', '.json', '.sql', '.js', '.html', '.css', '.env.example', '.dockerfile'}
-    # Directorios a ignorar para no ensuciar el contexto
-    ignore_dirs = {'.git', '__pycache__', 'postgres_data', 'redis_data', 'ollama_data', 'venv', 'node_modules', '.idea', '.vscode'}
-    
-    count = 0
-    files_processed = 0
-    
-    for root, dirs, files in os.walk(base_path):
-        # Modificar dirs in-place para saltar directorios ignorados
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
-        
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            if ext in allowed_extensions or file.lower() in ['dockerfile', 'makefile', 'requirements.txt']:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, base_path)
-                key = f"local/{rel_path}"
-                
-                # Verificar si ya existe (evitar duplicados)
-                # if db.query(KnowledgePage).filter(KnowledgePage.s3_key == key).first():
-                #     continue
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read().replace('\x00', '')
-                        if content.strip():
-                            # Guardamos el archivo completo como página 1
-                            doc = KnowledgePage(filename=rel_path, s3_key=key, page_number=1, content=content)
-                            db.add(doc)
-                            count += 1
-                            files_processed += 1
-                except Exception as e:
-                    print(f"Error leyendo {file_path}: {e}")
-    db.commit()
-    return {"message": f"Contexto del proyecto sincronizado. {files_processed} archivos de código/texto indexados."}
+
+    # Solo se re-procesan los archivos nuevos o modificados desde la última sincronización
+    stats = ingest.run_local_sync(db)
+    if stats["indexed"]:
+        background_tasks.add_task(retrieval.run_embedding_job)
+    return {
+        "message": f"Contexto del proyecto sincronizado. {stats['indexed']} archivos indexados, {stats['unchanged']} sin cambios, {stats['removed']} eliminados, {stats['errors']} con errores.",
+        **stats,
+    }
+
+@app.post("/kb/reembed")
+async def reembed_knowledge(background_tasks: BackgroundTasks, full: bool = False):
+    # full=True regenera todos los embeddings (ej: después de cambiar EMBED_MODEL)
+    if retrieval.embedding_job["status"] == "running":
+        raise HTTPException(status_code=409, detail="Ya hay una indexación en curso")
+    background_tasks.add_task(retrieval.run_embedding_job, full)
+    return {"message": "Indexación semántica iniciada"}
+
+@app.get("/kb/reembed/status")
+def reembed_status():
+    return retrieval.embedding_job
+
+@app.get("/kb/search")
+async def search_knowledge(q: str, k: int = 5, token_budget: int = 2000, rerank: bool = False):
+    # Fragmentos exactos (con rango de líneas/bytes) que el RAG usaría para esta consulta
+    passages = await rag.search(q, k, token_budget, rerank)
+    return [rag.to_dict(p) for p in passages]
 
 @app.get("/documents")
 def list_documents(db: Session = Depends(get_db)):
@@ -260,149 +268,212 @@ def view_document(filename: str, db: Session = Depends(get_db)):
     return [{"page": p.page_number, "content": p.content} for p in pages]
 
 @app.post("/chat")
-def chat(request: ChatRequest, db: Session = Depends(get_db)):
-    ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
-    
-    # Validar usuario
-    user = db.query(UserDB).filter(UserDB.username == request.username).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Usuario no encontrado")
-
+async def chat(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    request_started = time.perf_counter()
     # Generar session_id si no viene uno
     session_id = request.session_id if request.session_id else str(uuid.uuid4())
-    
-    # Verificar/Crear sesión en DB
-    db_session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    is_new_session = False
-    
-    if not db_session:
-        is_new_session = True
-        db_session = ChatSession(id=session_id, user_id=user.id)
-        db.add(db_session)
-        db.commit()
-        
-        # Generar título con IA (síncrono por simplicidad)
-        try:
-            title_prompt = f"Genera un título muy corto (máximo 5 palabras) que resuma esto: '{request.prompt}'. Solo devuelve el título, nada más."
-            title_payload = {"model": request.model, "prompt": title_prompt, "stream": False}
-            title_res = requests.post(f"{ollama_url}/api/generate", json=title_payload)
-            if title_res.status_code == 200:
-                title = title_res.json().get("response", "Nueva conversación").strip().replace('"', '')
-                db_session.description = title
-                db.commit()
-        except Exception as e:
-            print(f"Error generando título: {e}")
 
-    # Guardar mensaje del usuario en DB
-    user_msg = ChatMessage(session_id=session_id, role="user", content=request.prompt.replace('\x00', ''))
-    db.add(user_msg)
-    db.commit()
+    # Validar usuario (caché en memoria)
+    user_id = await users.get_id(db, request.username)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Usuario no encontrado")
 
-    # Recuperar el contexto si existe un session_id
-    context = None
-    cached_context = redis_client.get(f"session:{session_id}:context")
-    if cached_context:
-        context = json.loads(cached_context)
-    
-    # Lógica RAG (Búsqueda simple por palabras clave en DB)
+    # Límite de ritmo por usuario (token bucket)
+    retry_after = scheduler.take_token(request.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas peticiones seguidas. Espera unos segundos antes de volver a preguntar.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    # La sesión se crea aquí y no en el log write-behind: un segundo mensaje que llegara antes del volcado
+    # se tomaría por el primero (historial vacío, otro título). Solo una petición consigue insertarla.
+    is_new_session = (await db.execute(
+        insert(ChatSession)
+        .values(id=session_id, user_id=user_id)
+        .on_conflict_do_nothing(index_elements=["id"])
+        .returning(ChatSession.id)
+    )).scalar() is not None
+    if is_new_session:
+        await db.commit()
+
+    # Historial previo (ventana reciente + resumen); se lee antes de registrar el mensaje nuevo
+    conversation = history.empty() if is_new_session else await history.load(db, session_id)
+
+    # Archivos adjuntos: se leen y empaquetan aquí; el mensaje guarda solo las referencias por hash
+    attachment_context, attachment_refs = "", None
+    if request.attachments:
+        attachment_context, attachment_refs, blobs = await attachments.resolve(
+            [spec.model_dump() for spec in request.attachments], request.attachments_token_budget
+        )
+        await attachments.store(db, blobs)
+
+    # Mensaje del usuario al log write-behind
+    await message_log.append(session_id, "user", request.prompt, attachments=attachment_refs)
+
+    # Lógica RAG: búsqueda híbrida (texto completo + semántica) empaquetada en un presupuesto de tokens
     rag_context = ""
     if request.use_kb:
-        # Buscamos documentos que contengan palabras clave del prompt (búsqueda ingenua pero funcional sin vectores)
-        keywords = [w for w in request.prompt.split() if len(w) > 4] # Palabras > 4 letras
-        if keywords:
-            filters = [KnowledgePage.content.ilike(f"%{kw}%") for kw in keywords]
-            docs = db.query(KnowledgePage).filter(or_(*filters)).limit(5).all()
-            
-            if docs:
-                rag_context = "Instrucción: Utiliza la siguiente información de la base de conocimiento para responder. Es OBLIGATORIO que cites el documento, la ruta y la hoja (página) de donde obtuviste la información.\n\n"
-                for d in docs:
-                    rag_context += f"--- Documento: {d.filename} | Ruta: {d.s3_key} | Hoja: {d.page_number} ---\n{d.content[:2000]}...\n\n"
-
-    def generate():
+        try:
+            rag_context = await rag.build_context(request.prompt, request.kb_k, request.kb_token_budget, request.kb_rerank) or ""
+        except Exception as e:
+            print(f"Error en la búsqueda RAG: {e}")
+
+    # Adjuntos primero, luego los fragmentos recuperados
+    context = "\n\n".join(part for part in (attachment_context, rag_context) if part)
+
+    # Caché de respuestas (opt-in): mismo prompt normalizado, modelo, contexto (adjuntos y recuperado),
+    # historial de la sesión (resumen + ventana) y muestreo
+    cache_scope, cached = None, None
+    if request.cache:
+        cache_scope = response_cache.scope_key(request.model, context, request.options, history.context_messages(conversation))
+        cached = await response_cache.lookup(cache_scope, request.prompt)
+
+    async def finish(full_response: str, completed: bool, elapsed: float):
+        await message_log.append(session_id, "assistant", full_response)
+        # La ventana cacheada refleja exactamente los mensajes registrados (también los turnos fallidos)
+        await history.record_turn(session_id, conversation, request.prompt.replace('\x00', ''), full_response.replace('\x00', ''), request.model)
+
+        # Solo se cachean generaciones completas (no errores ni streams cortados)
+        if cache_scope and completed and full_response:
+            await response_cache.store(cache_scope, request.prompt, full_response, elapsed)
+
+        # El título se genera en segundo plano, después de entregar la respuesta
+        if is_new_session:
+            titles.enqueue(session_id, request.prompt, request.model)
+
+    async def generate():
         full_response = ""
+        completed = False
+        started = time.monotonic()
+        prompt = request.prompt
+        if context:
+            prompt = f"{context}\n\nPregunta del usuario: {request.prompt}"
         payload = {
             "model": request.model,
-            "prompt": request.prompt,
-            "stream": True
+            "messages": history.build_messages(conversation, prompt),
+            "stream": True,
         }
-        if context:
-            payload["context"] = context
-        
-        if rag_context:
-            payload["prompt"] = f"{rag_context}\n\nPregunta del usuario: {request.prompt}"
-            
+        if request.options:
+            payload["options"] = request.options
+
         try:
-            with requests.post(f"{ollama_url}/api/generate", json=payload, stream=True) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        json_response = json.loads(line.decode('utf-8'))
-                        if "response" in json_response:
-                            full_response += json_response["response"]
-                            yield json_response["response"]
-                        
-                        # Guardar el contexto al finalizar la respuesta
-                        if json_response.get("done"):
-                            if "context" in json_response:
-                                redis_client.set(f"session:{session_id}:context", json.dumps(json_response["context"]))
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                yield f"Error: El modelo '{request.model}' no está instalado en Ollama. Ejecuta: docker compose exec ollama ollama pull {request.model}"
-            elif e.response.status_code == 500:
-                yield f"Error Interno (500): El servidor de IA se quedó sin memoria al intentar cargar '{request.model}'. Revisa los logs del contenedor 'ollama' con 'docker compose logs ollama' para más detalles."
+            if cached:
+                full_response = cached["response"]
+                for chunk in response_cache.replay(full_response):
+                    yield chunk
             else:
-                yield f"Error de IA ({e.response.status_code}): {e.response.text}"
+                # Turno justo entre usuarios; mientras espera, el cliente recibe su posición en cola
+                ticket = scheduler.submit(request.username, request.model)
+                try:
+                    async for position in scheduler.wait(ticket):
+                        yield f"{scheduler.QUEUE_STATUS_PREFIX}: posición {position}\n"
+                    # Solo cuenta como uso del modelo la petición que llega a Ollama (no las rechazadas ni las de caché)
+                    residency.record(request.model)
+                    payload["keep_alive"] = residency.keep_alive(request.model)
+                    async with ollama.stream("/api/chat", payload) as response:
+                        if response.status_code != 200:
+                            await response.aread()
+                            if response.status_code == 404:
+                                yield f"Error: El modelo '{request.model}' no está instalado en Ollama. Ejecuta: docker compose exec ollama ollama pull {request.model}"
+                            elif response.status_code == 500:
+                                yield f"Error Interno (500): El servidor de IA se quedó sin memoria al intentar cargar '{request.model}'. Revisa los logs del contenedor 'ollama' con 'docker compose logs ollama' para más detalles."
+                            else:
+                                yield f"Error de IA ({response.status_code}): {response.text}"
+                        else:
+                            async for line in response.aiter_lines():
+                                if line:
+                                    json_response = json.loads(line)
+                                    chunk = json_response.get("message", {}).get("content")
+                                    if chunk:
+                                        if not full_response:
+                                            metrics.TTFT.labels(request.model).observe(time.monotonic() - started)
+                                        full_response += chunk
+                                        yield chunk
+                                    if json_response.get("done"):
+                                        completed = True
+                                        metrics.GENERATION_TIME.labels(request.model).observe(time.monotonic() - started)
+                                        metrics.record_generation(request.model, json_response)
+                finally:
+                    scheduler.release(ticket)
         except Exception as e:
             yield f"Error de conexión con IA: {str(e)}"
-            
-        # Guardar respuesta del asistente en DB al finalizar el stream
-        # Usamos una nueva sesión de DB porque estamos dentro de un generador
-        with SessionLocal() as db_inner:
-            ai_msg = ChatMessage(session_id=session_id, role="assistant", content=full_response.replace('\x00', ''))
-            db_inner.add(ai_msg)
-            db_inner.commit()
-
-    headers = {"X-Session-Id": session_id}
-    return StreamingResponse(generate(), headers=headers, media_type="text/plain")
+        finally:
+            # También si el cliente se desconecta a mitad: se guarda la respuesta parcial
+            with anyio.CancelScope(shield=True):
+                await finish(full_response, completed, time.monotonic() - started)
+
+    # La dependencia cierra la sesión después de enviar toda la respuesta: la conexión vuelve al pool ya,
+    # si no cada stream abierto ocuparía una y con el pool lleno el resto de peticiones esperaría
+    await db.close()
+
+    # Desglose de lo ocurrido antes del primer byte (el tiempo de generación va a /metrics)
+    timings = {**metrics.timings(), "setup": time.perf_counter() - request_started}
+    headers = {"X-Session-Id": session_id, "Server-Timing": metrics.server_timing(timings)}
+    if request.cache:
+        headers["X-Cache"] = "HIT" if cached else "MISS"
+        if cached:
+            headers["X-Cache-Similarity"] = f"{cached['similarity']:.3f}"
+    return StreamingResponse(metrics.track_stream(generate()), headers=headers, media_type="text/plain")
+
+@app.get("/chat/cache/stats")
+async def chat_cache_stats():
+    """Aciertos, fallos y segundos de generación ahorrados por la caché de respuestas."""
+    return await response_cache.stats()
+
+@app.get("/pdf-cache/stats")
+def pdf_cache_stats():
+    """Aciertos de la caché de texto extraído de PDFs (compartida por /analyze y /s3/sync) y ocupación en disco."""
+    return pdf_cache.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    content, content_type = metrics.render(scheduler.status())
+    return Response(content=content, media_type=content_type)
+
+@app.get("/models/status")
+def models_status():
+    """Modelos cargados en cada nodo de Ollama, con su memoria y último uso."""
+    return residency.status()
+
+@app.get("/scheduler/status")
+def scheduler_status():
+    """Peticiones en ejecución y en cola hacia Ollama, por modelo, y estado de cada backend."""
+    return {**scheduler.status(), "backends": ollama.status()}
 
 @app.post("/analyze")
-async def analyze_document(file: UploadFile = File(...), model: str = "gpt-oss:20b", query: Optional[str] = None):
+async def analyze_document(http_request: Request, file: UploadFile = File(...), model: str = "gpt-oss:20b", query: Optional[str] = None, stream: bool = False):
     # 1. Validar que sea PDF
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
 
-    # 2. Leer y extraer texto del PDF
+    # 2. Copiar a disco: las páginas se extraen por tandas en un proceso worker, sin cargar el PDF en memoria
     try:
-        content = await file.read()
-        pdf = PdfReader(io.BytesIO(content))
-        text = ""
-        # Extraemos texto de todas las páginas
-        for page in pdf.pages:
-            text += (page.extract_text() or "").replace('\x00', '')
-            
-        if not text.strip():
-             raise HTTPException(status_code=400, detail="No se pudo extraer texto del PDF (puede ser una imagen)")
-
+        path, sha256 = await run_in_threadpool(analyze.save_upload, file.file)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error leyendo el archivo: {str(e)}")
 
-    # 3. Enviar a la IA para buscar temas
-    # Truncamos el texto para no saturar el contexto (aprox 12k caracteres para empezar)
-    truncated_text = text[:12000]
-    if query:
-        prompt = f"Basado únicamente en el siguiente texto, responde a la pregunta: '{query}'. Si la respuesta no está en el texto, indícalo.\n\nTEXTO:\n{truncated_text}"
-    else:
-        prompt = f"Analiza el siguiente documento y lista los 5 temas principales o puntos clave que se tratan en él:\n\nTEXTO:\n{truncated_text}"
+    # Sin usuario autenticado: el reparto justo se hace por IP del cliente
+    client = http_request.client.host if http_request.client else "anonymous"
+    residency.record(model)
+    events = analyze.run(path, sha256, model, query, user=f"ip:{client}")
 
-    ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
-    payload = {"model": model, "prompt": prompt, "stream": False}
+    # 3. Los primeros fragmentos se extraen antes de responder para poder devolver 400 si el PDF no tiene texto
+    try:
+        start = await anext(events)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error leyendo el archivo: {str(e)}")
 
+    # 4. Map-reduce sobre el documento completo; en streaming se envía cada resultado parcial al terminar
+    if stream:
+        return StreamingResponse(metrics.track_stream(analyze.ndjson(start, events)), media_type="application/x-ndjson")
     try:
-        response = requests.post(f"{ollama_url}/api/generate", json=payload)
-        if response.status_code == 200:
-            return {"result": response.json().get("response", "")}
-        else:
-            raise HTTPException(status_code=response.status_code, detail="Error en el motor de IA")
+        return await analyze.collect(events)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail="Error en el motor de IA")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de conexión con IA: {str(e)}")
 
@@ -416,19 +487,41 @@ def list_files(path: str = "/context"):
     
     try:
         items = []
-        for item in os.listdir(path):
-            item_path = os.path.join(path, item)
-            is_dir = os.path.isdir(item_path)
-            items.append({
-                "name": item,
-                "path": item_path,
-                "is_directory": is_dir,
-                "size": os.path.getsize(item_path) if not is_dir else 0
-            })
+        # scandir trae el tipo de cada entrada en el mismo listado (sin un stat por archivo para saber si es carpeta)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                is_dir = entry.is_dir()
+                items.append({
+                    "name": entry.name,
+                    "path": entry.path,
+                    "is_directory": is_dir,
+                    "size": entry.stat().st_size if not is_dir else 0
+                })
         return {"items": items}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listando archivos: {str(e)}")
 
+@app.get("/tree")
+def get_tree(path: str = "/context", max_depth: int = tree.TREE_MAX_DEPTH, ignore_dirs: Optional[str] = None,
+             extensions: Optional[str] = None, dirs_only: bool = False, since: Optional[str] = None):
+    """Subárbol completo en una respuesta. Con `since` (versión anterior) solo se devuelven los cambios."""
+    base_path = ingest.LOCAL_CONTEXT_PATH
+    safe_path = os.path.normpath(os.path.join(base_path, path))
+    if safe_path != base_path and not safe_path.startswith(base_path + os.sep):
+        raise HTTPException(status_code=403, detail="Acceso denegado: Ruta fuera del contexto del proyecto")
+    if not os.path.isdir(safe_path):
+        raise HTTPException(status_code=404, detail="Directorio no encontrado")
+
+    # Listas separadas por coma; ignore_dirs vacío = no ignorar nada, sin indicar = directorios por defecto
+    return tree.get_tree(
+        safe_path,
+        max_depth,
+        ignore_dirs={d.strip() for d in ignore_dirs.split(",") if d.strip()} if ignore_dirs is not None else None,
+        extensions=[e.strip() for e in extensions.split(",") if e.strip()] if extensions else None,
+        dirs_only=dirs_only,
+        since=since,
+    )
+
 @app.get("/file/content")
 def get_file_content(path: str):
     if not os.path.exists(path):
@@ -444,8 +537,35 @@ def get_file_content(path: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error leyendo archivo: {str(e)}")
 
+@app.post("/files/content:batch")
+async def get_files_content(request: FileBatchRequest):
+    """Varios archivos (o rangos) leídos en paralelo; un registro NDJSON por archivo según terminan."""
+    if len(request.files) > files.FILES_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Máximo {files.FILES_BATCH_MAX_FILES} archivos por petición")
+    specs = [spec.model_dump() for spec in request.files]
+    return StreamingResponse(files.read_batch(specs, request.max_bytes), media_type="application/x-ndjson")
+
+@app.get("/file/raw")
+def get_file_raw(path: str):
+    """Archivo sin decodificar, con soporte de Range y ETag (archivos grandes o binarios)."""
+    safe_path = files.safe_path(path)
+    if safe_path is None:
+        raise HTTPException(status_code=403, detail="Acceso denegado: Ruta fuera del contexto del proyecto")
+    if not os.path.isfile(safe_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return FileResponse(safe_path)
+
+def reindex_paths(paths: list, db: Session, background_tasks: BackgroundTasks):
+    # Mantener la base de conocimiento al día con las ediciones hechas desde la API
+    try:
+        stats = ingest.index_local_paths(db, paths)
+        if stats["indexed"]:
+            background_tasks.add_task(retrieval.run_embedding_job)
+    except Exception as e:
+        print(f"Error actualizando el índice: {e}")
+
 @app.post("/file/write")
-def write_file(request: FileWriteRequest):
+def write_file(request: FileWriteRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     base_path = "/context"
     # Sanitizar ruta para evitar directory traversal (seguridad)
     safe_path = os.path.normpath(os.path.join(base_path, request.path.lstrip("/")))
@@ -458,13 +578,14 @@ def write_file(request: FileWriteRequest):
         
         with open(safe_path, 'w', encoding='utf-8') as f:
             f.write(request.content)
-            
-        return {"message": f"Archivo guardado exitosamente: {request.path}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error escribiendo archivo: {str(e)}")
 
+    reindex_paths([safe_path], db, background_tasks)
+    return {"message": f"Archivo guardado exitosamente: {request.path}"}
+
 @app.delete("/file/delete")
-def delete_file(path: str):
+def delete_file(path: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     base_path = "/context"
     safe_path = os.path.normpath(os.path.join(base_path, path.lstrip("/")))
     if not safe_path.startswith(base_path):
@@ -478,10 +599,12 @@ def delete_file(path: str):
             shutil.rmtree(safe_path)
         else:
             os.remove(safe_path)
-        return {"message": f"Eliminado exitosamente: {path}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error eliminando: {str(e)}")
 
+    reindex_paths([safe_path], db, background_tasks)
+    return {"message": f"Eliminado exitosamente: {path}"}
+
 @app.post("/file/mkdir")
 def create_directory(request: FileMkdirRequest):
     base_path = "/context"
@@ -0,0 +1,229 @@
+# message_log.py
+# Registro write-behind de los mensajes del chat: cada mensaje se añade a un stream de Redis
+# (durable, sobrevive a un reinicio de la API) y un worker los inserta en PostgreSQL por lotes.
+# Cada entrada guarda el id del stream en messages.log_id, así que reprocesar es idempotente.
+# Una entrada que la base de datos rechaza (no una caída) se reintenta MESSAGE_MAX_DELIVERIES veces y
+# luego pasa al stream chat:messages:dead para no bloquear al resto.
+
+import os
+import json
+import time
+import socket
+import asyncio
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import exc, insert as sa_insert
+from sqlalchemy.dialects.postgresql import insert
+
+from database import redis_client, AsyncSessionLocal, ChatSession, ChatMessage
+
+STREAM_KEY = "chat:messages"
+GROUP = "db-writers"
+CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+# Latencia máxima hasta que un mensaje llega a PostgreSQL y tamaño máximo de cada lote
+FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", 200))
+FLUSH_BATCH_SIZE = int(os.getenv("MESSAGE_FLUSH_BATCH", 500))
+# Entradas de otro worker sin confirmar durante este tiempo se dan por huérfanas (worker caído)
+CLAIM_IDLE_MS = 30000
+# Segundos entre reintentos de las entradas pendientes (rechazadas o huérfanas)
+RECOVER_INTERVAL = 5
+DEAD_LETTER_KEY = "chat:messages:dead"
+# Entregas de una entrada rechazada antes de apartarla (contador de entregas de XPENDING)
+MAX_DELIVERIES = int(os.getenv("MESSAGE_MAX_DELIVERIES", 5))
+
+_task: Optional[asyncio.Task] = None
+_lock = asyncio.Lock()
+
+async def append(session_id: str, role: str, content: str, attachments: Optional[list] = None):
+    """Registra un mensaje de una sesión que ya existe en la base de datos (/chat la crea al recibir su
+    primer mensaje). `attachments` son referencias a content_blobs (el contenido ya está guardado)."""
+    entry = {
+        "session_id": session_id,
+        "role": role,
+        "content": content.replace('\x00', ''),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    if attachments:
+        entry["attachments"] = attachments
+    try:
+        await redis_client.xadd(STREAM_KEY, {"data": json.dumps(entry)})
+    except Exception as e:
+        # Sin Redis no hay buffer: se escribe directamente para no perder el mensaje
+        print(f"Redis no disponible para el log de mensajes ({e}), escribiendo directo en la base de datos")
+        async with AsyncSessionLocal() as db:
+            await _write(db, [(None, entry)])
+            await db.commit()
+
+async def _write(db, entries: list):
+    # Entradas con user_id: de versiones anteriores, que creaban aquí la sesión; pueden quedar en el stream
+    sessions = {e["session_id"]: e["user_id"] for _, e in entries if "user_id" in e}
+    if sessions:
+        await db.execute(
+            insert(ChatSession)
+            .values([{"id": sid, "user_id": uid, "created_at": datetime.utcnow()} for sid, uid in sessions.items()])
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+    rows = [
+        {
+            "log_id": log_id,
+            "session_id": e["session_id"],
+            "role": e["role"],
+            "content": e["content"],
+            "attachments": e.get("attachments"),
+            "created_at": datetime.fromisoformat(e["created_at"]),
+        }
+        for log_id, e in entries
+    ]
+    if any(log_id is None for log_id, _ in entries):
+        await db.execute(sa_insert(ChatMessage), rows)
+    else:
+        # Entradas ya insertadas antes de una caída (sin confirmar en el stream) se ignoran
+        await db.execute(insert(ChatMessage).values(rows).on_conflict_do_nothing(index_elements=["log_id"]))
+
+async def _ensure_group():
+    try:
+        await redis_client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def _transient(e: Exception) -> bool:
+    # Base de datos caída o conexión perdida: no es culpa de la entrada, se reintenta sin límite
+    return isinstance(e, (OSError, asyncio.TimeoutError, exc.OperationalError, exc.InterfaceError)) or getattr(e, "connection_invalidated", False)
+
+async def _write_each(decoded: list) -> dict:
+    """Escribe las entradas una a una para aislar las que la base de datos rechaza. Devuelve {id: error}."""
+    failed = {}
+    for log_id, entry in decoded:
+        try:
+            async with AsyncSessionLocal() as db:
+                await _write(db, [(log_id, entry)])
+                await db.commit()
+        except Exception as e:
+            if _transient(e):
+                raise
+            failed[log_id] = e
+    return failed
+
+async def _deliveries(ids: list) -> dict:
+    counts = {}
+    for entry_id in ids:
+        info = await redis_client.xpending_range(STREAM_KEY, GROUP, entry_id, entry_id, 1)
+        counts[entry_id] = info[0]["times_delivered"] if info else 0
+    return counts
+
+async def _dead_letter(entries: dict, errors: dict):
+    for entry_id, fields in entries.items():
+        await redis_client.xadd(DEAD_LETTER_KEY, {
+            "log_id": entry_id,
+            "data": (fields or {}).get(b"data", b""),
+            "error": str(errors[entry_id])[:1000],
+        })
+    print(f"Log de mensajes: {len(entries)} mensajes rechazados movidos a {DEAD_LETTER_KEY}")
+
+async def _flush_entries(entries: list) -> int:
+    """Escribe un lote leído del stream y lo confirma. Devuelve cuántas entradas salieron del stream."""
+    if not entries:
+        return 0
+    raw = {entry_id.decode(): fields for entry_id, fields in entries}
+    decoded, poison = [], {}
+    for entry_id, fields in raw.items():
+        if not fields:
+            continue # Entrada borrada del stream: solo queda confirmarla
+        try:
+            decoded.append((entry_id, json.loads(fields[b"data"])))
+        except (KeyError, ValueError) as e:
+            poison[entry_id] = e # Ilegible: reintentar no la arregla
+    try:
+        async with AsyncSessionLocal() as db:
+            await _write(db, decoded)
+            await db.commit()
+        failed = {}
+    except Exception as e:
+        if _transient(e):
+            raise
+        # Alguna entrada del lote es inválida (ej: una sesión inexistente): se aísla escribiéndolas una a una
+        failed = await _write_each(decoded)
+    if failed:
+        deliveries = await _deliveries(list(failed))
+        poison.update({entry_id: e for entry_id, e in failed.items() if deliveries[entry_id] >= MAX_DELIVERIES})
+    if poison:
+        await _dead_letter({entry_id: raw[entry_id] for entry_id in poison}, poison)
+    done = [entry_id for entry_id in raw if entry_id not in failed or entry_id in poison]
+    if done:
+        await redis_client.xack(STREAM_KEY, GROUP, *done)
+        await redis_client.xdel(STREAM_KEY, *done)
+    retry = len(raw) - len(done)
+    if retry:
+        # Quedan pendientes sin confirmar; el worker las reclama (sumando una entrega) en el próximo _recover
+        error = str(next(iter(failed.values()))).splitlines()[0]
+        print(f"Log de mensajes: {retry} mensajes rechazados por la base de datos, se reintentarán: {error}")
+    return len(done)
+
+async def flush(block_ms: Optional[int] = None) -> int:
+    """Inserta un lote de mensajes pendientes. Devuelve cuántos se escribieron."""
+    async with _lock:
+        response = await redis_client.xreadgroup(GROUP, CONSUMER, {STREAM_KEY: ">"}, count=FLUSH_BATCH_SIZE, block=block_ms)
+        entries = response[0][1] if response else []
+        return await _flush_entries(entries)
+
+async def drain():
+    """Escribe todo lo pendiente (ej: al apagar la API)."""
+    while await flush():
+        pass
+
+async def _claim_own() -> list:
+    # XCLAIM (a diferencia de releer con XREADGROUP desde "0") suma una entrega a cada entrada
+    pending = await redis_client.xpending_range(STREAM_KEY, GROUP, "-", "+", FLUSH_BATCH_SIZE, consumername=CONSUMER)
+    if not pending:
+        return []
+    return await redis_client.xclaim(STREAM_KEY, GROUP, CONSUMER, 0, [p["message_id"] for p in pending])
+
+async def _recover():
+    # Propias sin confirmar (reinicio de este mismo worker o reintento) y huérfanas de workers caídos
+    recovered = 0
+    async with _lock:
+        while True:
+            entries = await _claim_own()
+            flushed = await _flush_entries(entries)
+            recovered += flushed
+            if not entries or flushed < len(entries):
+                break
+        claimed = await redis_client.xautoclaim(STREAM_KEY, GROUP, CONSUMER, CLAIM_IDLE_MS, count=FLUSH_BATCH_SIZE)
+        recovered += await _flush_entries(claimed[1])
+    if recovered:
+        print(f"Log de mensajes: {recovered} mensajes pendientes recuperados")
+
+async def _worker():
+    while True:
+        try:
+            await _recover()
+            deadline = time.monotonic() + RECOVER_INTERVAL
+            while time.monotonic() < deadline:
+                await flush(block_ms=FLUSH_INTERVAL_MS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Base de datos caída: los mensajes siguen en el stream y se reintentan
+            print(f"Error escribiendo mensajes en la base de datos: {e}")
+            await asyncio.sleep(1)
+
+async def start():
+    global _task
+    await _ensure_group()
+    _task = asyncio.create_task(_worker())
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    # Último vaciado al apagar; lo que no alcance queda en el stream para el próximo arranque
+    try:
+        await drain()
+    except Exception as e:
+        print(f"Mensajes pendientes quedan en Redis: {e}")
@@ -0,0 +1,160 @@
+# metrics.py
+# Métricas Prometheus (/metrics) y desglose de tiempos por petición (DB, Redis, RAG...).
+# Cada petición HTTP lleva un acumulador en un ContextVar; los tiempos de SQLAlchemy y Redis
+# se suman ahí y se publican por endpoint al terminar la respuesta (incluido el stream).
+
+import time
+import functools
+from contextvars import ContextVar
+from typing import Optional
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event, exc
+
+# Buckets pensados para LLMs: de decenas de ms a varios minutos
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HTTP_DURATION = Histogram("openccb_http_request_seconds", "Duración total de la petición (hasta el último byte)", ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS)
+DB_TIME = Histogram("openccb_db_seconds", "Tiempo en consultas SQL por petición", ["endpoint"], buckets=FAST_BUCKETS)
+REDIS_TIME = Histogram("openccb_redis_seconds", "Tiempo en comandos Redis por petición", ["endpoint"], buckets=FAST_BUCKETS)
+RAG_TIME = Histogram("openccb_rag_seconds", "Tiempo de la búsqueda RAG (recuperación + rerank + empaquetado)", buckets=FAST_BUCKETS + (5, 10))
+
+TTFT = Histogram("openccb_time_to_first_token_seconds", "Tiempo hasta el primer token (incluye la espera en cola)", ["model"], buckets=LATENCY_BUCKETS)
+GENERATION_TIME = Histogram("openccb_generation_seconds", "Duración total de la generación", ["model"], buckets=LATENCY_BUCKETS)
+TOKENS_PER_SECOND = Histogram("openccb_tokens_per_second", "Velocidad de generación según eval_count/eval_duration de Ollama", ["model"], buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200))
+GENERATED_TOKENS = Counter("openccb_generated_tokens_total", "Tokens generados", ["model"])
+PROMPT_TOKENS = Counter("openccb_prompt_tokens_total", "Tokens de prompt evaluados", ["model"])
+
+ACTIVE_STREAMS = Gauge("openccb_active_streams", "Respuestas de chat en streaming abiertas")
+QUEUE_DEPTH = Gauge("openccb_scheduler_queued", "Peticiones esperando turno hacia Ollama")
+RUNNING = Gauge("openccb_scheduler_running", "Peticiones en ejecución en Ollama")
+
+DB_POOL_WAIT = Histogram("openccb_db_pool_wait_seconds", "Espera para obtener una conexión del pool", ["engine"], buckets=FAST_BUCKETS + (5, 10, 30))
+DB_POOL_TIMEOUTS = Counter("openccb_db_pool_timeouts_total", "Peticiones que agotaron DB_POOL_TIMEOUT sin conseguir conexión", ["engine"])
+DB_POOL_IN_USE = Gauge("openccb_db_pool_checked_out", "Conexiones del pool en uso", ["engine"])
+DB_POOL_SATURATION = Gauge("openccb_db_pool_saturation", "Conexiones en uso / máximo (pool_size + max_overflow)", ["engine"])
+USER_CACHE = Counter("openccb_user_cache_total", "Búsquedas de usuario resueltas en la caché en memoria", ["result"])
+
+INGEST_DOCUMENTS = Counter("openccb_ingest_documents_total", "Documentos procesados en la ingesta", ["source", "result"])
+INGEST_PAGES = Counter("openccb_ingest_pages_total", "Páginas indexadas", ["source"])
+INGEST_BYTES = Counter("openccb_ingest_bytes_total", "Bytes descargados o leídos para indexar", ["source"])
+PDF_TEXT_CACHE = Counter("openccb_pdf_text_cache_total", "Consultas a la caché de texto extraído de PDFs", ["result"])
+
+RESPONSE_CACHE_HITS = Counter("openccb_response_cache_hits_total", "Respuestas de chat servidas desde la caché (incluye los aciertos semánticos)")
+RESPONSE_CACHE_MISSES = Counter("openccb_response_cache_misses_total", "Consultas a la caché de respuestas sin entrada reutilizable")
+RESPONSE_CACHE_SAVED = Counter("openccb_response_cache_saved_seconds_total", "Segundos de generación ahorrados (duración original de las respuestas reutilizadas)")
+
+# Acumulador de la petición en curso: {"db": s, "redis": s, ...}
+_timings: ContextVar[Optional[dict]] = ContextVar("timings", default=None)
+
+def add_timing(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def timings() -> dict:
+    return dict(_timings.get() or {})
+
+def server_timing(values: dict) -> str:
+    """Valor de la cabecera Server-Timing (milisegundos)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in values.items())
+
+async def track_stream(chunks):
+    """Envuelve el generador de una respuesta en streaming para contar los streams abiertos."""
+    with ACTIVE_STREAMS.track_inprogress():
+        async for chunk in chunks:
+            yield chunk
+
+def record_generation(model: str, final: dict):
+    """Métricas del mensaje final de Ollama (eval_count/eval_duration en nanosegundos)."""
+    eval_count = final.get("eval_count") or 0
+    eval_duration = final.get("eval_duration") or 0
+    GENERATED_TOKENS.labels(model).inc(eval_count)
+    PROMPT_TOKENS.labels(model).inc(final.get("prompt_eval_count") or 0)
+    if eval_count and eval_duration:
+        TOKENS_PER_SECOND.labels(model).observe(eval_count / (eval_duration / 1e9))
+
+def instrument_engine(engine):
+    """Suma el tiempo de cada consulta SQL al acumulador de la petición."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        add_timing("db", time.perf_counter() - conn.info["query_start"].pop())
+
+def instrument_redis(client):
+    """Envuelve execute_command del cliente asíncrono para medir cada comando."""
+    execute = client.execute_command
+
+    @functools.wraps(execute)
+    async def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await execute(*args, **kwargs)
+        finally:
+            add_timing("redis", time.perf_counter() - start)
+
+    client.execute_command = timed
+
+_pools = {} # nombre -> (pool, capacidad máxima)
+
+def instrument_pool(name: str, pool, capacity: int):
+    """Mide la espera al sacar una conexión del pool. Los pools sin límite (NullPool) no se miden."""
+    if not hasattr(pool, "checkedout"):
+        return
+    _pools[name] = (pool, capacity)
+    get = pool._do_get
+
+    @functools.wraps(get)
+    def timed():
+        start = time.perf_counter()
+        try:
+            return get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.labels(name).inc()
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            DB_POOL_WAIT.labels(name).observe(waited)
+            add_timing("db_pool", waited)
+
+    pool._do_get = timed
+
+class MetricsMiddleware:
+    """Middleware ASGI: abre el acumulador y publica los tiempos cuando se envía el último byte."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        token = _timings.set({})
+        timings = _timings.get()
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                route = scope.get("route")
+                endpoint = getattr(route, "path", "unmatched")
+                HTTP_DURATION.labels(endpoint, scope["method"], str(status["code"])).observe(time.perf_counter() - start)
+                DB_TIME.labels(endpoint).observe(timings.get("db", 0.0))
+                REDIS_TIME.labels(endpoint).observe(timings.get("redis", 0.0))
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+
+def render(scheduler_status: dict):
+    QUEUE_DEPTH.set(scheduler_status["queued"])
+    RUNNING.set(scheduler_status["running"])
+    for name, (pool, capacity) in _pools.items():
+        DB_POOL_IN_USE.labels(name).set(pool.checkedout())
+        DB_POOL_SATURATION.labels(name).set(pool.checkedout() / capacity if capacity else 0)
+    return generate_latest(), CONTENT_TYPE_LATEST
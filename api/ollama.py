@@ -0,0 +1,203 @@
+# ollama.py
+# Pool de backends de Ollama: un cliente HTTP asíncrono (con pool de conexiones) por nodo,
+# chequeos de salud, enrutado al nodo con menos peticiones en curso que ya tenga el modelo
+# cargado y reintento en otro nodo mientras la respuesta no haya empezado.
+
+import os
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import metrics
+import scheduler
+
+# Lista de nodos separados por coma (ej: "http://gpu1:11434,http://cpu1:11434"); por defecto, OLLAMA_URL
+OLLAMA_URLS = [u.strip() for u in (os.getenv("OLLAMA_URLS") or os.getenv("OLLAMA_URL", "http://localhost:11434")).split(",") if u.strip()]
+# Conexiones simultáneas abiertas hacia cada nodo (cada stream abierto ocupa una)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 500))
+# Segundos entre chequeos de salud (/api/ps y /api/tags)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", 10))
+# Códigos que indican que el nodo no puede atender ahora (se prueba el siguiente)
+RETRY_STATUS = {502, 503, 504}
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url
+        self.client: Optional[httpx.AsyncClient] = None
+        self.healthy = True # Optimista hasta el primer chequeo
+        self.outstanding = 0
+        self.loaded = {}       # Modelos en memoria (/api/ps): nombre -> {size, size_vram, expires_at}
+        self.installed = None  # Modelos descargados (/api/tags); None = desconocido
+        self.last_error: Optional[str] = None
+
+    def eject(self, error):
+        self.healthy = False
+        self.last_error = str(error) or type(error).__name__
+        print(f"Backend de Ollama {self.url} fuera de servicio: {self.last_error}")
+
+backends = [Backend(url) for url in OLLAMA_URLS]
+_health_task: Optional[asyncio.Task] = None
+
+async def start():
+    """Crea los clientes y lanza los chequeos de salud. Se llama una vez al arrancar la app."""
+    global _health_task
+    for backend in backends:
+        backend.client = httpx.AsyncClient(
+            base_url=backend.url,
+            # Sin timeout de lectura: una generación larga puede tardar minutos entre tokens al cargar el modelo
+            timeout=httpx.Timeout(10.0, read=None),
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=50),
+        )
+    await check_health()
+    _health_task = asyncio.create_task(_health_loop())
+
+async def close():
+    global _health_task
+    if _health_task is not None:
+        _health_task.cancel()
+        _health_task = None
+    for backend in backends:
+        if backend.client is not None:
+            await backend.client.aclose()
+            backend.client = None
+
+def estimate_tokens(text: str) -> int:
+    # Aproximación de ~4 caracteres por token; suficiente para presupuestar el prompt
+    return len(text) // 4 + 1
+
+async def _check(backend: Backend):
+    try:
+        ps, tags = await asyncio.gather(
+            backend.client.get("/api/ps", timeout=5.0),
+            backend.client.get("/api/tags", timeout=5.0),
+        )
+        ps.raise_for_status()
+        tags.raise_for_status()
+        backend.loaded = {
+            m["name"]: {"size": m.get("size", 0), "size_vram": m.get("size_vram", 0), "expires_at": m.get("expires_at")}
+            for m in ps.json().get("models", [])
+        }
+        backend.installed = {m["name"] for m in tags.json().get("models", [])}
+        if not backend.healthy:
+            print(f"Backend de Ollama {backend.url} disponible de nuevo")
+        backend.healthy = True
+        backend.last_error = None
+    except Exception as e:
+        if backend.healthy:
+            backend.eject(e)
+
+async def check_health():
+    await asyncio.gather(*(_check(b) for b in backends))
+    # El planificador reparte OLLAMA_NUM_PARALLEL huecos por cada nodo sano
+    scheduler.set_capacity(sum(1 for b in backends if b.healthy))
+
+async def _health_loop():
+    while True:
+        await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+        await check_health()
+
+def has_model(names, model: str) -> bool:
+    # Ollama lista "llama3:latest" cuando se pide "llama3"
+    return model in names or (":" not in model and f"{model}:latest" in names)
+
+def _choose(model: Optional[str], tried: set) -> Optional[Backend]:
+    candidates = [b for b in backends if b.healthy and b not in tried and b.client is not None]
+    if not candidates:
+        # Todos marcados como caídos: se prueba igualmente uno no intentado antes de rendirse
+        candidates = [b for b in backends if b not in tried and b.client is not None]
+    if model:
+        # Nodos sin el modelo descargado solo si ninguno lo tiene
+        installed = [b for b in candidates if b.installed is None or has_model(b.installed, model)]
+        candidates = installed or candidates
+    if not candidates:
+        return None
+    # Afinidad: primero los que ya tienen el modelo en memoria; luego, menos peticiones en curso
+    return min(candidates, key=lambda b: (not (model and has_model(b.loaded, model)), b.outstanding))
+
+async def _send(path: str, payload: dict, stream: bool):
+    """Envía la petición al mejor nodo, reintentando en otro si falla antes de responder."""
+    model = payload.get("model")
+    tried = set()
+    last_error = None
+    while True:
+        backend = _choose(model, tried)
+        if backend is None:
+            raise httpx.ConnectError(f"No hay backends de Ollama disponibles ({last_error})")
+        tried.add(backend)
+        backend.outstanding += 1
+        handed_over = False
+        try:
+            try:
+                response = await backend.client.send(backend.client.build_request("POST", path, json=payload), stream=stream)
+            except httpx.TransportError as e:
+                backend.eject(e)
+                last_error = e
+                continue
+            if response.status_code in RETRY_STATUS and len(tried) < len(backends):
+                await response.aclose()
+                last_error = f"{backend.url} respondió {response.status_code}"
+                continue
+            if model and response.status_code == 200:
+                backend.loaded.setdefault(model, {})
+            handed_over = True
+            return backend, response
+        finally:
+            # Cualquier otra salida (cancelación, error inesperado, reintento) libera la petición;
+            # la respuesta devuelta sigue en curso hasta que el llamador la cierre
+            if not handed_over:
+                backend.outstanding -= 1
+
+@asynccontextmanager
+async def stream(path: str, payload: dict):
+    """POST en streaming. Si el nodo falla a mitad del stream se expulsa del pool y el error se propaga."""
+    backend, response = await _send(path, payload, stream=True)
+    try:
+        yield response
+    except httpx.TransportError as e:
+        backend.eject(e)
+        raise
+    finally:
+        await response.aclose()
+        backend.outstanding -= 1
+
+async def post(path: str, payload: dict) -> httpx.Response:
+    # Sin streaming el cuerpo ya está leído: la petición terminó al volver de _send
+    backend, response = await _send(path, payload, stream=False)
+    backend.outstanding -= 1
+    return response
+
+async def post_to(backend: Backend, path: str, payload: dict) -> httpx.Response:
+    """POST a un nodo concreto (carga/descarga de modelos), sin enrutado ni reintentos."""
+    backend.outstanding += 1
+    try:
+        return await backend.client.post(path, json=payload)
+    finally:
+        backend.outstanding -= 1
+
+async def generate(model: str, prompt: str, user: str = scheduler.SYSTEM_USER, keep_alive: Optional[str] = None,
+                   options: Optional[dict] = None, max_active: Optional[int] = None) -> str:
+    """Generación no-streaming (pasa por el planificador). Devuelve el texto completo o lanza httpx.HTTPStatusError."""
+    payload = {"model": model, "prompt": prompt, "stream": False}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    if options:
+        payload["options"] = options
+    async with scheduler.slot(user, model, max_active=max_active):
+        response = await post("/api/generate", payload)
+    response.raise_for_status()
+    result = response.json()
+    metrics.record_generation(model, result)
+    return result.get("response", "")
+
+def status() -> list:
+    return [
+        {
+            "url": b.url,
+            "healthy": b.healthy,
+            "outstanding": b.outstanding,
+            "loaded_models": sorted(b.loaded),
+            "last_error": b.last_error,
+        }
+        for b in backends
+    ]
@@ -0,0 +1,43 @@
+# pagination.py
+# Paginación por cursor (keyset) y ETags para los listados de sesiones y mensajes.
+# El cursor codifica (created_at, id) del último elemento devuelto: cada página es un
+# rango del índice compuesto, con el mismo coste sea la primera o la número mil.
+
+import json
+import base64
+import hashlib
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def page_size(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(created_at: datetime, row_id) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, id_type=str):
+    """(created_at, id) del cursor; 400 si está mal formado."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, _, row_id = raw.rpartition("|")
+        return datetime.fromisoformat(created_at), id_type(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def etag_response(request: Request, payload, next_cursor: Optional[str] = None) -> Response:
+    """JSON compacto con ETag. Si el cliente ya tiene esta versión (If-None-Match) responde 304 sin cuerpo."""
+    body = json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if next_cursor:
+        # Página siguiente (elementos más antiguos); sin cabecera = no hay más
+        headers["X-Next-Cursor"] = next_cursor
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,126 @@
+# pdf_cache.py
+# Caché en disco del texto extraído de PDFs, direccionada por contenido: la clave es el SHA-256
+# de los bytes del archivo, así que el mismo PDF subido a /analyze o re-sincronizado desde S3
+# (aunque cambie de nombre o de bucket) no vuelve a pasar por pypdf. Cada entrada es la lista de
+# páginas en JSON comprimido con zlib; al superar el tamaño máximo se borran las menos usadas.
+
+import os
+import json
+import zlib
+import threading
+from typing import Optional
+
+import metrics
+
+PDF_TEXT_CACHE_DIR = os.getenv("PDF_TEXT_CACHE_DIR", "/cache/pdf_text")
+# Tamaño máximo en disco (MB). 0 = caché desactivada
+PDF_TEXT_CACHE_MAX_MB = float(os.getenv("PDF_TEXT_CACHE_MAX_MB", 1024))
+MAX_BYTES = PDF_TEXT_CACHE_MAX_MB * 1024 * 1024
+# Al expulsar se baja hasta esta fracción del máximo, para no expulsar en cada escritura
+EVICT_TARGET = 0.9
+
+_lock = threading.Lock()
+_size: Optional[int] = None # Bytes en disco; se calcula en la primera escritura
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _path(sha256: str) -> str:
+    return os.path.join(PDF_TEXT_CACHE_DIR, sha256[:2], f"{sha256}.json.z")
+
+def _record(result: str):
+    _stats["hits" if result == "hit" else "misses"] += 1
+    metrics.PDF_TEXT_CACHE.labels(result).inc()
+
+def get(sha256: str) -> Optional[list]:
+    """Páginas cacheadas del PDF con ese hash, o None. Bloqueante (lectura de disco)."""
+    if MAX_BYTES <= 0:
+        return None
+    path = _path(sha256)
+    try:
+        with open(path, "rb") as f:
+            pages = json.loads(zlib.decompress(f.read()))
+        # La fecha de modificación hace de marca LRU
+        os.utime(path)
+    except FileNotFoundError:
+        _record("miss")
+        return None
+    except Exception as e:
+        print(f"Entrada corrupta en la caché de PDFs ({sha256}): {e}")
+        _remove(path)
+        _record("miss")
+        return None
+    _record("hit")
+    return pages
+
+def put(sha256: str, pages: list):
+    """Guarda las páginas extraídas. Los errores de disco no interrumpen la extracción."""
+    if MAX_BYTES <= 0:
+        return
+    global _size
+    path = _path(sha256)
+    data = zlib.compress(json.dumps(pages, ensure_ascii=False).encode("utf-8"), 6)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        # Escritura atómica: un lector concurrente ve la entrada completa o ninguna
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"No se pudo guardar en la caché de PDFs: {e}")
+        return
+    _stats["stores"] += 1
+    with _lock:
+        if _size is None:
+            _size = sum(size for _, size, _ in _entries())
+        else:
+            _size += len(data)
+        if _size > MAX_BYTES:
+            _evict()
+
+def _entries() -> list:
+    entries = []
+    if not os.path.isdir(PDF_TEXT_CACHE_DIR):
+        return entries
+    for shard in os.scandir(PDF_TEXT_CACHE_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith(".json.z"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue # Expulsada por otro proceso mientras se recorría
+            entries.append((entry.path, st.st_size, st.st_mtime))
+    return entries
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _evict():
+    # Se recorre el disco (otros procesos también escriben) y se borran las entradas menos usadas
+    global _size
+    entries = sorted(_entries(), key=lambda e: e[2])
+    _size = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if _size <= MAX_BYTES * EVICT_TARGET:
+            break
+        _remove(path)
+        _size -= size
+        _stats["evictions"] += 1
+
+def stats() -> dict:
+    """Aciertos y fallos de este proceso, y ocupación en disco."""
+    with _lock:
+        entries = _entries()
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        "entries": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "max_bytes": int(MAX_BYTES),
+    }
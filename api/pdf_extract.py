@@ -0,0 +1,18 @@
+# pdf_extract.py
+# Extracción de texto de PDFs. Módulo liviano (sin conexiones a DB) para poder ejecutarse en procesos worker.
+
+import io
+from pypdf import PdfReader
+
+def extract_pages(data: bytes) -> list:
+    """Texto de cada página del PDF, en orden."""
+    pdf = PdfReader(io.BytesIO(data))
+    return [(page.extract_text() or "").replace('\x00', '') for page in pdf.pages]
+
+def count_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+def extract_page_range(path: str, start: int, end: int) -> list:
+    """Texto de las páginas [start, end) de un PDF en disco (para extraer por tandas sin cargar todo el documento)."""
+    pdf = PdfReader(path)
+    return [(pdf.pages[i].extract_text() or "").replace('\x00', '') for i in range(start, min(end, len(pdf.pages)))]
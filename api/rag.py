@@ -0,0 +1,165 @@
+# rag.py
+# Pipeline de recuperación híbrida: texto completo + semántica en paralelo, fusión RRF,
+# rerank opcional con cross-encoder y empaquetado de fragmentos en un presupuesto de tokens.
+
+import os
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+
+import metrics
+import ollama
+import retrieval
+from database import AsyncSessionLocal
+
+# Constante de Reciprocal Rank Fusion (valor estándar del paper original)
+RRF_K = 60
+# Candidatos que aporta cada buscador antes de fusionar
+CANDIDATES_PER_SOURCE = int(os.getenv("RAG_CANDIDATES", 20))
+# Cross-encoder multilingüe pequeño; corre en CPU (requiere sentence-transformers, opcional)
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 20))
+
+RAG_HEADER = "Instrucción: Utiliza la siguiente información de la base de conocimiento para responder. Es OBLIGATORIO que cites el documento, la ruta, la hoja (página) y las líneas de donde obtuviste la información.\n\n"
+
+@dataclass
+class Passage:
+    key: str
+    content: str
+    filename: str
+    s3_key: str
+    page_number: int
+    score: float = 0.0
+    # Rango exacto dentro de la página (None si la página aún no está fragmentada)
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    start_byte: Optional[int] = None
+    end_byte: Optional[int] = None
+
+    def citation(self) -> str:
+        citation = f"Documento: {self.filename} | Ruta: {self.s3_key} | Hoja: {self.page_number}"
+        if self.start_line is not None:
+            citation += f" | Líneas: {self.start_line}-{self.end_line}"
+        return citation
+
+def _from_chunks(rows) -> list:
+    return [
+        Passage(
+            f"c{chunk.id}", chunk.content, page.filename, page.s3_key, page.page_number,
+            start_line=chunk.start_line, end_line=chunk.end_line, start_byte=chunk.start_byte, end_byte=chunk.end_byte,
+        )
+        for chunk, page, _ in rows
+    ]
+
+async def _keyword_candidates(query: str) -> list:
+    async with AsyncSessionLocal() as db:
+        rows = await retrieval.chunk_keyword_search(db, query, k=CANDIDATES_PER_SOURCE)
+        if rows:
+            return _from_chunks(rows)
+        # Páginas aún sin fragmentar (el job de embeddings no ha pasado por ellas)
+        pages = await retrieval.keyword_search(db, query, k=CANDIDATES_PER_SOURCE)
+        return [Passage(f"p{page.id}", page.content, page.filename, page.s3_key, page.page_number) for page, _ in pages]
+
+async def _semantic_candidates(query: str) -> list:
+    try:
+        async with AsyncSessionLocal() as db:
+            return _from_chunks(await retrieval.semantic_search(db, query, k=CANDIDATES_PER_SOURCE))
+    except Exception as e:
+        print(f"Error en búsqueda semántica: {e}")
+        return []
+
+def reciprocal_rank_fusion(*rankings: list) -> list:
+    """Fusiona listas ordenadas: cada aparición suma 1 / (RRF_K + posición)."""
+    fused = {}
+    for ranking in rankings:
+        for position, passage in enumerate(ranking, start=1):
+            entry = fused.setdefault(passage.key, passage)
+            entry.score += 1.0 / (RRF_K + position)
+    return sorted(fused.values(), key=lambda p: p.score, reverse=True)
+
+_cross_encoder = None
+
+def _load_cross_encoder():
+    global _cross_encoder
+    if _cross_encoder is None:
+        from sentence_transformers import CrossEncoder
+        _cross_encoder = CrossEncoder(RERANK_MODEL, device="cpu")
+    return _cross_encoder
+
+def _rerank_sync(query: str, passages: list) -> list:
+    scores = _load_cross_encoder().predict([(query, p.content) for p in passages])
+    for passage, score in zip(passages, scores):
+        passage.score = float(score)
+    return sorted(passages, key=lambda p: p.score, reverse=True)
+
+async def rerank(query: str, passages: list) -> list:
+    head, tail = passages[:RERANK_TOP_N], passages[RERANK_TOP_N:]
+    try:
+        # La inferencia del cross-encoder es CPU: fuera del event loop
+        return await run_in_threadpool(_rerank_sync, query, head) + tail
+    except ImportError:
+        print("Rerank desactivado: instala sentence-transformers para usar el cross-encoder")
+    except Exception as e:
+        print(f"Error en rerank: {e}")
+    return passages
+
+def pack(passages: list, token_budget: int, k: int) -> list:
+    """Selecciona los mejores fragmentos que caben en el presupuesto (máximo k)."""
+    packed, used = [], 0
+    for passage in passages:
+        if len(packed) >= k:
+            break
+        cost = ollama.estimate_tokens(passage.content)
+        if used + cost > token_budget:
+            if packed:
+                # Seguir buscando fragmentos más cortos que aún quepan
+                continue
+            # Ni el mejor fragmento cabe entero: se recorta al presupuesto en un fin de línea
+            limit = token_budget * 4
+            text = passage.content[:(passage.content.rfind("\n", 0, limit) + 1) or limit]
+            passage.content = text
+            if passage.start_line is not None:
+                passage.end_byte = passage.start_byte + len(text.encode("utf-8"))
+                passage.end_line = passage.start_line + text.count("\n") - (1 if text.endswith("\n") else 0)
+            cost = token_budget
+        packed.append(passage)
+        used += cost
+    return packed
+
+async def search(query: str, k: int = 5, token_budget: int = 2000, use_rerank: bool = False) -> list:
+    started = time.perf_counter()
+    keyword, semantic = await asyncio.gather(_keyword_candidates(query), _semantic_candidates(query))
+    candidates = reciprocal_rank_fusion(keyword, semantic)
+    if use_rerank and candidates:
+        candidates = await rerank(query, candidates)
+    packed = pack(candidates, token_budget, k)
+    elapsed = time.perf_counter() - started
+    metrics.RAG_TIME.observe(elapsed)
+    metrics.add_timing("rag", elapsed)
+    return packed
+
+def to_dict(passage: Passage) -> dict:
+    return {
+        "citation": passage.citation(),
+        "filename": passage.filename,
+        "path": passage.s3_key,
+        "page": passage.page_number,
+        "start_line": passage.start_line,
+        "end_line": passage.end_line,
+        "start_byte": passage.start_byte,
+        "end_byte": passage.end_byte,
+        "score": passage.score,
+        "content": passage.content,
+    }
+
+async def build_context(query: str, k: int = 5, token_budget: int = 2000, use_rerank: bool = False) -> Optional[str]:
+    """Bloque de contexto RAG listo para anteponer al prompt, o None si no hay resultados."""
+    passages = await search(query, k, token_budget, use_rerank)
+    if not passages:
+        return None
+    context = RAG_HEADER
+    for p in passages:
+        context += f"--- {p.citation()} ---\n{p.content}\n\n"
+    return context
@@ -0,0 +1,159 @@
+# residency.py
+# Gestión de los modelos en memoria de Ollama: precarga al arrancar, keep_alive por petición
+# según el uso (más largo en horario laboral) y descarga de modelos grandes que quedan ociosos.
+
+import os
+import time
+import asyncio
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+
+import ollama
+import scheduler
+
+# Modelos que se cargan al arrancar y se mantienen calientes en horario laboral (separados por coma)
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "").split(",") if m.strip()]
+KEEP_ALIVE_DEFAULT = os.getenv("OLLAMA_KEEP_ALIVE", "5m")
+KEEP_ALIVE_BUSINESS = os.getenv("KEEP_ALIVE_BUSINESS", "2h")
+# Horario laboral: horas [inicio, fin) y días (0 = lunes) en la zona horaria indicada
+BUSINESS_HOURS = os.getenv("BUSINESS_HOURS", "8-19")
+BUSINESS_DAYS = os.getenv("BUSINESS_DAYS", "0-4")
+BUSINESS_TZ = os.getenv("BUSINESS_TZ", "UTC")
+# Un modelo con al menos MODEL_HOT_MIN_REQUESTS peticiones en esta ventana se considera "caliente"
+# (la petición en curso ya está registrada: con 1, cualquier modelo pedido sería caliente)
+HOT_WINDOW_SECONDS = int(os.getenv("MODEL_HOT_WINDOW", 3600))
+HOT_MIN_REQUESTS = max(2, int(os.getenv("MODEL_HOT_MIN_REQUESTS", 2)))
+# Modelos de al menos este tamaño se descargan tras este tiempo sin uso
+LARGE_MODEL_BYTES = float(os.getenv("MODEL_LARGE_GB", 8)) * 1024 ** 3
+IDLE_UNLOAD_SECONDS = int(os.getenv("MODEL_IDLE_UNLOAD", 900))
+CHECK_INTERVAL = 60
+
+_last_used = {} # modelo -> instante (epoch) de la última petición
+_requests = Counter()
+_recent = {} # modelo -> instantes de sus últimas HOT_MIN_REQUESTS peticiones
+_task: Optional[asyncio.Task] = None
+
+def _name(model: str) -> str:
+    # /api/ps devuelve "llama3:latest" aunque se pida "llama3"
+    return model if ":" in model else f"{model}:latest"
+
+_PRELOAD = {_name(m) for m in PRELOAD_MODELS}
+
+def _range(spec: str) -> range:
+    start, _, end = spec.partition("-")
+    return range(int(start), int(end or start) + 1)
+
+def in_business_hours() -> bool:
+    try:
+        from zoneinfo import ZoneInfo
+        now = datetime.now(ZoneInfo(BUSINESS_TZ))
+    except Exception:
+        now = datetime.now()
+    start, _, end = BUSINESS_HOURS.partition("-")
+    return now.weekday() in _range(BUSINESS_DAYS) and int(start) <= now.hour < int(end)
+
+def record(model: str):
+    """Registra el uso de un modelo (para decidir su keep_alive y si se puede descargar)."""
+    now = time.time()
+    _last_used[_name(model)] = now
+    _requests[_name(model)] += 1
+    _recent.setdefault(_name(model), deque(maxlen=HOT_MIN_REQUESTS)).append(now)
+
+def is_hot(model: str) -> bool:
+    if _name(model) in _PRELOAD:
+        return True
+    recent = _recent.get(_name(model))
+    # Las últimas HOT_MIN_REQUESTS peticiones caben en la ventana
+    return bool(recent) and len(recent) == HOT_MIN_REQUESTS and time.time() - recent[0] < HOT_WINDOW_SECONDS
+
+def keep_alive(model: str) -> str:
+    """keep_alive que se envía con cada petición: largo para modelos calientes en horario laboral."""
+    if in_business_hours() and is_hot(model):
+        return KEEP_ALIVE_BUSINESS
+    return KEEP_ALIVE_DEFAULT
+
+async def _load(backend, model: str, alive):
+    # Una petición sin prompt carga (o descarga, con keep_alive=0) el modelo sin generar nada
+    response = await ollama.post_to(backend, "/api/generate", {"model": model, "keep_alive": alive})
+    response.raise_for_status()
+
+async def _warm(models: list, only_empty: bool = False):
+    for backend in ollama.backends:
+        if not backend.healthy or backend.client is None or (only_empty and backend.loaded):
+            continue
+        for model in models:
+            if backend.installed is not None and not ollama.has_model(backend.installed, model):
+                continue
+            try:
+                print(f"Precargando {model} en {backend.url}")
+                await _load(backend, model, keep_alive(model))
+                backend.loaded.setdefault(model, {})
+            except Exception as e:
+                print(f"No se pudo precargar {model} en {backend.url}: {e}")
+
+async def _unload_idle():
+    now = time.time()
+    running = {_name(m) for m in scheduler.status()["running_models"]}
+    for backend in ollama.backends:
+        if not backend.healthy or backend.client is None:
+            continue
+        for model, info in list(backend.loaded.items()):
+            name = _name(model)
+            if (info.get("size") or 0) < LARGE_MODEL_BYTES or name in running:
+                continue
+            if in_business_hours() and name in _PRELOAD:
+                continue
+            if now - _last_used.get(name, 0) < IDLE_UNLOAD_SECONDS:
+                continue
+            try:
+                await _load(backend, model, 0)
+                backend.loaded.pop(model, None)
+                print(f"Modelo {model} descargado de {backend.url} por inactividad")
+            except Exception as e:
+                print(f"No se pudo descargar {model} de {backend.url}: {e}")
+
+async def _loop():
+    await _warm(PRELOAD_MODELS)
+    while True:
+        await asyncio.sleep(CHECK_INTERVAL)
+        try:
+            await _unload_idle()
+            if in_business_hours():
+                # Rellenar nodos vacíos con los modelos precargados (sin desalojar otros modelos)
+                idle = [m for m in PRELOAD_MODELS if not any(ollama.has_model(b.loaded, m) for b in ollama.backends)]
+                if idle:
+                    await _warm(idle, only_empty=True)
+        except Exception as e:
+            print(f"Error gestionando los modelos en memoria: {e}")
+
+async def start():
+    global _task
+    # La primera carga puede tardar decenas de segundos: no bloquea el arranque
+    _task = asyncio.create_task(_loop())
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+def status() -> dict:
+    loaded = []
+    for backend in ollama.backends:
+        for model, info in backend.loaded.items():
+            last = _last_used.get(_name(model))
+            loaded.append({
+                "model": model,
+                "backend": backend.url,
+                "size": info.get("size"),
+                "size_vram": info.get("size_vram"),
+                "expires_at": info.get("expires_at"),
+                "last_used": datetime.fromtimestamp(last).isoformat() if last else None,
+                "requests": _requests[_name(model)],
+            })
+    return {
+        "business_hours": in_business_hours(),
+        "preload": PRELOAD_MODELS,
+        "loaded": loaded,
+    }
@@ -0,0 +1,155 @@
+# response_cache.py
+# Caché opcional de respuestas del chat en Redis. La clave combina el prompt normalizado, el modelo,
+# el hash del contexto recuperado, el historial de la sesión y los parámetros de muestreo; un segundo nivel (opcional) reconoce
+# prompts casi idénticos comparando embeddings.
+
+import os
+import json
+import math
+import time
+import array
+import hashlib
+import unicodedata
+from typing import Optional
+
+import metrics
+import retrieval
+from database import redis_client
+
+# Vida de cada respuesta cacheada y máximo de entradas (las menos usadas se expulsan primero)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 86400))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 10000))
+# Nivel semántico: similitud coseno mínima para reutilizar la respuesta de un prompt parecido (0 = desactivado)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0))
+# Prompts comparados como máximo por cada combinación de modelo/contexto/muestreo
+SEMANTIC_CANDIDATES = 200
+# Tamaño de los trozos al reproducir una respuesta cacheada
+REPLAY_CHUNK_CHARS = 64
+
+PREFIX = "rcache"
+LRU_KEY = f"{PREFIX}:lru"
+STATS_KEY = f"{PREFIX}:stats"
+
+def normalize_prompt(prompt: str) -> str:
+    # Sin tocar mayúsculas ni indentación: en prompts con código cambian el significado
+    text = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n")
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def scope_key(model: str, context: str, options: Optional[dict], history: Optional[list] = None) -> str:
+    """Todo lo que, además del prompt, determina la respuesta (incluido el historial que ve el modelo)."""
+    return _digest(model, hashlib.sha256(context.encode("utf-8")).hexdigest(), options or {}, _digest(history or []))
+
+def entry_key(scope: str, prompt: str) -> str:
+    return _digest(scope, normalize_prompt(prompt))
+
+def _pack(vector: list) -> bytes:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return array.array("f", (x / norm for x in vector)).tobytes()
+
+def _unpack(data: bytes) -> array.array:
+    vector = array.array("f")
+    vector.frombytes(data)
+    return vector
+
+# Campos de STATS_KEY que se publican también en /metrics (Redis suma todas las réplicas; Prometheus, por proceso)
+_COUNTERS = {
+    "hits": metrics.RESPONSE_CACHE_HITS,
+    "misses": metrics.RESPONSE_CACHE_MISSES,
+    "latency_saved_seconds": metrics.RESPONSE_CACHE_SAVED,
+}
+
+async def _record(field: str, amount: float = 1):
+    if field in _COUNTERS:
+        _COUNTERS[field].inc(amount)
+    await redis_client.hincrbyfloat(STATS_KEY, field, amount)
+
+async def lookup(scope: str, prompt: str) -> Optional[dict]:
+    """Entrada cacheada para el prompt ({response, elapsed, similarity}) o None."""
+    key = entry_key(scope, prompt)
+    cached = await redis_client.get(f"{PREFIX}:entry:{key}")
+    similarity = 1.0
+    if cached is None and RESPONSE_CACHE_SIMILARITY > 0:
+        key, similarity = await _nearest(scope, prompt)
+        if key:
+            cached = await redis_client.get(f"{PREFIX}:entry:{key}")
+    if cached is None:
+        await _record("misses")
+        return None
+
+    entry = json.loads(cached)
+    entry["similarity"] = similarity
+    # Renovar la posición LRU y el TTL
+    await redis_client.zadd(LRU_KEY, {key: time.time()})
+    await redis_client.expire(f"{PREFIX}:entry:{key}", RESPONSE_CACHE_TTL)
+    await _record("hits")
+    if similarity < 1.0:
+        await _record("semantic_hits")
+    await _record("latency_saved_seconds", entry.get("elapsed", 0))
+    return entry
+
+async def _nearest(scope: str, prompt: str):
+    vectors = await redis_client.hgetall(f"{PREFIX}:vectors:{scope}")
+    if not vectors:
+        return None, 0.0
+    try:
+        [query] = await retrieval.embed([normalize_prompt(prompt)])
+    except Exception as e:
+        print(f"Caché semántica no disponible: {e}")
+        return None, 0.0
+    query = _unpack(_pack(query))
+    best_key, best = None, RESPONSE_CACHE_SIMILARITY
+    for key, data in vectors.items():
+        score = sum(a * b for a, b in zip(query, _unpack(data)))
+        if score >= best:
+            best_key, best = key.decode(), score
+    return best_key, best
+
+async def store(scope: str, prompt: str, response: str, elapsed: float):
+    key = entry_key(scope, prompt)
+    entry = {"response": response, "elapsed": elapsed, "created_at": time.time()}
+    await redis_client.set(f"{PREFIX}:entry:{key}", json.dumps(entry), ex=RESPONSE_CACHE_TTL)
+    await redis_client.zadd(LRU_KEY, {key: time.time()})
+    await _record("stores")
+
+    if RESPONSE_CACHE_SIMILARITY > 0:
+        vectors_key = f"{PREFIX}:vectors:{scope}"
+        try:
+            [vector] = await retrieval.embed([normalize_prompt(prompt)])
+            await redis_client.hset(vectors_key, key, _pack(vector))
+            await redis_client.expire(vectors_key, RESPONSE_CACHE_TTL)
+            if await redis_client.hlen(vectors_key) > SEMANTIC_CANDIDATES:
+                # Se descarta un candidato cualquiera; la entrada sigue accesible por clave exacta
+                oldest = await redis_client.hrandfield(vectors_key)
+                await redis_client.hdel(vectors_key, oldest)
+        except Exception as e:
+            print(f"No se pudo indexar el prompt en la caché semántica: {e}")
+
+    await _evict()
+
+async def _evict():
+    excess = await redis_client.zcard(LRU_KEY) - RESPONSE_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return
+    for key, _ in await redis_client.zpopmin(LRU_KEY, excess):
+        await redis_client.delete(f"{PREFIX}:entry:{key.decode()}")
+
+def replay(response: str):
+    """Trozos de una respuesta cacheada, para devolverla por el mismo camino que un stream."""
+    for i in range(0, len(response), REPLAY_CHUNK_CHARS):
+        yield response[i:i + REPLAY_CHUNK_CHARS]
+
+async def stats() -> dict:
+    raw = {k.decode(): float(v) for k, v in (await redis_client.hgetall(STATS_KEY)).items()}
+    hits, misses = raw.get("hits", 0), raw.get("misses", 0)
+    return {
+        "hits": int(hits),
+        "semantic_hits": int(raw.get("semantic_hits", 0)),
+        "misses": int(misses),
+        "stores": int(raw.get("stores", 0)),
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "latency_saved_seconds": raw.get("latency_saved_seconds", 0.0),
+        "entries": await redis_client.zcard(LRU_KEY),
+    }
@@ -0,0 +1,188 @@
+# retrieval.py
+# Recuperación sobre la base de conocimiento: texto completo (índice GIN) y semántica (fragmentos + embeddings en pgvector).
+
+import os
+import re
+import asyncio
+from datetime import datetime
+from sqlalchemy import select, delete, exists, func, or_, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import ollama
+from chunking import chunk_document
+from database import AsyncSessionLocal, KnowledgePage, KnowledgeChunk
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+# Candidatos que explora HNSW por consulta (más alto = mejor recall, más lento)
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+# Páginas procesadas por transacción en el job de embeddings
+JOB_PAGE_BATCH = 50
+# Conjunto de candidatos que la búsqueda de texto puntúa entero con ts_rank_cd. Un término que aparece
+# en más filas es demasiado común para elegir candidatos (solo cuenta para el ranking); si todos lo son,
+# se puntúa una muestra de este tamaño en lugar de leer el tsvector de medio corpus
+FTS_MAX_CANDIDATES = int(os.getenv("FTS_MAX_CANDIDATES", 1000))
+
+async def embed(texts: list) -> list:
+    """Embeddings en lote vía /api/embed de Ollama."""
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        response = await ollama.post("/api/embed", {"model": EMBED_MODEL, "input": texts[i:i + EMBED_BATCH_SIZE]})
+        response.raise_for_status()
+        vectors.extend(response.json()["embeddings"])
+    return vectors
+
+async def semantic_search(db: AsyncSession, query: str, k: int = 5) -> list:
+    """Top-k fragmentos por similitud coseno. Devuelve [(fragmento, página, similitud)]."""
+    [vector] = await embed([query])
+    # SET LOCAL no admite parámetros; el valor es un entero de configuración
+    await db.execute(text(f"SET LOCAL hnsw.ef_search = {int(HNSW_EF_SEARCH)}"))
+    distance = KnowledgeChunk.embedding.cosine_distance(vector)
+    rows = (await db.execute(
+        select(KnowledgeChunk, KnowledgePage, distance.label("distance"))
+        .join(KnowledgePage, KnowledgeChunk.page_id == KnowledgePage.id)
+        .where(KnowledgeChunk.embedding.is_not(None))
+        .order_by(distance)
+        .limit(k)
+    )).all()
+    return [(chunk, page, 1 - dist) for chunk, page, dist in rows]
+
+def _tsquery(terms: list, operator: str):
+    # Solo se usan caracteres de palabra, así que la sintaxis de to_tsquery no puede romperse
+    expression = f" {operator} ".join(terms)
+    return func.to_tsquery("spanish", expression).op("||")(func.to_tsquery("english", expression))
+
+def _matches(model, terms: list, operator: str):
+    return model.search_vector.op("@@")(_tsquery(terms, operator))
+
+async def _candidate_counts(db: AsyncSession, model, conditions: list) -> list:
+    """Filas que cumple cada condición, contadas como mucho hasta FTS_MAX_CANDIDATES + 1 (el índice GIN
+    resuelve enseguida las poco frecuentes y el LIMIT corta las comunes). Una sola consulta."""
+    counts = [
+        select(func.count()).select_from(
+            select(model.id).where(condition).limit(FTS_MAX_CANDIDATES + 1).subquery()
+        ).scalar_subquery()
+        for condition in conditions
+    ]
+    return list((await db.execute(select(*counts))).one())
+
+async def _full_text(db: AsyncSession, model, entities: tuple, query: str, k: int, join=None) -> list:
+    """Top-k filas de `model` por texto completo, ordenadas por ts_rank_cd. Primero las que tienen todos
+    los términos; si no llegan a k, se completa con las que tienen alguno (una pregunta en lenguaje natural
+    rara vez contiene todas las palabras del documento). El ranking es exacto sobre los candidatos, que
+    se acotan a FTS_MAX_CANDIDATES por término: en la segunda pasada solo aportan candidatos los términos
+    poco comunes, y solo si todos son comunes se puntúa una muestra."""
+    terms = list(dict.fromkeys(re.findall(r"\w+", query)))
+    if not terms:
+        return []
+    # Se puntúa siempre contra todos los términos, así los rangos de ambas pasadas son comparables
+    rank = func.ts_rank_cd(model.search_vector, _tsquery(terms, "|")).label("rank")
+
+    def sample(condition):
+        # El LIMIT también impide que el planificador aplane la subconsulta y puntúe la tabla entera
+        return model.id.in_(select(model.id).where(condition).limit(FTS_MAX_CANDIDATES))
+
+    every = _matches(model, terms, "&")
+    per_term = [_matches(model, [term], "|") for term in terms] if len(terms) > 1 else []
+    *term_counts, every_count = await _candidate_counts(db, model, per_term + [every])
+    passes = [every if every_count <= FTS_MAX_CANDIDATES else sample(every)]
+    if len(terms) > 1:
+        selective = [term for term, count in zip(terms, term_counts) if count <= FTS_MAX_CANDIDATES]
+        # Con términos poco comunes el candidato máximo es len(selective) * FTS_MAX_CANDIDATES filas
+        passes.append(_matches(model, selective, "|") if selective else sample(_matches(model, terms, "|")))
+
+    rows, seen = [], set()
+    for condition in passes:
+        statement = select(*entities, rank).where(condition)
+        if join is not None:
+            statement = statement.join(*join)
+        # El id desempata: con rangos iguales el resultado no depende del plan de ejecución
+        for row in (await db.execute(statement.order_by(rank.desc(), model.id).limit(k))).all():
+            if row[0].id not in seen:
+                seen.add(row[0].id)
+                rows.append(row)
+        if len(rows) >= k:
+            break
+    return rows[:k]
+
+async def keyword_search(db: AsyncSession, query: str, k: int = 5) -> list:
+    """Top-k páginas por búsqueda de texto completo (índice GIN) ordenadas por ts_rank_cd. Devuelve [(página, rank)]."""
+    rows = await _full_text(db, KnowledgePage, (KnowledgePage,), query, k)
+    return [(page, score) for page, score in rows]
+
+async def chunk_keyword_search(db: AsyncSession, query: str, k: int = 20) -> list:
+    """Como keyword_search pero a nivel de fragmento. Devuelve [(fragmento, página, rank)]."""
+    rows = await _full_text(
+        db, KnowledgeChunk, (KnowledgeChunk, KnowledgePage), query, k,
+        join=(KnowledgePage, KnowledgeChunk.page_id == KnowledgePage.id),
+    )
+    return [(chunk, page, score) for chunk, page, score in rows]
+
+# --- Job de (re)generación de embeddings ---
+embedding_job = {"status": "idle", "total": 0, "done": 0, "chunks": 0, "errors": 0, "started_at": None, "finished_at": None}
+_job_lock = asyncio.Lock()
+# Pedido de indexación recibido mientras el job corría: se hace otra pasada al terminar
+_rerun_requested = False
+
+async def _embed_pages(db: AsyncSession, pages: list) -> int:
+    chunks = [
+        KnowledgeChunk(
+            page_id=page.id, chunk_index=i, content=chunk.text,
+            start_byte=chunk.start_byte, end_byte=chunk.end_byte, start_line=chunk.start_line, end_line=chunk.end_line,
+        )
+        for page in pages
+        for i, chunk in enumerate(chunk_document(page.content or "", page.filename))
+    ]
+    vectors = await embed([c.content for c in chunks]) if chunks else []
+    for chunk, vector in zip(chunks, vectors):
+        chunk.embedding = vector
+
+    # Reemplazo atómico de los fragmentos de estas páginas
+    await db.execute(delete(KnowledgeChunk).where(KnowledgeChunk.page_id.in_([p.id for p in pages])))
+    db.add_all(chunks)
+    await db.commit()
+    return len(chunks)
+
+async def run_embedding_job(full: bool = False):
+    """Genera embeddings de las páginas sin fragmentos (o de todas si full=True, ej. al cambiar de modelo)."""
+    global _rerun_requested
+    if _job_lock.locked():
+        _rerun_requested = True
+        return
+    async with _job_lock:
+        while True:
+            _rerun_requested = False
+            await _run_embedding_pass(full)
+            if not _rerun_requested:
+                break
+            full = False
+
+async def _run_embedding_pass(full: bool):
+    embedding_job.update(status="running", done=0, chunks=0, errors=0, started_at=datetime.utcnow(), finished_at=None)
+    try:
+        async with AsyncSessionLocal() as db:
+            query = select(KnowledgePage.id).order_by(KnowledgePage.id)
+            if not full:
+                # Páginas sin fragmentos o con fragmentos antiguos sin rango de líneas
+                query = query.where(or_(
+                    ~exists().where(KnowledgeChunk.page_id == KnowledgePage.id),
+                    exists().where(KnowledgeChunk.page_id == KnowledgePage.id, KnowledgeChunk.start_line.is_(None)),
+                ))
+            page_ids = (await db.execute(query)).scalars().all()
+            embedding_job["total"] = len(page_ids)
+
+            for i in range(0, len(page_ids), JOB_PAGE_BATCH):
+                batch_ids = page_ids[i:i + JOB_PAGE_BATCH]
+                pages = (await db.execute(select(KnowledgePage).where(KnowledgePage.id.in_(batch_ids)))).scalars().all()
+                try:
+                    embedding_job["chunks"] += await _embed_pages(db, pages)
+                except Exception as e:
+                    await db.rollback()
+                    embedding_job["errors"] += len(batch_ids)
+                    print(f"Error generando embeddings: {e}")
+                embedding_job["done"] += len(batch_ids)
+        embedding_job["status"] = "finished"
+    except Exception as e:
+        embedding_job["status"] = f"error: {e}"
+    finally:
+        embedding_job["finished_at"] = datetime.utcnow()
@@ -0,0 +1,167 @@
+# scheduler.py
+# Planificador en proceso delante de Ollama: limita la concurrencia global a la que Ollama
+# atiende en paralelo, reparte los turnos entre usuarios con Weighted Fair Queueing y agrupa
+# las peticiones por modelo para no descargar/cargar modelos en cada petición.
+
+import os
+import time
+import asyncio
+import itertools
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+# Debe coincidir con OLLAMA_NUM_PARALLEL de los contenedores de Ollama (por nodo)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 2))
+# Peticiones simultáneas (en ejecución) por usuario
+USER_MAX_ACTIVE = int(os.getenv("SCHEDULER_USER_MAX_ACTIVE", 1))
+# Token bucket por usuario: peticiones por minuto sostenidas y ráfaga máxima
+USER_RATE_PER_MINUTE = float(os.getenv("SCHEDULER_USER_RATE", 30))
+USER_BURST = float(os.getenv("SCHEDULER_USER_BURST", 10))
+# Segundos que puede esperar una petición de otro modelo antes de forzar el cambio de modelo
+MODEL_SWITCH_WAIT = float(os.getenv("SCHEDULER_MODEL_SWITCH_WAIT", 30))
+# Cada cuánto se informa la posición en cola a los clientes que esperan
+POSITION_INTERVAL = 1.0
+# Prefijo de las líneas de estado que se envían en el stream antes del primer token
+QUEUE_STATUS_PREFIX = "⏳ En cola"
+
+# Trabajos internos (títulos, resúmenes): sin límite de ritmo y con menos peso
+SYSTEM_USER = "__system__"
+SYSTEM_WEIGHT = 0.5
+
+class Ticket:
+    def __init__(self, user: str, model: str, weight: float, finish: float, seq: int, max_active: int):
+        self.user = user
+        self.model = model
+        self.weight = weight
+        self.max_active = max_active # Peticiones simultáneas que admite para su usuario
+        self.finish = finish # Tiempo virtual de fin (WFQ)
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = asyncio.Event()
+
+    def order(self):
+        return (self.finish, self.seq)
+
+_capacity = OLLAMA_NUM_PARALLEL
+_waiting = []
+_running = defaultdict(int)         # usuario -> peticiones en ejecución
+_running_models = defaultdict(int)  # modelo -> peticiones en ejecución
+_last_model: Optional[str] = None
+_virtual_time = 0.0
+_last_finish = {}                   # usuario -> tiempo virtual de fin de su última petición
+_buckets = {}                       # usuario -> (tokens, instante)
+_seq = itertools.count()
+
+def set_capacity(backends: int):
+    """Huecos totales: OLLAMA_NUM_PARALLEL por cada backend de Ollama sano."""
+    global _capacity
+    _capacity = OLLAMA_NUM_PARALLEL * max(1, backends)
+    _dispatch()
+
+def take_token(user: str) -> float:
+    """Consume un token del bucket del usuario. Devuelve 0 si se admite, o los segundos hasta el próximo token."""
+    if user == SYSTEM_USER:
+        return 0.0
+    now = time.monotonic()
+    tokens, last = _buckets.get(user, (USER_BURST, now))
+    tokens = min(USER_BURST, tokens + (now - last) * USER_RATE_PER_MINUTE / 60)
+    if tokens < 1:
+        _buckets[user] = (tokens, now)
+        return (1 - tokens) * 60 / USER_RATE_PER_MINUTE
+    _buckets[user] = (tokens - 1, now)
+    return 0.0
+
+def submit(user: str, model: str, weight: Optional[float] = None, max_active: Optional[int] = None) -> Ticket:
+    """Encola una petición. El ticket se concede cuando hay hueco y le toca por reparto justo.
+    max_active permite a un trabajo en paralelo (ej: map-reduce de /analyze) superar USER_MAX_ACTIVE."""
+    if weight is None:
+        weight = SYSTEM_WEIGHT if user == SYSTEM_USER else 1.0
+    # Self-clocked fair queueing: cada petición cuesta 1 / peso en tiempo virtual
+    start = max(_virtual_time, _last_finish.get(user, 0.0))
+    ticket = Ticket(user, model, weight, start + 1.0 / weight, next(_seq), max_active or USER_MAX_ACTIVE)
+    _last_finish[user] = ticket.finish
+    _waiting.append(ticket)
+    _dispatch()
+    return ticket
+
+def position(ticket: Ticket) -> int:
+    """Posición aproximada en la cola (1 = el siguiente). 0 si ya está en ejecución."""
+    if ticket.granted.is_set():
+        return 0
+    return 1 + sum(1 for t in _waiting if t.order() < ticket.order())
+
+def release(ticket: Ticket):
+    """Libera el hueco de una petición terminada o la saca de la cola si aún esperaba."""
+    if ticket.granted.is_set():
+        _running[ticket.user] -= 1
+        if not _running[ticket.user]:
+            del _running[ticket.user]
+        _running_models[ticket.model] -= 1
+        if not _running_models[ticket.model]:
+            del _running_models[ticket.model]
+    elif ticket in _waiting:
+        _waiting.remove(ticket)
+    _dispatch()
+
+def _pick(eligible: list) -> Ticket:
+    # Afinidad de modelo: se vacía la cola del modelo cargado antes de cambiar,
+    # salvo que otro modelo lleve esperando demasiado
+    loaded = set(_running_models) or ({_last_model} if _last_model else set())
+    preferred = [t for t in eligible if t.model in loaded]
+    others = [t for t in eligible if t.model not in loaded]
+    if preferred and others:
+        oldest = min(t.enqueued_at for t in others)
+        if time.monotonic() - oldest < MODEL_SWITCH_WAIT:
+            eligible = preferred
+    return min(eligible, key=Ticket.order)
+
+def _dispatch():
+    global _virtual_time, _last_model
+    while _waiting and sum(_running.values()) < _capacity:
+        eligible = [t for t in _waiting if _running.get(t.user, 0) < t.max_active]
+        if not eligible:
+            return
+        ticket = _pick(eligible)
+        _waiting.remove(ticket)
+        _running[ticket.user] += 1
+        _running_models[ticket.model] += 1
+        _last_model = ticket.model
+        _virtual_time = max(_virtual_time, ticket.finish - 1.0 / ticket.weight)
+        ticket.granted.set()
+    if not _waiting and not _running:
+        # Sistema ocioso: se reinicia el reloj virtual para que no crezca indefinidamente
+        _last_finish.clear()
+        _virtual_time = 0.0
+
+async def wait(ticket: Ticket):
+    """Espera el turno e informa la posición en cola cada vez que cambia (async generator)."""
+    last = None
+    while not ticket.granted.is_set():
+        current = position(ticket)
+        if current != last:
+            last = current
+            yield current
+        try:
+            await asyncio.wait_for(ticket.granted.wait(), POSITION_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+@asynccontextmanager
+async def slot(user: str, model: str, weight: Optional[float] = None, max_active: Optional[int] = None):
+    """Ejecuta un bloque con un hueco de Ollama concedido (sin informar posición)."""
+    ticket = submit(user, model, weight, max_active)
+    try:
+        await ticket.granted.wait()
+        yield ticket
+    finally:
+        release(ticket)
+
+def status() -> dict:
+    return {
+        "parallel": _capacity,
+        "running": sum(_running.values()),
+        "queued": len(_waiting),
+        "running_models": dict(_running_models),
+        "queued_by_model": {model: sum(1 for t in _waiting if t.model == model) for model in {t.model for t in _waiting}},
+    }
@@ -0,0 +1,117 @@
+# titles.py
+# Cola en segundo plano para generar los títulos de las sesiones sin retrasar la respuesta del chat.
+
+import os
+import json
+import asyncio
+from typing import Optional
+from sqlalchemy import select, update
+
+import ollama
+from database import AsyncSessionLocal, ChatSession, ChatMessage
+
+# Modelo pequeño para los títulos (ej: "tinyllama"). Vacío = usar el mismo modelo del chat.
+TITLE_MODEL = os.getenv("TITLE_MODEL", "")
+# Máximo de títulos pendientes que se resuelven en una sola llamada a Ollama cuando la cola se acumula
+TITLE_BATCH_SIZE = int(os.getenv("TITLE_BATCH_SIZE", 8))
+TITLE_PLACEHOLDER = "Nueva conversación"
+# Modelo para sesiones recuperadas al arrancar (mismo valor por defecto que ChatRequest.model)
+FALLBACK_MODEL = "gpt-oss:20b"
+
+_queue: Optional[asyncio.Queue] = None
+_worker_task: Optional[asyncio.Task] = None
+
+def enqueue(session_id: str, prompt: str, model: str):
+    """Encola la generación del título de una sesión nueva. No bloquea."""
+    if _queue is None:
+        return
+    _queue.put_nowait((session_id, prompt, TITLE_MODEL or model))
+
+async def start():
+    global _queue, _worker_task
+    _queue = asyncio.Queue()
+    _worker_task = asyncio.create_task(_worker())
+    await _recover_pending()
+
+async def stop():
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+async def _recover_pending():
+    # Sesiones que quedaron sin título (ej: reinicio de la API con la cola llena)
+    async with AsyncSessionLocal() as db:
+        first_msg = (
+            select(ChatMessage.session_id, ChatMessage.content)
+            .where(ChatMessage.role == "user")
+            .distinct(ChatMessage.session_id)
+            .order_by(ChatMessage.session_id, ChatMessage.id)
+            .subquery()
+        )
+        rows = (await db.execute(
+            select(ChatSession.id, first_msg.c.content)
+            .join(first_msg, first_msg.c.session_id == ChatSession.id)
+            .where(ChatSession.description.is_(None))
+            .limit(100)
+        )).all()
+    for session_id, prompt in rows:
+        enqueue(session_id, prompt, FALLBACK_MODEL)
+
+def _clean_title(title: str) -> str:
+    return title.strip().replace('"', '')[:120] or TITLE_PLACEHOLDER
+
+async def _generate_one(model: str, prompt: str) -> str:
+    title_prompt = f"Genera un título muy corto (máximo 5 palabras) que resuma esto: '{prompt[:1000]}'. Solo devuelve el título, nada más."
+    return _clean_title(await ollama.generate(model, title_prompt))
+
+async def _generate_batch(model: str, prompts: list) -> list:
+    if len(prompts) == 1:
+        return [await _generate_one(model, prompts[0])]
+    # Varios títulos en una sola generación: un único turno del modelo en vez de N
+    listing = "\n".join(f"{i+1}. '{p[:500]}'" for i, p in enumerate(prompts))
+    batch_prompt = (
+        f"Genera un título muy corto (máximo 5 palabras) para cada uno de estos {len(prompts)} mensajes:\n{listing}\n\n"
+        "Devuelve SOLO un arreglo JSON de strings con los títulos, en el mismo orden."
+    )
+    response = await ollama.generate(model, batch_prompt)
+    try:
+        titles = json.loads(response[response.index("["):response.rindex("]") + 1])
+        if isinstance(titles, list) and len(titles) == len(prompts):
+            return [_clean_title(str(t)) for t in titles]
+    except ValueError:
+        pass
+    # El modelo no respetó el formato: generar uno por uno
+    return [await _generate_one(model, p) for p in prompts]
+
+async def _worker():
+    while True:
+        batch = [await _queue.get()]
+        # Si la cola se acumuló, tomar lo pendiente para resolverlo en lote
+        while len(batch) < TITLE_BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+
+        by_model = {}
+        for session_id, prompt, model in batch:
+            by_model.setdefault(model, []).append((session_id, prompt))
+
+        for model, items in by_model.items():
+            try:
+                titles = await _generate_batch(model, [p for _, p in items])
+            except Exception as e:
+                print(f"Error generando título: {e}")
+                titles = [TITLE_PLACEHOLDER] * len(items)
+            try:
+                async with AsyncSessionLocal() as db:
+                    for (session_id, _), title in zip(items, titles):
+                        await db.execute(update(ChatSession).where(ChatSession.id == session_id).values(description=title))
+                    await db.commit()
+            except Exception as e:
+                print(f"Error guardando títulos: {e}")
+
+        for _ in batch:
+            _queue.task_done()
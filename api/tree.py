@@ -0,0 +1,110 @@
+# tree.py
+# Listado recursivo de /context en una sola respuesta (explorador de archivos del frontend).
+# Cada directorio se lee con scandir y se cachea junto a su mtime: crear, borrar o renombrar
+# entradas cambia el mtime del directorio, así que mientras no cambie se reutiliza el listado.
+# Editar un archivo no cambia el mtime de su carpeta, así que el tamaño y el mtime de los archivos
+# se leen con stat en cada recorrido. Cada resultado lleva un token de versión; con `since` se
+# devuelven solo las diferencias.
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import ingest
+
+TREE_MAX_DEPTH = 32
+# Entradas máximas por respuesta (el resto se marca como truncado)
+TREE_MAX_ENTRIES = int(os.getenv("TREE_MAX_ENTRIES", 50000))
+DEFAULT_IGNORE_DIRS = ingest.IGNORE_DIRS | {"uploaded_context"}
+# Directorios cacheados y versiones recordadas para calcular diferencias
+DIR_CACHE_MAX = 20000
+SNAPSHOTS = 16
+
+_dirs = {}                 # ruta -> (mtime_ns, [(nombre, es_dir)])
+_snapshots = OrderedDict() # token -> {ruta: (es_dir, tamaño, mtime_ns)}
+_lock = threading.Lock()
+
+def _list_dir(path: str) -> list:
+    try:
+        # El mtime se toma antes de listar: un cambio durante el listado invalida la entrada en la próxima lectura
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    cached = _dirs.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    entries.append((entry.name, entry.is_dir()))
+                except OSError:
+                    continue
+    except OSError:
+        return []
+    if len(_dirs) >= DIR_CACHE_MAX:
+        _dirs.clear()
+    _dirs[path] = (mtime, entries)
+    return entries
+
+def _walk(root: str, max_depth: int, ignore_dirs: set, extensions: tuple, dirs_only: bool) -> tuple:
+    items = {}
+    stack = [(root, 1)]
+    while stack:
+        path, depth = stack.pop()
+        for name, is_dir in _list_dir(path):
+            if is_dir:
+                if name in ignore_dirs:
+                    continue
+            elif dirs_only or (extensions and not name.lower().endswith(extensions)):
+                continue
+            if len(items) >= TREE_MAX_ENTRIES:
+                return items, True
+            child = os.path.join(path, name)
+            if is_dir:
+                items[child] = (True, 0, 0) # En las carpetas no se informan tamaño ni mtime
+            else:
+                try:
+                    st = os.stat(child)
+                except OSError:
+                    continue # Borrado entre el listado y el stat
+                items[child] = (False, st.st_size, st.st_mtime_ns)
+            if is_dir and depth < max_depth:
+                stack.append((child, depth + 1))
+    return items, False
+
+def _item(path: str, value: tuple) -> dict:
+    is_dir, size, mtime_ns = value
+    return {"path": path, "is_directory": is_dir, "size": size, "mtime": mtime_ns // 1_000_000_000}
+
+def get_tree(root: str, max_depth: int, ignore_dirs: Optional[set] = None, extensions: Optional[list] = None,
+             dirs_only: bool = False, since: Optional[str] = None) -> dict:
+    """Subárbol completo (`items`) o, si `since` es una versión reciente, solo `added` (nuevos o modificados) y `removed`."""
+    max_depth = max(1, min(max_depth, TREE_MAX_DEPTH))
+    ignore = DEFAULT_IGNORE_DIRS if ignore_dirs is None else ignore_dirs
+    suffixes = tuple(e.lower() if e.startswith(".") else f".{e.lower()}" for e in extensions or [])
+    items, truncated = _walk(root, max_depth, ignore, suffixes, dirs_only)
+
+    # La versión identifica también la consulta: un token de otra raíz u otras opciones no sirve de base
+    query = (root, max_depth, sorted(ignore), suffixes, dirs_only)
+    version = hashlib.sha1(repr((query, sorted(items.items()))).encode()).hexdigest()[:16]
+    with _lock:
+        previous = _snapshots.get(since) if since else None
+        _snapshots[version] = items
+        _snapshots.move_to_end(version)
+        while len(_snapshots) > SNAPSHOTS:
+            _snapshots.popitem(last=False)
+
+    result = {"root": root, "version": version, "truncated": truncated}
+    if since == version:
+        result["unchanged"] = True
+    elif previous is not None:
+        result["added"] = [_item(p, v) for p, v in sorted(items.items()) if previous.get(p) != v]
+        result["removed"] = sorted(p for p in previous if p not in items)
+    else:
+        # Versión desconocida (o expulsada): listado completo
+        result["items"] = [_item(p, v) for p, v in sorted(items.items())]
+    return result
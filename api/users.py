@@ -0,0 +1,44 @@
+# users.py
+# Caché en memoria (por proceso) de username -> id de usuario. El chat y el listado de sesiones
+# la consultan en cada petición; así la búsqueda del usuario no pasa por PostgreSQL.
+
+import os
+import time
+from typing import Optional
+from sqlalchemy import select
+
+import metrics
+from database import UserDB
+
+# Segundos que se confía en una entrada. 0 = sin caché
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))
+USER_CACHE_MAX_ENTRIES = 10000
+
+_cache = {} # username -> (user_id, expira)
+
+def _cached(username: str) -> Optional[int]:
+    entry = _cache.get(username)
+    if entry and entry[1] > time.monotonic():
+        metrics.USER_CACHE.labels("hit").inc()
+        return entry[0]
+    metrics.USER_CACHE.labels("miss").inc()
+    return None
+
+def _remember(username: str, user_id: Optional[int]):
+    # Solo se cachean usuarios existentes: un username desconocido puede registrarse en otro proceso
+    if user_id is None or USER_CACHE_TTL <= 0:
+        return
+    if len(_cache) >= USER_CACHE_MAX_ENTRIES:
+        _cache.clear()
+    _cache[username] = (user_id, time.monotonic() + USER_CACHE_TTL)
+
+async def get_id(db, username: str) -> Optional[int]:
+    """Id del usuario o None si no existe."""
+    user_id = _cached(username)
+    if user_id is None:
+        user_id = (await db.execute(select(UserDB.id).where(UserDB.username == username))).scalar()
+        _remember(username, user_id)
+    return user_id
+
+def invalidate(username: str):
+    _cache.pop(username, None)
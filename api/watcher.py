@@ -0,0 +1,214 @@
+# watcher.py
+# Indexador continuo (opcional) de /context: detecta archivos creados, modificados o borrados
+# con inotify (watchdog) o, si no está disponible, con un sondeo que cachea los stat.
+
+import os
+import time
+import asyncio
+import threading
+from fastapi.concurrency import run_in_threadpool
+
+import ingest
+import retrieval
+from database import SessionLocal
+
+WATCHER_ENABLED = os.getenv("CONTEXT_WATCHER", "0") == "1"
+# auto = inotify si watchdog está instalado; poll = forzar sondeo (ej: volúmenes de Docker Desktop/WSL sin inotify)
+WATCHER_MODE = os.getenv("CONTEXT_WATCHER_MODE", "auto")
+# Segundos sin eventos sobre una ruta antes de indexarla (agrupa ráfagas de guardado)
+DEBOUNCE_SECONDS = float(os.getenv("CONTEXT_WATCHER_DEBOUNCE", 1.0))
+POLL_INTERVAL = float(os.getenv("CONTEXT_WATCHER_POLL_INTERVAL", 5.0))
+# Rutas indexadas por transacción
+MAX_BATCH = 500
+
+_pending = {} # ruta -> instante del último evento
+_lock = threading.Lock()
+_tasks = []
+_observer = None
+_embedding_task = None
+_embedding_requested = False
+
+def notify(path: str):
+    """Marca una ruta como pendiente de indexar. Seguro desde cualquier hilo."""
+    if ingest.is_ignored(path):
+        return
+    with _lock:
+        _pending[path] = time.monotonic()
+
+def _index(paths: list) -> dict:
+    with SessionLocal() as db:
+        return ingest.index_local_paths(db, paths)
+
+async def _embed_loop():
+    global _embedding_requested
+    while _embedding_requested:
+        _embedding_requested = False
+        try:
+            await retrieval.run_embedding_job()
+        except Exception as e:
+            print(f"Error generando embeddings de /context: {e}")
+
+def _schedule_embeddings():
+    """Lanza los embeddings en segundo plano sin bloquear el indexador; una sola tarea a la vez
+    (si ya hay una en curso, hace otra pasada al terminar para las páginas nuevas)."""
+    global _embedding_task, _embedding_requested
+    _embedding_requested = True
+    if _embedding_task is None or _embedding_task.done():
+        _embedding_task = asyncio.create_task(_embed_loop())
+
+def _sync() -> dict:
+    with SessionLocal() as db:
+        return ingest.run_local_sync(db)
+
+async def _catch_up():
+    # Ponerse al día con los cambios ocurridos mientras la API estaba apagada (incremental vía manifiesto).
+    # Corre en segundo plano para no retrasar el arranque; los eventos que lleguen mientras tanto quedan
+    # pendientes y se indexan al terminar, así no se indexa la misma ruta dos veces a la vez.
+    try:
+        stats = await run_in_threadpool(_sync)
+        if stats["indexed"]:
+            _schedule_embeddings()
+    except Exception as e:
+        print(f"Error sincronizando /context al arrancar: {e}")
+    await _flush_loop()
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(DEBOUNCE_SECONDS / 2)
+        if _observer is not None and _inotify_failed():
+            _fall_back_to_polling("un watch de inotify dejó de funcionar")
+        now = time.monotonic()
+        with _lock:
+            ready = [p for p, t in _pending.items() if now - t >= DEBOUNCE_SECONDS][:MAX_BATCH]
+            for p in ready:
+                del _pending[p]
+        if not ready:
+            continue
+        try:
+            stats = await run_in_threadpool(_index, ready)
+            if stats["indexed"]:
+                _schedule_embeddings()
+        except Exception as e:
+            print(f"Error en el indexador de /context: {e}")
+
+def _scan() -> dict:
+    """Firma (mtime, tamaño) de cada archivo indexable; scandir reutiliza el stat del listado."""
+    signatures = {}
+    stack = [ingest.LOCAL_CONTEXT_PATH]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in ingest.IGNORE_DIRS:
+                            stack.append(entry.path)
+                    elif ingest.is_indexable(entry.name):
+                        st = entry.stat()
+                        signatures[entry.path] = (st.st_mtime, st.st_size)
+        except OSError:
+            continue
+    return signatures
+
+async def _poll_loop():
+    cache = await run_in_threadpool(_scan)
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        current = await run_in_threadpool(_scan)
+        for path, signature in current.items():
+            if cache.get(path) != signature:
+                notify(path)
+        for path in cache.keys() - current.keys():
+            notify(path)
+        cache = current
+
+def _start_inotify(loop):
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+
+    root = os.path.normpath(ingest.LOCAL_CONTEXT_PATH)
+    observer = Observer()
+    watches = {} # Subcarpeta de primer nivel -> watch recursivo
+
+    # La raíz sin recursión y un watch recursivo por subcarpeta de primer nivel: las carpetas ignoradas
+    # de la raíz (.git, node_modules, venv...) no consumen watches de fs.inotify.max_user_watches
+    def watch(path: str):
+        if path not in watches and os.path.isdir(path) and not os.path.islink(path) and not ingest.is_ignored(path):
+            watches[path] = observer.schedule(handler, path, recursive=True)
+
+    def unwatch(path: str):
+        if path in watches:
+            observer.unschedule(watches.pop(path))
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.event_type in ("opened", "closed_no_write"):
+                return
+            notify(event.src_path)
+            dest_path = getattr(event, "dest_path", None)
+            if dest_path:
+                notify(dest_path)
+            if not event.is_directory:
+                return
+            try:
+                if event.event_type in ("deleted", "moved") and os.path.dirname(event.src_path) == root:
+                    unwatch(event.src_path)
+                new_path = dest_path if event.event_type == "moved" else event.src_path
+                if event.event_type in ("created", "moved") and os.path.dirname(new_path) == root:
+                    watch(new_path)
+            except OSError as e:
+                loop.call_soon_threadsafe(_fall_back_to_polling, e)
+
+    handler = Handler()
+    try:
+        observer.schedule(handler, root, recursive=False)
+        with os.scandir(root) as entries:
+            for entry in entries:
+                watch(os.path.join(root, entry.name))
+        observer.start()
+    except Exception:
+        observer.stop()
+        raise
+    return observer
+
+def _inotify_failed() -> bool:
+    # Un watch recursivo cuyo hilo murió con su carpeta aún en pie: falló al vigilar una subcarpeta
+    # nueva (sin watches libres). Los de carpetas borradas terminan solos y no cuentan.
+    return any(not emitter.is_alive() and os.path.isdir(emitter.watch.path) for emitter in list(_observer.emitters))
+
+def _fall_back_to_polling(error):
+    global _observer
+    if _observer is None:
+        return
+    print(f"inotify sin watches disponibles ({error}), usando sondeo cada {POLL_INTERVAL}s. Sube fs.inotify.max_user_watches para volver a inotify")
+    _observer.stop()
+    _observer = None
+    _tasks.append(asyncio.create_task(_poll_loop()))
+    # Lo cambiado mientras inotify no vigilaba: el sondeo solo detecta cambios posteriores a su primer recorrido
+    notify(ingest.LOCAL_CONTEXT_PATH)
+
+async def start():
+    global _observer
+    if not WATCHER_ENABLED or not os.path.isdir(ingest.LOCAL_CONTEXT_PATH):
+        return
+    if WATCHER_MODE != "poll":
+        try:
+            _observer = await run_in_threadpool(_start_inotify, asyncio.get_running_loop())
+        except Exception as e:
+            print(f"inotify no disponible ({e}), usando sondeo cada {POLL_INTERVAL}s")
+    if _observer is None:
+        _tasks.append(asyncio.create_task(_poll_loop()))
+    _tasks.append(asyncio.create_task(_catch_up()))
+    print(f"Indexador de /context activo ({'inotify' if _observer else 'sondeo'})")
+
+async def stop():
+    global _observer, _embedding_task
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    if _embedding_task is not None:
+        _embedding_task.cancel()
+        _embedding_task = None
+    if _observer is not None:
+        _observer.stop()
+        await run_in_threadpool(_observer.join)
+        _observer = None
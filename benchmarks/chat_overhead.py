@@ -0,0 +1,98 @@
+# Sobrecarga de /chat antes del stream (validar usuario, sesión, log de mensajes... hasta enviar las
+# cabeceras), con y sin la caché en memoria de usuarios. La API corre con uvicorn en este proceso
+# contra un Ollama simulado que responde al instante, así solo se mide el trabajo propio de la API.
+# Se lanzan las peticiones de una en una y en ráfagas concurrentes (donde pesa el pool de conexiones).
+# Se mide el tiempo hasta las cabeceras en el cliente y "setup" de la cabecera Server-Timing.
+#
+#   TEST_DATABASE_URL=postgresql://... REDIS_HOST=localhost python benchmarks/chat_overhead.py
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from support import API_DIR, FakeOllama, ServerThread, add_path, free_port, report
+
+if not os.getenv("TEST_DATABASE_URL"):
+    sys.exit("Define TEST_DATABASE_URL con una base de datos de pruebas (se registran usuarios y sesiones)")
+OLLAMA_PORT = free_port()
+os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{OLLAMA_PORT}"
+os.environ.pop("OLLAMA_URLS", None)
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("PDF_TEXT_CACHE_DIR", tempfile.mkdtemp(prefix="pdf_text_"))
+os.environ.setdefault("PRELOAD_MODELS", "")
+os.environ.setdefault("OLLAMA_NUM_PARALLEL", "1000")
+os.environ.setdefault("SCHEDULER_USER_MAX_ACTIVE", "1000")
+os.environ.setdefault("SCHEDULER_USER_RATE", "1000000")
+os.environ.setdefault("SCHEDULER_USER_BURST", "1000000")
+add_path(API_DIR)
+
+import httpx
+
+def _setup_time(response: httpx.Response) -> float:
+    """Duración de "setup" (segundos) en la cabecera Server-Timing."""
+    for part in response.headers.get("server-timing", "").split(","):
+        name, _, duration = part.strip().partition(";dur=")
+        if name == "setup":
+            return float(duration) / 1000
+    return 0.0
+
+async def _chat(client: httpx.AsyncClient, username: str, i: int, use_kb: bool) -> tuple:
+    """(tiempo hasta las cabeceras, setup en el servidor) de un /chat; el stream se lee completo."""
+    payload = {"username": username, "prompt": f"pregunta {i}", "use_kb": use_kb}
+    started = time.perf_counter()
+    async with client.stream("POST", "/chat", json=payload) as response:
+        headers = time.perf_counter() - started
+        assert response.status_code == 200, response.status_code
+        async for _ in response.aiter_bytes():
+            pass
+    return headers, _setup_time(response)
+
+async def _measure(api: str, username: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=api, limits=limits, timeout=120) as client:
+        for i in range(10): # Calentamiento (conexiones HTTP y del pool)
+            await _chat(client, username, i, args.kb)
+        sequential = [await _chat(client, username, i, args.kb) for i in range(args.requests)]
+        concurrent = []
+        for start in range(0, args.requests, args.concurrency):
+            burst = range(start, min(start + args.concurrency, args.requests))
+            concurrent += await asyncio.gather(*(_chat(client, username, i, args.kb) for i in burst))
+    return {"secuencial": sequential, f"{args.concurrency} concurrentes": concurrent}
+
+def run(args):
+    import main
+    import users
+    ollama = FakeOllama(tokens=1)
+    results = {}
+    with ServerThread(ollama.app, port=OLLAMA_PORT), ServerThread(main.app) as server:
+        username = f"bench-{uuid.uuid4().hex[:12]}"
+        httpx.post(f"{server.url}/register", json={"username": username, "password": "clave"}, timeout=30).raise_for_status()
+        ttl = users.USER_CACHE_TTL or 300
+        for label, cache_ttl in (("sin caché", 0), ("con caché", ttl)):
+            users.USER_CACHE_TTL = cache_ttl
+            users._cache.clear()
+            results[label] = asyncio.run(_measure(server.url, username, args))
+
+    print(f"\n/chat hasta las cabeceras: {args.requests} peticiones por modo, RAG {'activado' if args.kb else 'desactivado'}")
+    for mode in results["sin caché"]:
+        print(f"\n{mode}")
+        for label in results:
+            samples = results[label][mode]
+            report(f"{label}: cliente", [headers for headers, _ in samples])
+            report(f"{label}: setup (Server-Timing)", [setup for _, setup in samples])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--kb", action="store_true", help="Incluir la búsqueda RAG (embedding simulado)")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# corpus.py
+# Corpus sintético para los benchmarks de búsqueda: páginas de texto mixto (español/inglés más una cola
+# larga de términos poco frecuentes) y, opcionalmente, un fragmento por página con un embedding agrupado
+# en clusters (como los de un modelo real, para que el recall de HNSW tenga sentido). Todo se genera
+# en PostgreSQL con SQL, sin transferir el texto ni los vectores. Las filas llevan s3_key "bench://N"
+# y se reutilizan entre ejecuciones; --cleanup las borra.
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from support import API_DIR, add_path
+
+if not os.getenv("TEST_DATABASE_URL"):
+    sys.exit("Define TEST_DATABASE_URL con una base de datos de pruebas (se insertan miles de páginas)")
+os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+os.environ.setdefault("REDIS_HOST", "localhost")
+add_path(API_DIR)
+
+from sqlalchemy import text
+
+from database import engine, EMBED_DIM, KnowledgeChunk
+
+BENCH_PREFIX = "bench://"
+PAGE_WORDS = 200
+CLUSTERS = 200
+CLUSTER_NOISE = 0.3
+SEED_BATCH = 10000
+
+COMMON_WORDS = (
+    "servidor configuración usuario contraseña factura cliente proveedor contrato pago inventario "
+    "almacén pedido entrega reporte informe política seguridad acceso permiso cuenta correo red "
+    "respaldo copia restauración instalación actualización versión error registro sistema base datos "
+    "consulta tabla índice archivo carpeta documento manual procedimiento proceso aprobación gerencia "
+    "presupuesto compra venta nómina empleado vacaciones horario turno capacitación curso evaluación "
+    "server configuration user password invoice customer supplier contract payment inventory warehouse "
+    "order delivery report policy security access permission account email network backup restore "
+    "install update version error logging system database query table index file folder document "
+    "manual procedure process approval management budget purchase sale payroll employee schedule "
+    "training course evaluation deploy cluster container kubernetes docker pipeline monitoring alert"
+).split()
+_SYLLABLES = "ca me lo ri ta sen dor mi pla ne tro gu vel sa fi ro ba te ni lu co".split()
+
+def rare_words(count: int = 20000) -> list:
+    """Términos inventados de cuatro sílabas: cada uno aparece en pocas páginas."""
+    rng = random.Random(7)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(4)))
+    return sorted(words)
+
+RARE_WORDS = rare_words()
+
+def centroids() -> list:
+    rng = random.Random(11)
+    return [[rng.uniform(-0.5, 0.5) for _ in range(EMBED_DIM)] for _ in range(CLUSTERS)]
+
+def query_vector(rng: random.Random, centers: list) -> list:
+    center = rng.choice(centers)
+    return [x + rng.uniform(-CLUSTER_NOISE, CLUSTER_NOISE) / 2 for x in center]
+
+def common_query(rng: random.Random) -> str:
+    return " ".join(rng.sample(COMMON_WORDS, 4))
+
+def rare_query(rng: random.Random) -> str:
+    return " ".join(rng.sample(RARE_WORDS, 2))
+
+def mixed_query(rng: random.Random) -> str:
+    return " ".join(rng.sample(COMMON_WORDS, 2) + [rng.choice(RARE_WORDS)])
+
+def seeded_pages() -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT count(*) FROM knowledge_pages WHERE s3_key LIKE :p"), {"p": BENCH_PREFIX + "%"}).scalar()
+
+def seed_pages(total: int):
+    """Inserta las páginas que falten hasta tener `total`."""
+    existing = seeded_pages()
+    if existing >= total:
+        return
+    print(f"Generando {total - existing} páginas sintéticas...")
+    started = time.monotonic()
+    for start in range(existing + 1, total + 1, SEED_BATCH):
+        end = min(start + SEED_BATCH - 1, total)
+        with engine.begin() as conn:
+            # 70 % palabras frecuentes y 30 % de la cola larga; la subconsulta se correlaciona con g para
+            # que PostgreSQL genere un texto distinto por fila
+            conn.execute(text("""
+                INSERT INTO knowledge_pages (filename, s3_key, page_number, content, created_at)
+                SELECT 'bench-' || g || '.txt', :prefix || g, 1,
+                       (SELECT string_agg(CASE WHEN random() < 0.7
+                                               THEN (CAST(:common AS text[]))[1 + floor(random() * :n_common)::int]
+                                               ELSE (CAST(:rare AS text[]))[1 + floor(random() * :n_rare)::int] END, ' ')
+                        FROM generate_series(1, :words + 0 * g)),
+                       now()
+                FROM generate_series(:start, :end) AS g
+            """), {
+                "prefix": BENCH_PREFIX, "common": COMMON_WORDS, "n_common": len(COMMON_WORDS),
+                "rare": RARE_WORDS, "n_rare": len(RARE_WORDS), "words": PAGE_WORDS, "start": start, "end": end,
+            })
+        print(f"  {end} páginas ({time.monotonic() - started:.0f} s)")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE knowledge_pages"))
+
+def seed_chunks():
+    """Un fragmento con embedding por página sintética que aún no lo tenga.
+    Para cargas grandes el índice HNSW se reconstruye al final (mucho más rápido que insertar con él)."""
+    with engine.connect() as conn:
+        missing = conn.execute(text("""
+            SELECT count(*) FROM knowledge_pages p
+            WHERE p.s3_key LIKE :p AND NOT EXISTS (SELECT 1 FROM knowledge_chunks c WHERE c.page_id = p.id)
+        """), {"p": BENCH_PREFIX + "%"}).scalar()
+    if not missing:
+        return
+    print(f"Generando {missing} embeddings sintéticos...")
+    hnsw = next(i for i in KnowledgeChunk.__table__.indexes if i.name == "ix_knowledge_chunks_embedding_hnsw")
+    rebuild = missing >= SEED_BATCH
+    started = time.monotonic()
+    with engine.begin() as conn:
+        if rebuild:
+            hnsw.drop(conn)
+        conn.execute(text("CREATE TEMP TABLE bench_centroids (id int PRIMARY KEY, v float8[]) ON COMMIT DROP"))
+        conn.execute(text("INSERT INTO bench_centroids VALUES (:id, :v)"), [{"id": i, "v": v} for i, v in enumerate(centroids())])
+        conn.execute(text("""
+            INSERT INTO knowledge_chunks (page_id, chunk_index, content, start_byte, end_byte, start_line, end_line, embedding, created_at)
+            SELECT p.id, 0, p.content, 0, octet_length(p.content), 1, 1,
+                   (SELECT CAST(array_agg(x + (random() - 0.5) * :noise + 0 * p.id ORDER BY i) AS vector)
+                    FROM unnest(c.v) WITH ORDINALITY AS t(x, i)),
+                   now()
+            FROM knowledge_pages p
+            JOIN bench_centroids c ON c.id = p.id % :clusters
+            WHERE p.s3_key LIKE :p AND NOT EXISTS (SELECT 1 FROM knowledge_chunks k WHERE k.page_id = p.id)
+        """), {"noise": CLUSTER_NOISE, "clusters": CLUSTERS, "p": BENCH_PREFIX + "%"})
+        print(f"  fragmentos insertados ({time.monotonic() - started:.0f} s)")
+        if rebuild:
+            conn.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+            hnsw.create(conn)
+            print(f"  índice HNSW reconstruido ({time.monotonic() - started:.0f} s)")
+        conn.execute(text("ANALYZE knowledge_chunks"))
+
+def cleanup():
+    with engine.begin() as conn:
+        # Los fragmentos se borran en cascada
+        deleted = conn.execute(text("DELETE FROM knowledge_pages WHERE s3_key LIKE :p"), {"p": BENCH_PREFIX + "%"}).rowcount
+    print(f"{deleted} páginas sintéticas borradas")
@@ -0,0 +1,109 @@
+# Búsqueda por palabras clave: el camino anterior del chat (un ilike '%palabra%' por cada palabra de más
+# de 4 letras, unidos con OR, sin orden) frente a retrieval.keyword_search (tsvector + índice GIN,
+# ordenado por ts_rank_cd), sobre el mismo corpus sintético. Tres tipos de consulta: solo palabras
+# frecuentes (el ilike devuelve las 5 primeras filas que encuentra y corta el recorrido), solo términos
+# poco frecuentes (el ilike recorre buena parte de la tabla) y mezcla de ambos.
+#
+# Además de la latencia se mide la calidad del ranking: recall@k frente a un ranking exhaustivo con la
+# misma semántica (primero las páginas con todos los términos, luego las que tienen alguno, cada grupo
+# ordenado por ts_rank_cd sobre todas sus filas, sin límite de candidatos). Es lento con palabras
+# frecuentes, así que solo se calcula para las primeras --exact-queries consultas.
+#
+import time
+import random
+import asyncio
+import argparse
+
+from sqlalchemy import select, func, or_
+
+import corpus
+from support import report
+import retrieval
+from database import AsyncSessionLocal, KnowledgePage
+
+async def ilike_search(db, query: str, k: int = 5) -> list:
+    """Búsqueda anterior del chat (sin índice ni ranking)."""
+    keywords = [word for word in query.split() if len(word) > 4]
+    if not keywords:
+        return []
+    filters = [KnowledgePage.content.ilike(f"%{word}%") for word in keywords]
+    return (await db.execute(select(KnowledgePage).where(or_(*filters)).limit(k))).scalars().all()
+
+async def exact_search(db, query: str, k: int = 5) -> list:
+    """Ranking de referencia: la semántica de retrieval.keyword_search puntuando todas las filas."""
+    terms = list(dict.fromkeys(query.split()))
+    rank = func.ts_rank_cd(KnowledgePage.search_vector, retrieval._tsquery(terms, "|"))
+    pages = []
+    for operator in ("&", "|"):
+        condition = retrieval._matches(KnowledgePage, terms, operator)
+        ids = (await db.execute(
+            select(KnowledgePage.id).where(condition, KnowledgePage.id.not_in(pages or [0])).order_by(rank.desc(), KnowledgePage.id).limit(k - len(pages))
+        )).scalars().all()
+        pages += ids
+        if len(pages) >= k:
+            break
+    return pages
+
+def _ids(rows: list) -> list:
+    return [row[0].id if isinstance(row, tuple) else row.id for row in rows]
+
+async def measure(search, queries: list, k: int, truths: list = ()) -> tuple:
+    """(latencias, páginas devueltas de media, recall@k medio frente a `truths`)."""
+    samples, found, recall = [], 0, []
+    async with AsyncSessionLocal() as db:
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            rows = await search(db, query, k)
+            samples.append(time.perf_counter() - started)
+            found += len(rows)
+            if i < len(truths) and truths[i]:
+                recall.append(len(set(_ids(rows)) & set(truths[i])) / len(truths[i]))
+            await db.rollback()
+    return samples, found / len(queries), sum(recall) / len(recall) if recall else None
+
+async def reference(queries: list, k: int) -> list:
+    truths = []
+    async with AsyncSessionLocal() as db:
+        for query in queries:
+            truths.append(await exact_search(db, query, k))
+            await db.rollback()
+    return truths
+
+async def run(args):
+    rng = random.Random(args.seed)
+    workloads = {
+        "frecuentes": [corpus.common_query(rng) for _ in range(args.queries)],
+        "poco frecuentes": [corpus.rare_query(rng) for _ in range(args.queries)],
+        "mixtas": [corpus.mixed_query(rng) for _ in range(args.queries)],
+    }
+    print(f"\n{corpus.seeded_pages()} páginas sintéticas, {args.queries} consultas por tipo, k={args.k}, "
+          f"recall sobre {min(args.exact_queries, args.queries)} consultas")
+    for name, queries in workloads.items():
+        # Calentamiento de caché de la tabla y del índice con las primeras consultas
+        await measure(ilike_search, queries[:5], args.k)
+        await measure(retrieval.keyword_search, queries[:5], args.k)
+        truths = await reference(queries[:args.exact_queries], args.k)
+        old, old_found, old_recall = await measure(ilike_search, queries, args.k, truths)
+        new, new_found, new_recall = await measure(retrieval.keyword_search, queries, args.k, truths)
+        print(f"\nPalabras {name} (ej: \"{queries[0]}\")")
+        old_stats = report(f"or_(*ilike)    ({old_found:.1f} pág., recall {old_recall:.2f})", old)
+        new_stats = report(f"tsvector + GIN ({new_found:.1f} pág., recall {new_recall:.2f})", new)
+        print(f"p50 ilike / p50 índice: {old_stats['p50'] / new_stats['p50']:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--exact-queries", type=int, default=20, help="Consultas con ranking de referencia para el recall")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cleanup", action="store_true", help="Borrar el corpus sintético y salir")
+    args = parser.parse_args()
+    if args.cleanup:
+        corpus.cleanup()
+        return
+    corpus.seed_pages(args.pages)
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Latencia de la búsqueda semántica (pgvector + HNSW) sobre un corpus sintético de 100.000+ páginas.
+# Mide retrieval.semantic_search tal cual la usa el chat y la compara con el recorrido exacto (sin
+# índice), que además da el recall@k de HNSW. El embedding de la consulta no entra en la medición:
+# depende de Ollama, no de la base de datos.
+#
+#   TEST_DATABASE_URL=postgresql://... python benchmarks/retrieval_latency.py --pages 100000
+
+import time
+import random
+import asyncio
+import argparse
+
+from sqlalchemy import select, text
+
+import corpus
+from support import report
+import retrieval
+from database import AsyncSessionLocal, KnowledgeChunk
+
+async def exact_search(db, vector: list, k: int) -> list:
+    """Top-k exacto: el mismo ORDER BY sin índice (recorrido secuencial completo)."""
+    await db.execute(text("SET LOCAL enable_indexscan = off"))
+    distance = KnowledgeChunk.embedding.cosine_distance(vector)
+    return (await db.execute(
+        select(KnowledgeChunk.id).where(KnowledgeChunk.embedding.is_not(None)).order_by(distance).limit(k)
+    )).scalars().all()
+
+async def run(args):
+    rng = random.Random(args.seed)
+    centers = corpus.centroids()
+    queries = [corpus.query_vector(rng, centers) for _ in range(args.queries)]
+    vectors = iter(queries)
+
+    async def query_embedding(texts):
+        return [next(vectors)]
+    retrieval.embed = query_embedding
+    retrieval.HNSW_EF_SEARCH = args.ef_search
+
+    hnsw, exact, recall = [], [], []
+    async with AsyncSessionLocal() as db:
+        # Calentamiento: cargar el índice en memoria compartida antes de medir
+        for _ in range(min(20, args.queries)):
+            await db.execute(text(f"SET LOCAL hnsw.ef_search = {args.ef_search}"))
+            await db.execute(select(KnowledgeChunk.id).order_by(KnowledgeChunk.embedding.cosine_distance(queries[0])).limit(args.k))
+            await db.rollback()
+        for i, vector in enumerate(queries):
+            started = time.perf_counter()
+            rows = await retrieval.semantic_search(db, "consulta", args.k)
+            hnsw.append(time.perf_counter() - started)
+            found = {chunk.id for chunk, _, _ in rows}
+            await db.rollback()
+            if i < args.exact_queries:
+                started = time.perf_counter()
+                truth = await exact_search(db, vector, args.k)
+                exact.append(time.perf_counter() - started)
+                await db.rollback()
+                recall.append(len(found & set(truth)) / max(1, len(truth)))
+
+    print(f"\n{corpus.seeded_pages()} páginas sintéticas, {args.queries} consultas, k={args.k}, ef_search={args.ef_search}")
+    report("semantic_search (HNSW)", hnsw)
+    if exact:
+        report(f"recorrido exacto ({len(exact)} consultas)", exact)
+        print(f"recall@{args.k} de HNSW frente al exacto: {sum(recall) / len(recall):.3f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--exact-queries", type=int, default=50, help="Consultas que también se resuelven sin índice")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--ef-search", type=int, default=retrieval.HNSW_EF_SEARCH)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cleanup", action="store_true", help="Borrar el corpus sintético y salir")
+    args = parser.parse_args()
+    if args.cleanup:
+        corpus.cleanup()
+        return
+    corpus.seed_pages(args.pages)
+    corpus.seed_chunks()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Coste de dibujar una respuesta de 20.000 tokens en el frontend: el bucle anterior (decodificar cada
+# chunk por separado y redibujar la respuesta entera en cada uno) frente a streaming.StreamRenderer.
+# El placeholder de Streamlit se sustituye por uno que solo cuenta lo que se le envía: cada llamada a
+# markdown() es un mensaje al navegador, que vuelve a interpretar todo el texto recibido, así que los
+# bytes enviados miden el trabajo del navegador. El reloj se simula al ritmo de generación del modelo
+# (--tokens-per-second) para que la agrupación por tiempo se comporte como en vivo.
+#
+#   python benchmarks/stream_render.py --tokens 20000
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from support import FRONTEND_DIR, add_path
+
+add_path(FRONTEND_DIR)
+
+import streaming
+
+PROSE = "la configuración del servidor ñandú acción año pingüino database query the index is rebuilt".split()
+CODE_LINE = "    resultado = consulta(tabla, filtro=\"año\")  # comentario\n"
+
+class Placeholder:
+    """Sustituto de st.empty()/st.container(): acumula las llamadas y los bytes que irían al navegador."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def container(self):
+        return Placeholder(self.stats)
+
+    def empty(self, *args):
+        # Como st.empty() (crear el elemento) y como placeholder.empty() (vaciarlo)
+        return Placeholder(self.stats)
+
+    def markdown(self, text: str):
+        self.stats["renders"] += 1
+        self.stats["bytes"] += len(text.encode("utf-8"))
+
+    info = markdown
+
+def response_chunks(tokens: int, seed: int) -> list:
+    """Chunks de bytes de una respuesta con párrafos y bloques de código, uno por token como los reenvía
+    la API. Los tokens se cortan por bytes, así que algunos caracteres multibyte quedan partidos."""
+    rng = random.Random(seed)
+    pieces = []
+    while len(pieces) < tokens:
+        if rng.random() < 0.1:
+            pieces.append("```python\n")
+            pieces += [word + " " for word in CODE_LINE.split(" ")] * rng.randint(3, 15)
+            pieces.append("```\n\n")
+        else:
+            pieces += [rng.choice(PROSE) + " " for _ in range(rng.randint(20, 80))]
+            pieces.append("\n\n")
+    data = "".join(pieces[:tokens]).encode("utf-8")
+    size = max(1, -(-len(data) // tokens))
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def old_loop(chunks: list, message_placeholder, status_placeholder) -> str:
+    """Bucle de chat_interface() antes de StreamRenderer. decode() estricto lanzaba UnicodeDecodeError con
+    un carácter partido; aquí se reemplaza para poder completar la medición."""
+    raw_response = ""
+    full_response = ""
+    for chunk in chunks:
+        raw_response += chunk.decode("utf-8", errors="replace")
+        queue_status, full_response = streaming.split_queue_status(raw_response)
+        if queue_status and not full_response:
+            status_placeholder.info(queue_status)
+        else:
+            status_placeholder.info("💭 Generando respuesta...")
+        message_placeholder.markdown(full_response + "▌")
+    message_placeholder.markdown(full_response)
+    return full_response
+
+def renderer_loop(chunks: list, message_placeholder, status_placeholder) -> str:
+    renderer = streaming.StreamRenderer(message_placeholder, on_status=status_placeholder.info)
+    for chunk in chunks:
+        renderer.feed(chunk)
+    return renderer.finish()
+
+def measure(loop, chunks: list, tokens_per_second: float) -> dict:
+    stats = {"renders": 0, "bytes": 0}
+    clock = [0.0]
+    real_monotonic = streaming.time.monotonic
+    streaming.time.monotonic = lambda: clock[0]
+
+    def timed_chunks():
+        for chunk in chunks:
+            clock[0] += 1 / tokens_per_second
+            yield chunk
+    try:
+        started = time.perf_counter()
+        text = loop(timed_chunks(), Placeholder(stats), Placeholder(stats))
+        stats["cpu"] = time.perf_counter() - started
+    finally:
+        streaming.time.monotonic = real_monotonic
+    stats["text"] = text
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    chunks = response_chunks(args.tokens, args.seed)
+    characters = len(b"".join(chunks).decode("utf-8"))
+    print(f"\nRespuesta de {len(chunks)} chunks ({characters} caracteres) a {args.tokens_per_second:g} tokens/s")
+    for label, loop in (("bucle anterior", old_loop), ("StreamRenderer", renderer_loop)):
+        stats = measure(loop, chunks, args.tokens_per_second)
+        corrupted = stats["text"].count("\ufffd") # Carácter de reemplazo de decode()
+        print(
+            f"{label:<16} {stats['renders']:7d} mensajes  {stats['bytes'] / 1e6:10.1f} MB al navegador  "
+            f"{stats['cpu'] * 1000:8.1f} ms de CPU  {corrupted} caracteres corruptos"
+        )
+
+if __name__ == "__main__":
+    main()
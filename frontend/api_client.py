@@ -0,0 +1,256 @@
+# api_client.py
+# Acceso a la API desde el frontend. Todas las peticiones salen de una misma requests.Session con
+# pool de conexiones (compartida entre reruns y usuarios de Streamlit), y las lecturas que se repiten
+# en cada rerun (árbol de archivos, sesiones, modelos cargados, contenido de archivos) se cachean con
+# un TTL. Las escrituras en /context invalidan el árbol y el contenido de los archivos afectados.
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+API_URL = os.getenv("API_URL", "http://api:8000")
+# Conexiones abiertas que se reutilizan (el chat en streaming ocupa una mientras dura)
+POOL_SIZE = 20
+# Segundos que se reutiliza cada lectura antes de volver a pedirla
+TREE_TTL = 30
+SESSIONS_TTL = 15
+MODELS_TTL = 10
+FILE_TTL = 60
+# Contenido de archivos en memoria (compartido por todos los usuarios): se descartan los menos usados
+FILE_CACHE_MAX_ENTRIES = int(os.getenv("FILE_CACHE_MAX_ENTRIES", 500))
+FILE_CACHE_MAX_MB = int(os.getenv("FILE_CACHE_MAX_MB", 64))
+
+@st.cache_resource
+def session() -> requests.Session:
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+def get(path: str, **kwargs) -> requests.Response:
+    return session().get(f"{API_URL}{path}", **kwargs)
+
+def post(path: str, **kwargs) -> requests.Response:
+    return session().post(f"{API_URL}{path}", **kwargs)
+
+def delete(path: str, **kwargs) -> requests.Response:
+    return session().delete(f"{API_URL}{path}", **kwargs)
+
+# --- Árbol de archivos ---
+
+@st.cache_resource
+def _tree_versions() -> dict:
+    # Último árbol recibido por tipo (carpetas / todo): con su versión, /tree solo devuelve los cambios
+    return {}
+
+@st.cache_data(ttl=TREE_TTL, show_spinner=False)
+def _tree(dirs_only: bool) -> dict:
+    versions = _tree_versions()
+    cached = versions.get(dirs_only)
+    params = {"path": "/context", "dirs_only": dirs_only}
+    if cached:
+        params["since"] = cached["version"]
+    res = get("/tree", params=params, timeout=30)
+    res.raise_for_status()
+    data = res.json()
+    if "items" in data:
+        items = {item["path"]: item for item in data["items"]}
+    else:
+        items = dict(cached["items"])
+        for item in data.get("added", []):
+            items[item["path"]] = item
+        for path in data.get("removed", []):
+            items.pop(path, None)
+    versions[dirs_only] = {"version": data["version"], "items": items}
+    return items
+
+def tree(dirs_only: bool = False) -> dict:
+    """Árbol completo de /context ({ruta: entrada}). Si la API falla se usa el último recibido."""
+    try:
+        return _tree(dirs_only)
+    except Exception as e:
+        st.error(f"Error obteniendo el árbol de archivos: {e}")
+        cached = _tree_versions().get(dirs_only)
+        return dict(cached["items"]) if cached else {}
+
+# --- Sesiones y modelos ---
+
+@st.cache_data(ttl=SESSIONS_TTL, show_spinner=False)
+def sessions(username: str, limit: int = 20) -> list:
+    res = get(f"/sessions/{username}", params={"limit": limit}, timeout=5)
+    res.raise_for_status()
+    return res.json()
+
+@st.cache_data(ttl=SESSIONS_TTL, show_spinner=False)
+def session_messages(session_id: str, limit: int = 50) -> list:
+    res = get(f"/sessions/{session_id}/messages", params={"limit": limit}, timeout=5)
+    res.raise_for_status()
+    return res.json()
+
+def invalidate_sessions():
+    """Tras un mensaje nuevo: la lista de sesiones y los historiales cacheados quedan viejos."""
+    sessions.clear()
+    session_messages.clear()
+
+@st.cache_data(ttl=MODELS_TTL, show_spinner=False)
+def loaded_models() -> set:
+    res = get("/models/status", timeout=2)
+    res.raise_for_status()
+    loaded = set()
+    for m in res.json().get("loaded", []):
+        loaded.add(m["model"])
+        loaded.add(m["model"].removesuffix(":latest"))
+    return loaded
+
+# --- Contenido de archivos ---
+
+class FileCache:
+    """ruta -> (instante de lectura, sha256, contenido), con LRU por número de archivos y por bytes.
+    La usan los reruns de todos los usuarios y el hilo de precarga a la vez, así que cada operación toma el lock."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict() # ruta -> (instante, sha256, contenido, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+            return entry[:3]
+
+    def put(self, path: str, sha256, content: str):
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            self._discard(path)
+            if size > self.max_bytes:
+                return
+            self._entries[path] = (time.monotonic(), sha256, content, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def touch(self, path: str):
+        """El servidor confirmó que no cambió: vuelve a contar el TTL."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries[path] = (time.monotonic(), *entry[1:])
+                self._entries.move_to_end(path)
+
+    def pop(self, path: str):
+        with self._lock:
+            self._discard(path)
+
+    def paths(self) -> list:
+        with self._lock:
+            return list(self._entries)
+
+    def _discard(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+@st.cache_resource
+def _files() -> FileCache:
+    # Se revalida con el hash al vencer el TTL
+    return FileCache(FILE_CACHE_MAX_ENTRIES, FILE_CACHE_MAX_MB * 1024 * 1024)
+
+@st.cache_resource
+def _prefetcher() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+def _fetch_files(http: requests.Session, store: FileCache, paths: list):
+    specs = []
+    for path in paths:
+        entry = store.get(path)
+        specs.append({"path": path, "if_none_match": entry[1] if entry else None})
+    with http.post(f"{API_URL}/files/content:batch", json={"files": specs}, stream=True, timeout=60) as res:
+        res.raise_for_status()
+        for line in res.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            path = record["path"]
+            if record.get("unchanged"):
+                store.touch(path)
+            elif "content" in record:
+                store.put(path, record.get("sha256"), record["content"])
+            else:
+                store.pop(path)
+
+def _stale(store: FileCache, paths: list) -> list:
+    now = time.monotonic()
+    stale = []
+    for path in paths:
+        entry = store.get(path)
+        if entry is None or now - entry[0] > FILE_TTL:
+            stale.append(path)
+    return stale
+
+def file_content(path: str):
+    """Contenido del archivo (None si no se pudo leer). Sin petición si se leyó hace menos de FILE_TTL."""
+    store = _files()
+    if _stale(store, [path]):
+        _fetch_files(session(), store, [path])
+    entry = store.get(path)
+    return entry[2] if entry else None
+
+@st.cache_resource
+def _pending() -> set:
+    return set() # Rutas con una precarga en curso (no se vuelven a pedir en cada rerun)
+
+def _prefetch(http: requests.Session, store: FileCache, pending: set, paths: list):
+    # Corre fuera del hilo del script (sin ScriptRunContext): no puede llamar a funciones de st.*,
+    # por eso recibe la sesión, la caché y el conjunto de pendientes ya resueltos
+    try:
+        _fetch_files(http, store, paths)
+    except Exception as e:
+        print(f"Error precargando archivos: {e}")
+    finally:
+        pending.difference_update(paths)
+
+def prefetch(paths: list):
+    """Lee en segundo plano (una sola petición en lote) los archivos que aún no están en caché."""
+    store, pending = _files(), _pending()
+    stale = [p for p in _stale(store, list(paths)) if p not in pending]
+    if stale:
+        pending.update(stale)
+        _prefetcher().submit(_prefetch, session(), store, pending, stale)
+
+# --- Escrituras en /context ---
+
+def invalidate_files(*paths: str):
+    _tree.clear()
+    store = _files()
+    for path in paths:
+        store.pop(path)
+
+def write_file(path: str, content: str) -> requests.Response:
+    res = post("/file/write", json={"path": path, "content": content})
+    invalidate_files(path, os.path.join("/context", path.lstrip("/")))
+    return res
+
+def delete_file(path: str) -> requests.Response:
+    res = delete("/file/delete", params={"path": path})
+    prefix = os.path.join("/context", path.lstrip("/")).rstrip("/") + "/"
+    # Borrar una carpeta invalida también los archivos que contenía
+    invalidate_files(path, prefix.rstrip("/"), *[p for p in _files().paths() if p.startswith(prefix)])
+    return res
+
+def mkdir(path: str) -> requests.Response:
+    res = post("/file/mkdir", json={"path": path})
+    invalidate_files()
+    return res
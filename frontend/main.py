@@ -1,11 +1,12 @@
 import streamlit as st
-import requests
 import json
 import os
 import time
 
+import api_client
+from streaming import StreamRenderer
+
 # Configuración
-API_URL = os.getenv("API_URL", "http://api:8000")
 st.set_page_config(page_title="OpenCCB AI", page_icon="🤖", layout="wide")
 
 # Estilos CSS personalizados
@@ -15,6 +16,23 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def fetch_tree(dirs_only=False):
+    """Árbol completo de /context en una sola petición ({ruta: entrada}), cacheado por el cliente de la API."""
+    return api_client.tree(dirs_only)
+
+def tree_children(items):
+    """Entradas de cada carpeta (carpetas primero, luego por nombre)."""
+    children = {}
+    for item in items.values():
+        children.setdefault(os.path.dirname(item["path"]), []).append(item)
+    for entries in children.values():
+        entries.sort(key=lambda x: (not x["is_directory"], os.path.basename(x["path"])))
+    return children
+
+def files_under(items, dir_path):
+    prefix = dir_path.rstrip("/") + "/"
+    return [path for path, item in items.items() if not item["is_directory"] and path.startswith(prefix)]
+
 # Inicializar estado de sesión
 if "token" not in st.session_state:
     st.session_state.token = None
@@ -42,7 +60,7 @@ def login_register_sidebar():
 
             if submit_login:
                 try:
-                    res = requests.post(f"{API_URL}/login", json={"username": l_user.strip(), "password": l_pass.strip()})
+                    res = api_client.post("/login", json={"username": l_user.strip(), "password": l_pass.strip()})
                     if res.status_code == 200:
                         st.session_state.token = res.json().get("access_token") # Ajustar según tu API
                         st.session_state.username = l_user.strip()
@@ -64,7 +82,7 @@ def login_register_sidebar():
                     st.error("Por favor completa todos los campos.")
                 else:
                     try:
-                        res = requests.post(f"{API_URL}/register", json={"username": r_user.strip(), "password": r_pass.strip()})
+                        res = api_client.post("/register", json={"username": r_user.strip(), "password": r_pass.strip()})
                         if res.status_code == 200:
                             st.success("Usuario creado. Por favor inicia sesión.")
                         else:
@@ -79,14 +97,49 @@ def login_register_sidebar():
             st.divider()
             st.write(f"Conectado como: **{st.session_state.username}**")
             
+            # Modelos ya cargados en memoria: responden sin esperar la carga
+            loaded_models = set()
+            try:
+                loaded_models = api_client.loaded_models()
+            except Exception:
+                pass
+
             # Selector de modelo
             st.session_state.current_model = st.selectbox(
                 "Modelo de IA",
                 ["gpt-oss:20b", "llama3", "mistral", "gemma2", "codellama", "phi3", "tinyllama"],
                 index=0,
-                help="Selecciona el modelo según tu tarea. Si falla, asegúrate de descargarlo."
+                format_func=lambda m: f"⚡ {m}" if m in loaded_models else m,
+                help="Selecciona el modelo según tu tarea. ⚡ = ya cargado en memoria (respuesta inmediata). Si falla, asegúrate de descargarlo."
             )
-            
+
+            # Conversaciones anteriores (la primera página, las más recientes)
+            sessions = []
+            try:
+                sessions = api_client.sessions(st.session_state.username)
+            except Exception:
+                pass
+            if sessions:
+                titles = {s["id"]: s["description"] for s in sessions}
+                options = [None] + list(titles)
+                current = st.session_state.session_id if st.session_state.session_id in titles else None
+                selected = st.selectbox(
+                    "💬 Conversaciones",
+                    options,
+                    index=options.index(current),
+                    format_func=lambda sid: "➕ Nueva conversación" if sid is None else titles[sid],
+                )
+                if selected != current and (selected or st.session_state.session_id):
+                    st.session_state.session_id = selected
+                    st.session_state.messages = []
+                    if selected:
+                        # Restaurar los últimos mensajes guardados en el servidor
+                        try:
+                            st.session_state.messages = [{"role": m["role"], "content": m["content"]} for m in api_client.session_messages(selected)]
+                        except Exception as e:
+                            st.error(f"Error cargando la conversación: {e}")
+                    st.rerun()
+
             st.divider()
             st.subheader("☁️ Base de Conocimiento (S3)")
             
@@ -105,9 +158,21 @@ def login_register_sidebar():
                             "aws_region": aws_region,
                             "bucket_name": bucket_name
                         }
-                        res = requests.post(f"{API_URL}/s3/sync", json=payload)
-                        if res.status_code == 200:
-                            st.success(res.json().get("message"))
+                        res = api_client.post("/s3/sync", json=payload)
+                        if res.status_code in (200, 202):
+                            # La ingesta corre en segundo plano: consultar el progreso hasta que termine
+                            job_id = res.json().get("job_id")
+                            progress = st.empty()
+                            while True:
+                                job = api_client.get(f"/s3/sync/{job_id}").json()
+                                progress.caption(f"Listados: {job['listed']} | Procesados: {job['processed']} | Páginas: {job['pages']} | Errores: {job['errors']}")
+                                if job["status"] != "running":
+                                    break
+                                time.sleep(2)
+                            if job["status"] == "finished":
+                                st.success(f"Sincronizadas {job['pages']} páginas nuevas desde S3")
+                            else:
+                                st.error(f"Error S3: {job.get('last_error')}")
                         else:
                             st.error(f"Error: {res.text}")
                     except Exception as e:
@@ -120,7 +185,7 @@ def login_register_sidebar():
             if st.button("Sincronizar Proyecto Local"):
                 with st.spinner("Leyendo estructura de archivos..."):
                     try:
-                        res = requests.post(f"{API_URL}/local/sync")
+                        res = api_client.post("/local/sync")
                         if res.status_code == 200:
                             st.success(res.json().get("message"))
                         else:
@@ -140,22 +205,9 @@ def login_register_sidebar():
             if "expand_all" not in st.session_state:
                 st.session_state.expand_all = False
             
-            # Función para obtener todas las carpetas recursivamente
-            def get_all_dirs(current_path="/context"):
-                all_dirs = set()
-                ignore_dirs = {'__pycache__', '.git', 'uploaded_context', 'node_modules', '.vscode', '.idea', 'venv'}
-                try:
-                    res = requests.get(f"{API_URL}/files", params={"path": current_path})
-                    if res.status_code == 200:
-                        items = res.json().get("items", [])
-                        for item in items:
-                            if item["is_directory"]:
-                                if item["name"] not in ignore_dirs:
-                                    all_dirs.add(item["path"])
-                                    all_dirs.update(get_all_dirs(item["path"]))
-                except Exception as e:
-                    st.error(f"Error obteniendo carpetas: {e}")
-                return all_dirs
+            # Todas las carpetas (una sola petición a /tree, sin las ignoradas por el servidor)
+            def get_all_dirs():
+                return set(fetch_tree(dirs_only=True))
             
             # Checkbox para seleccionar todas las carpetas
             if st.button("Seleccionar todas las carpetas"):
@@ -168,41 +220,36 @@ def login_register_sidebar():
                 st.rerun()
             
             # Función para mostrar árbol de archivos
+            tree_items = fetch_tree()
+            children = tree_children(tree_items)
+
             def display_file_tree(current_path="/context", level=0):
-                ignore_dirs = {'__pycache__', '.git', 'uploaded_context', 'node_modules', '.vscode', '.idea', 'venv'}
-                try:
-                    res = requests.get(f"{API_URL}/files", params={"path": current_path})
-                    if res.status_code == 200:
-                        items = res.json().get("items", [])
-                        for item in sorted(items, key=lambda x: (not x["is_directory"], x["name"])):
-                            if item["is_directory"] and item["name"] in ignore_dirs:
-                                continue
-                            indent = "  " * level
-                            if item["is_directory"]:
-                                dir_checked = item["path"] in st.session_state.selected_dirs
-                                with st.expander(f"{indent}📁 {item['name']}", expanded=st.session_state.expand_all):
-                                    # Checkbox para la carpeta
-                                    if st.checkbox(f"Seleccionar carpeta {item['name']}", value=dir_checked, key=f"dir_{item['path']}"):
-                                        if item["path"] not in st.session_state.selected_dirs:
-                                            st.session_state.selected_dirs.append(item["path"])
-                                    else:
-                                        if item["path"] in st.session_state.selected_dirs:
-                                            st.session_state.selected_dirs.remove(item["path"])
-                                    display_file_tree(item["path"], level + 1)
+                for item in children.get(current_path, []):
+                    name = os.path.basename(item["path"])
+                    indent = "  " * level
+                    if item["is_directory"]:
+                        dir_checked = item["path"] in st.session_state.selected_dirs
+                        with st.expander(f"{indent}📁 {name}", expanded=st.session_state.expand_all):
+                            # Checkbox para la carpeta
+                            if st.checkbox(f"Seleccionar carpeta {name}", value=dir_checked, key=f"dir_{item['path']}"):
+                                if item["path"] not in st.session_state.selected_dirs:
+                                    st.session_state.selected_dirs.append(item["path"])
                             else:
-                                checked = item["path"] in st.session_state.selected_files
-                                if st.checkbox(f"{indent}📄 {item['name']}", value=checked, key=item["path"]):
-                                    if item["path"] not in st.session_state.selected_files:
-                                        st.session_state.selected_files.append(item["path"])
-                                else:
-                                    if item["path"] in st.session_state.selected_files:
-                                        st.session_state.selected_files.remove(item["path"])
+                                if item["path"] in st.session_state.selected_dirs:
+                                    st.session_state.selected_dirs.remove(item["path"])
+                            display_file_tree(item["path"], level + 1)
                     else:
-                        st.error(f"Error cargando archivos: {res.text}")
-                except Exception as e:
-                    st.error(f"Error de conexión: {e}")
+                        checked = item["path"] in st.session_state.selected_files
+                        if st.checkbox(f"{indent}📄 {name}", value=checked, key=item["path"]):
+                            if item["path"] not in st.session_state.selected_files:
+                                st.session_state.selected_files.append(item["path"])
+                        else:
+                            if item["path"] in st.session_state.selected_files:
+                                st.session_state.selected_files.remove(item["path"])
             
             display_file_tree()
+            # Los archivos marcados se precargan en segundo plano para abrirlos al instante en el editor
+            api_client.prefetch(st.session_state.selected_files)
             
             if st.session_state.selected_dirs or st.session_state.selected_files:
                 st.write(f"Carpetas seleccionadas: {len(st.session_state.selected_dirs)} | Archivos seleccionados: {len(st.session_state.selected_files)}")
@@ -271,28 +318,14 @@ def chat_interface():
                 status_placeholder = st.empty()
                 status_placeholder.info("📝 Preparando contexto de archivos seleccionados...")
                 
-                # Obtener contenido de archivos seleccionados
-                context_files = ""
+                # Archivos seleccionados: se envían solo las rutas, la API lee y empaqueta el contenido
                 selected_files = list(st.session_state.selected_files)
                 
-                # Expandir carpetas seleccionadas a archivos
-                def expand_dir_to_files(dir_path):
-                    files = []
-                    try:
-                        res = requests.get(f"{API_URL}/files", params={"path": dir_path})
-                        if res.status_code == 200:
-                            items = res.json().get("items", [])
-                            for item in items:
-                                if item["is_directory"]:
-                                    files.extend(expand_dir_to_files(item["path"]))
-                                else:
-                                    files.append(item["path"])
-                    except Exception as e:
-                        st.error(f"Error expandiendo {dir_path}: {e}")
-                    return files
-                
-                for dir_path in st.session_state.selected_dirs:
-                    selected_files.extend(expand_dir_to_files(dir_path))
+                # Expandir carpetas seleccionadas a archivos (con el árbol ya cargado)
+                if st.session_state.selected_dirs:
+                    tree_items = fetch_tree()
+                    for dir_path in st.session_state.selected_dirs:
+                        selected_files.extend(files_under(tree_items, dir_path))
                 
                 selected_files = list(set(selected_files))  # Remover duplicados
                 
@@ -300,32 +333,19 @@ def chat_interface():
                     st.warning(f"Demasiados archivos seleccionados ({len(selected_files)}). Limitando a 20 para evitar timeouts.")
                     selected_files = selected_files[:20]
                 
-                if selected_files:
-                    status_placeholder.info("📂 Leyendo contenido de archivos...")
-                    context_files = "Contexto de archivos seleccionados:\n"
-                    for file_path in selected_files:
-                        try:
-                            res = requests.get(f"{API_URL}/file/content", params={"path": file_path})
-                            if res.status_code == 200:
-                                content = res.json().get("content", "")
-                                context_files += f"\n--- Archivo: {file_path} ---\n{content[:2000]}...\n"  # Limitar a 2000 chars por archivo
-                            else:
-                                context_files += f"\n--- Archivo: {file_path} ---\nError cargando contenido.\n"
-                        except Exception as e:
-                            context_files += f"\n--- Archivo: {file_path} ---\nError: {str(e)}\n"
-                
                 status_placeholder.info("🤖 Enviando consulta a la IA...")
                 
                 payload = {
                     "username": st.session_state.username,
-                    "prompt": prompt + (f"\n\n{context_files}" if context_files else ""),
+                    "prompt": prompt,
                     "session_id": st.session_state.session_id,
                     "model": st.session_state.current_model,
-                    "use_kb": st.session_state.use_kb
+                    "use_kb": st.session_state.use_kb,
+                    "attachments": [{"path": path} for path in selected_files]
                 }
                 
                 # Petición con streaming
-                response = requests.post(f"{API_URL}/chat", json=payload, stream=True)
+                response = api_client.post("/chat", json=payload, stream=True)
                 
                 if response.status_code == 200:
                     # Actualizar el session_id desde el header de la respuesta
@@ -335,14 +355,13 @@ def chat_interface():
 
                     status_placeholder.info("💭 Generando respuesta...")
                     
+                    renderer = StreamRenderer(message_placeholder, on_status=lambda status: status_placeholder.info(status or "💭 Generando respuesta..."))
                     for chunk in response.iter_content(chunk_size=1024):
                         if chunk:
-                            text_chunk = chunk.decode("utf-8")
-                            full_response += text_chunk
-                            message_placeholder.markdown(full_response + "▌")
-                    
-                    message_placeholder.markdown(full_response)
+                            renderer.feed(chunk)
+                    full_response = renderer.finish()
                     st.session_state.messages.append({"role": "assistant", "content": full_response})
+                    api_client.invalidate_sessions()
                     
                     status_placeholder.success("✅ Respuesta completada")
                     status_placeholder.empty()  # Limpiar
@@ -353,20 +372,7 @@ def chat_interface():
                 st.error(f"Error de conexión: {e}")
 
 def get_all_files_flat(current_path="/context"):
-    files = []
-    try:
-        res = requests.get(f"{API_URL}/files", params={"path": current_path})
-        if res.status_code == 200:
-            items = res.json().get("items", [])
-            for item in items:
-                if item["is_directory"]:
-                    if item["name"] not in {'.git', '__pycache__', 'node_modules', 'venv', '.idea', '.vscode'}:
-                        files.extend(get_all_files_flat(item["path"]))
-                else:
-                    files.append(item["path"])
-    except:
-        pass
-    return files
+    return files_under(fetch_tree(), current_path)
 
 def editor_interface():
     st.header("📝 Editor de Archivos")
@@ -376,6 +382,7 @@ def editor_interface():
     with col1:
         st.subheader("Explorador")
         if st.button("🔄 Recargar"):
+            api_client.invalidate_files()
             st.rerun()
             
         all_files = get_all_files_flat()
@@ -392,12 +399,12 @@ def editor_interface():
         with c1:
             if st.button("📄 Archivo"):
                 if new_name:
-                    requests.post(f"{API_URL}/file/write", json={"path": new_name, "content": ""})
+                    api_client.write_file(new_name, "")
                     st.rerun()
         with c2:
             if st.button("📁 Carpeta"):
                 if new_name:
-                    requests.post(f"{API_URL}/file/mkdir", json={"path": new_name})
+                    api_client.mkdir(new_name)
                     st.rerun()
     
     current_content = ""
@@ -409,9 +416,9 @@ def editor_interface():
             
             # Cargar contenido solo si cambia el archivo seleccionado
             if "editor_file" not in st.session_state or st.session_state.editor_file != full_path:
-                res = requests.get(f"{API_URL}/file/content", params={"path": full_path})
-                if res.status_code == 200:
-                    st.session_state.editor_content = res.json().get("content", "")
+                content = api_client.file_content(full_path)
+                if content is not None:
+                    st.session_state.editor_content = content
                     st.session_state.editor_file = full_path
                     # Resetear el widget de texto para que tome el nuevo valor
                     if "code_editor" in st.session_state:
@@ -425,7 +432,7 @@ def editor_interface():
             b1, b2 = st.columns([1, 5])
             with b1:
                 if st.button("💾 Guardar", type="primary"):
-                    res = requests.post(f"{API_URL}/file/write", json={"path": selected_key, "content": new_content})
+                    res = api_client.write_file(selected_key, new_content)
                     if res.status_code == 200:
                         st.success("Guardado!")
                         st.session_state.editor_content = new_content
@@ -433,7 +440,7 @@ def editor_interface():
                         st.error(res.text)
             with b2:
                 if st.button("🗑️ Eliminar"):
-                    requests.delete(f"{API_URL}/file/delete", params={"path": selected_key})
+                    api_client.delete_file(selected_key)
                     if "editor_file" in st.session_state: del st.session_state.editor_file
                     st.rerun()
         else:
@@ -475,17 +482,18 @@ def editor_interface():
                             "prompt": context_prompt,
                             "session_id": st.session_state.session_id,
                             "model": st.session_state.current_model,
-                            "use_kb": False
+                            "use_kb": False,
+                            "cache": True # Mismo código + misma pregunta = misma respuesta
                         }
                         
                         try:
-                            response = requests.post(f"{API_URL}/chat", json=payload, stream=True)
+                            response = api_client.post("/chat", json=payload, stream=True)
                             if response.status_code == 200:
+                                renderer = StreamRenderer(msg_placeholder)
                                 for chunk in response.iter_content(chunk_size=1024):
                                     if chunk:
-                                        full_response += chunk.decode("utf-8")
-                                        msg_placeholder.markdown(full_response + "▌")
-                                msg_placeholder.markdown(full_response)
+                                        renderer.feed(chunk)
+                                full_response = renderer.finish()
                                 st.session_state.editor_messages.append({"role": "assistant", "content": full_response})
                             else:
                                 st.error(f"Error: {response.text}")
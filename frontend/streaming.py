@@ -0,0 +1,110 @@
+# streaming.py
+# Render incremental de las respuestas en streaming. Los bytes se decodifican con un decodificador
+# incremental (un carácter multibyte partido entre dos chunks no se corrompe), los redibujados se
+# agrupan a ~20 por segundo y solo se redibuja el último bloque: los párrafos ya terminados (fuera de
+# bloques de código) se fijan una vez en su propio elemento y no se vuelven a enviar al navegador.
+
+import time
+import codecs
+
+# Líneas de estado que la API envía mientras la petición espera turno en Ollama
+QUEUE_STATUS_PREFIX = "⏳ En cola"
+RENDER_FPS = 20
+CURSOR = "▌"
+FENCES = ("```", "~~~")
+
+def split_queue_status(text):
+    """Separa las líneas de posición en cola (previas al primer token) del texto de la respuesta."""
+    status = None
+    while text.startswith(QUEUE_STATUS_PREFIX):
+        if "\n" not in text:
+            return status, ""
+        status, text = text.split("\n", 1)
+    return status, text
+
+class StreamRenderer:
+    """Muestra en `placeholder` una respuesta que llega por chunks de bytes.
+    `on_status` recibe la posición en cola (o None al empezar la respuesta); sin él se muestra en el mensaje."""
+
+    def __init__(self, placeholder, on_status=None):
+        container = placeholder.container()
+        self._blocks = container.container() # Bloques fijos (se crean en orden, antes del final)
+        self._tail = container.empty()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._on_status = on_status
+        self._head = "" # Texto previo al primer token (líneas de cola)
+        self._started = False
+        self._status = None
+        self.text = ""
+        self._frozen = 0 # Caracteres de `text` ya fijados en bloques
+        self._scanned = 0 # Hasta dónde se buscaron límites de bloque
+        self._in_fence = False
+        self._last_render = 0.0
+
+    def feed(self, chunk: bytes):
+        text = self._decoder.decode(chunk)
+        if not text:
+            return
+        if self._started:
+            self.text += text
+        else:
+            self._head += text
+            status, body = split_queue_status(self._head)
+            # Un chunk puede cortar la línea de cola a la mitad: se espera a tenerla completa
+            if body and not QUEUE_STATUS_PREFIX.startswith(body):
+                self._started, self.text, self._head = True, body, ""
+                status = None
+            self._set_status(status)
+        if time.monotonic() - self._last_render >= 1 / RENDER_FPS:
+            self._render()
+
+    def finish(self) -> str:
+        """Vacía el decodificador y dibuja la respuesta completa (sin cursor). Devuelve el texto."""
+        rest = self._decoder.decode(b"", final=True)
+        if self._started:
+            self.text += rest
+        else:
+            _, self.text = split_queue_status(self._head + rest)
+            self._set_status(None)
+        self._render(final=True)
+        return self.text
+
+    def _set_status(self, status):
+        if status == self._status:
+            return
+        self._status = status
+        if self._on_status:
+            self._on_status(status)
+
+    def _boundary(self) -> int:
+        # Último límite de párrafo (línea en blanco fuera de un bloque de código) en las líneas completas nuevas
+        boundary = self._frozen
+        end = self.text.rfind("\n") + 1
+        position = self._scanned
+        while position < end:
+            line_end = self.text.index("\n", position) + 1
+            line = self.text[position:line_end].strip()
+            if line.startswith(FENCES):
+                self._in_fence = not self._in_fence
+            elif not line and not self._in_fence:
+                boundary = line_end
+            position = line_end
+        self._scanned = max(self._scanned, end)
+        return boundary
+
+    def _render(self, final: bool = False):
+        self._last_render = time.monotonic()
+        boundary = len(self.text) if final else self._boundary()
+        if boundary > self._frozen:
+            block = self.text[self._frozen:boundary]
+            self._frozen = boundary
+            if block.strip():
+                self._blocks.markdown(block)
+        if final:
+            self._tail.empty()
+        elif self._started:
+            self._tail.markdown(self.text[self._frozen:] + CURSOR)
+        elif self._status and not self._on_status:
+            self._tail.markdown(self._status + CURSOR)
+        else:
+            self._tail.markdown(CURSOR)
@@ -0,0 +1,145 @@
+# support.py
+# Utilidades compartidas por las pruebas y los benchmarks: un Ollama simulado, servidores uvicorn en
+# un hilo del mismo proceso (así moto y los parches en memoria también alcanzan a la API) y un
+# generador de PDFs mínimos.
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import threading
+import statistics
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, "api")
+FRONTEND_DIR = os.path.join(ROOT, "frontend")
+
+def add_path(path: str):
+    """Hace importables los módulos de api/ o de frontend/ (no son paquetes y ambos tienen un main.py)."""
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class FakeOllama:
+    """Ollama simulado: /api/chat y /api/generate (con o sin streaming), /api/embed, /api/ps y /api/tags.
+    Cada respuesta en streaming envía `tokens` tokens separados por `token_delay` segundos."""
+
+    def __init__(self, tokens: int = 20, token_delay: float = 0.0, embed_dim: int = None, models=("gpt-oss:20b", "nomic-embed-text")):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.embed_dim = embed_dim or int(os.getenv("EMBED_DIM", 768))
+        self.models = list(models)
+        self.loaded = [] # Modelos que /api/ps da como cargados en memoria
+        self.calls = [] # (ruta, cuerpo)
+        self.app = FastAPI()
+        self.app.post("/api/chat")(self._generate)
+        self.app.post("/api/generate")(self._generate)
+        self.app.post("/api/embed")(self._embed)
+        self.app.get("/api/ps")(self._ps)
+        self.app.get("/api/tags")(self._tags)
+
+    def vector(self, text: str) -> list:
+        """Embedding determinista (el mismo texto da el mismo vector)."""
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [(digest[i % len(digest)] - 128) / 128 for i in range(self.embed_dim)]
+
+    async def _generate(self, request: Request):
+        body = await request.json()
+        path = request.url.path
+        self.calls.append((path, body))
+
+        def message(text: str, done: bool) -> dict:
+            if path == "/api/chat":
+                return {"message": {"role": "assistant", "content": text}, "done": done}
+            return {"response": text, "done": done}
+
+        if body.get("stream") is False:
+            return JSONResponse(message("Respuesta de prueba", True))
+
+        async def stream():
+            for i in range(self.tokens):
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+                yield json.dumps(message(f" token{i}", False)) + "\n"
+            yield json.dumps({**message("", True), "eval_count": self.tokens, "eval_duration": 1000000, "prompt_eval_count": 5}) + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    async def _embed(self, request: Request):
+        body = await request.json()
+        self.calls.append((request.url.path, body))
+        inputs = body.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return {"embeddings": [self.vector(text) for text in inputs]}
+
+    async def _ps(self):
+        return {"models": [{"name": name, "model": name} for name in self.loaded]}
+
+    async def _tags(self):
+        return {"models": [{"name": name, "model": name} for name in self.models]}
+
+class ServerThread:
+    """Servidor uvicorn en un hilo de fondo. Se usa como context manager; `url` es su dirección."""
+
+    def __init__(self, app, port: int = None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        # Sin límite de conexiones simultáneas (las pruebas de carga abren cientos)
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", timeout_keep_alive=30)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 60
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"El servidor de pruebas en {self.url} no arrancó")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+def make_pdf(pages: list) -> bytes:
+    """PDF mínimo con una página de texto (Helvetica) por elemento de `pages`. Solo caracteres latin-1."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = "".join(f"({line}) Tj T* " for line in text.split("\n"))
+        stream = f"BT /F1 10 Tf 14 TL 50 780 Td {lines}ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out.encode("latin-1")))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out.encode("latin-1"))
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+def report(label: str, samples: list) -> dict:
+    """Imprime y devuelve p50/p95/p99/media en milisegundos de una lista de duraciones en segundos."""
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    stats = {"p50": pct(50), "p95": pct(95), "p99": pct(99), "mean": statistics.mean(ordered) * 1000}
+    print(f"{label:<42} p50 {stats['p50']:8.2f} ms   p95 {stats['p95']:8.2f} ms   p99 {stats['p99']:8.2f} ms   media {stats['mean']:8.2f} ms")
+    return stats
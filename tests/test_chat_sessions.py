@@ -0,0 +1,33 @@
+# Sesiones de /chat con el log write-behind: la sesión existe en cuanto responde su primer mensaje,
+# aunque los mensajes todavía no se hayan volcado a PostgreSQL, y un segundo mensaje enviado antes del
+# volcado ve el historial del primero.
+
+import uuid
+
+import httpx
+
+def _chat(api: str, username: str, session_id: str, prompt: str) -> str:
+    payload = {"username": username, "prompt": prompt, "session_id": session_id}
+    response = httpx.post(f"{api}/chat", json=payload, timeout=60)
+    assert response.status_code == 200
+    return response.text
+
+def _sent_messages(fake_ollama, prompt: str) -> list:
+    """Mensajes que recibió Ollama en la llamada de /api/chat con el último mensaje `prompt`."""
+    [body] = [body for path, body in fake_ollama.calls if path == "/api/chat" and body["messages"][-1]["content"] == prompt]
+    return body["messages"]
+
+def test_second_message_before_flush_sees_session_and_history(api, username, fake_ollama):
+    from sqlalchemy import select
+    from database import SessionLocal, ChatSession
+    session_id = str(uuid.uuid4())
+    first, second = f"primera {session_id}", f"segunda {session_id}"
+
+    _chat(api, username, session_id, first)
+    with SessionLocal() as db:
+        # Sin esperar al worker del log (MESSAGE_FLUSH_INTERVAL_MS)
+        assert db.execute(select(ChatSession.id).where(ChatSession.id == session_id)).scalar() == session_id
+    _chat(api, username, session_id, second)
+
+    history = [message["content"] for message in _sent_messages(fake_ollama, second)]
+    assert first in history
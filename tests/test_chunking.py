@@ -0,0 +1,33 @@
+# División en fragmentos: una línea más larga que CHUNK_SIZE (JS minificado, JSON en una línea, páginas
+# de PDF sin saltos) se parte por caracteres y los offsets siguen apuntando al contenido original.
+
+from chunking import chunk_document
+
+def _check_offsets(content: str, chunks: list):
+    data = content.encode("utf-8")
+    for chunk in chunks:
+        assert data[chunk.start_byte:chunk.end_byte].decode("utf-8") == chunk.text
+
+def test_long_line_is_split_into_bounded_chunks():
+    content = "// cabecera\n" + "a" * 50000 + "\nconsole.log(1);\n"
+
+    chunks = chunk_document(content, "bundle.min.js", size=1000, overlap=150)
+
+    assert max(len(chunk.text) for chunk in chunks) <= 1000
+    assert "".join(chunk.text for chunk in chunks) == content
+    _check_offsets(content, chunks)
+    # Los trozos de la línea larga llevan su número de línea en ambos extremos
+    middle = [chunk for chunk in chunks if chunk.text == "a" * 1000]
+    assert len(middle) >= 48
+    assert all(chunk.start_line == chunk.end_line == 2 for chunk in middle)
+    assert chunks[-1].end_line == 3
+
+def test_long_line_split_keeps_multibyte_characters_whole():
+    content = "ñandú " * 2000 # Una sola línea de 12.000 caracteres (más bytes que caracteres)
+
+    chunks = chunk_document(content, "pagina.txt", size=1000, overlap=150)
+
+    assert len(chunks) == 12
+    assert all(chunk.start_line == chunk.end_line == 1 for chunk in chunks)
+    _check_offsets(content, chunks)
+    assert chunks[-1].end_byte == len(content.encode("utf-8"))
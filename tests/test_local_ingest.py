@@ -0,0 +1,94 @@
+# Indexado del proyecto local: un archivo que la base de datos rechaza se salta sin perder el resto
+# del lote (sincronización completa y actualización por rutas del watcher).
+
+import uuid
+
+import pytest
+from sqlalchemy import func, text
+
+@pytest.fixture
+def context(api, tmp_path, monkeypatch):
+    """Carpeta de proyecto temporal como /context."""
+    import ingest
+    monkeypatch.setattr(ingest, "LOCAL_CONTEXT_PATH", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def failing_file(monkeypatch):
+    """Hace que PostgreSQL rechace las páginas de `bad.py` (un error real, que invalida la transacción)."""
+    import ingest
+    replace_pages = ingest._replace_pages
+
+    def failing_replace(db, keys, rows):
+        if any(key.endswith("/bad.py") for key in keys):
+            db.execute(text("SELECT 1 / 0"))
+        return replace_pages(db, keys, rows)
+    monkeypatch.setattr(ingest, "_replace_pages", failing_replace)
+
+def _write(context, names: list) -> list:
+    # Contenido único: la base de datos de pruebas conserva el manifiesto de ejecuciones anteriores
+    run = uuid.uuid4().hex
+    paths = []
+    for name in names:
+        path = context / name
+        path.write_text(f"# contenido de {name} ({run})\n")
+        paths.append(str(path))
+    return paths
+
+def _indexed(names: list) -> list:
+    from database import SessionLocal, KnowledgePage
+    keys = [f"local/{name}" for name in names]
+    with SessionLocal() as db:
+        found = db.query(KnowledgePage.s3_key).filter(KnowledgePage.s3_key.in_(keys)).all()
+    return sorted(key[len("local/"):] for (key,) in found)
+
+def test_local_sync_skips_file_rejected_by_database(context, failing_file):
+    import ingest
+    from database import SessionLocal
+    names = ["a.py", "bad.py", "c.py", "d.py"]
+    _write(context, names)
+
+    with SessionLocal() as db:
+        stats = ingest.run_local_sync(db)
+
+    assert stats["indexed"] == 3
+    assert stats["errors"] == 1
+    assert _indexed(names) == ["a.py", "c.py", "d.py"]
+
+def test_index_paths_skips_file_rejected_by_database(context, failing_file):
+    import ingest
+    from database import SessionLocal
+    names = ["e.py", "bad.py", "f.py"]
+    paths = _write(context, names)
+
+    with SessionLocal() as db:
+        stats = ingest.index_local_paths(db, paths)
+
+    assert stats["indexed"] == 2
+    assert stats["errors"] == 1
+    assert _indexed(names) == ["e.py", "f.py"]
+
+def test_local_sync_indexes_file_larger_than_tsvector_limit(context):
+    import random
+    import ingest
+    from database import SessionLocal, KnowledgePage
+    # ~900 KB de palabras distintas: el tsvector del archivo completo (español + inglés) pasaría de 1 MB
+    # y PostgreSQL lo rechazaría
+    rng = random.Random(uuid.uuid4().int)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(9)) for _ in range(90000)]
+    lockfile = context / "package-lock.json"
+    lockfile.write_text(" ".join(words))
+
+    with SessionLocal() as db:
+        stats = ingest.run_local_sync(db)
+        found = db.query(KnowledgePage.s3_key).filter(
+            KnowledgePage.s3_key == "local/package-lock.json",
+            KnowledgePage.search_vector.op("@@")(func.to_tsquery("simple", words[0])),
+        ).all()
+        # No dejar la página grande en la base de datos de pruebas: la siguiente sincronización la borra
+        lockfile.unlink()
+        ingest.run_local_sync(db)
+
+    assert stats["errors"] == 0
+    assert stats["indexed"] == 1
+    assert found # Las primeras palabras siguen indexadas
@@ -0,0 +1,151 @@
+# Pool de backends de Ollama contra varios Ollama simulados: enrutado entre nodos, reintento en otro
+# nodo si uno no acepta conexiones, expulsión y readmisión tras los chequeos de salud, y que el
+# contador de peticiones en curso de cada nodo vuelve a cero por cualquier camino. No necesita base de datos.
+
+import os
+import socket
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+from support import API_DIR, FakeOllama, ServerThread, free_port
+
+MODEL = "gpt-oss:20b"
+PAYLOAD = {"model": MODEL, "prompt": "hola", "stream": False}
+
+class Scheduler:
+    """Sustituto del planificador: registra los nodos sanos que le comunica check_health()."""
+    healthy = None
+
+    def set_capacity(self, backends: int):
+        self.healthy = backends
+
+@pytest.fixture
+def ollama():
+    """Copia aparte del módulo ollama. Si otra prueba ya arrancó la API en este proceso, su bucle de
+    salud y sus trabajos de fondo siguen usando el módulo importado y no tocan estos backends."""
+    spec = importlib.util.spec_from_file_location("ollama_pool_test", os.path.join(API_DIR, "ollama.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.backends = []
+    module.scheduler = Scheduler()
+    return module
+
+@asynccontextmanager
+async def _pool(ollama, urls: list):
+    """Backends con cliente para `urls`, sin el bucle de salud de start()."""
+    ollama.backends[:] = [ollama.Backend(url) for url in urls]
+    for backend in ollama.backends:
+        backend.client = httpx.AsyncClient(base_url=backend.url, timeout=httpx.Timeout(10.0, read=None))
+    try:
+        yield ollama.backends
+    finally:
+        for backend in ollama.backends:
+            await backend.client.aclose()
+
+def _served(fakes: list) -> list:
+    """Generaciones sin streaming que ha atendido cada Ollama simulado."""
+    return [sum(1 for path, body in fake.calls if path == "/api/generate" and body.get("stream") is False) for fake in fakes]
+
+def test_routes_by_loaded_model_then_least_outstanding(ollama):
+    fakes = [FakeOllama(), FakeOllama()]
+    fakes[1].loaded = [MODEL]
+
+    async def scenario(urls):
+        async with _pool(ollama, urls) as backends:
+            await asyncio.gather(*(ollama._check(b) for b in backends))
+            # Afinidad: el nodo que ya tiene el modelo en memoria
+            await ollama.post("/api/generate", PAYLOAD)
+            assert _served(fakes) == [0, 1]
+            # Con el modelo cargado en ambos, el nodo con un stream abierto queda para después
+            fakes[0].loaded = [MODEL]
+            await asyncio.gather(*(ollama._check(b) for b in backends))
+            async with ollama.stream("/api/generate", {**PAYLOAD, "stream": True}):
+                assert [b.outstanding for b in backends] == [1, 0]
+                await ollama.post("/api/generate", PAYLOAD)
+            assert _served(fakes) == [0, 2]
+            assert [b.outstanding for b in backends] == [0, 0]
+
+    with ServerThread(fakes[0].app) as first, ServerThread(fakes[1].app) as second:
+        asyncio.run(scenario([first.url, second.url]))
+
+def test_fails_over_when_backend_refuses_connections(ollama):
+    fake = FakeOllama()
+    dead_url = f"http://127.0.0.1:{free_port()}" # Nadie escucha en ese puerto
+
+    async def scenario(url):
+        async with _pool(ollama, [dead_url, url]) as backends:
+            # Ambos parecen sanos antes del primer chequeo; el empate lleva al nodo caído
+            response = await ollama.post("/api/generate", PAYLOAD)
+            assert response.json()["response"] == "Respuesta de prueba"
+            assert [b.healthy for b in backends] == [False, True]
+            assert backends[0].last_error
+            assert [b.outstanding for b in backends] == [0, 0]
+
+    with ServerThread(fake.app) as server:
+        asyncio.run(scenario(server.url))
+    assert _served([fake]) == [1]
+
+def test_ejects_and_readmits_backend_after_health_checks(ollama):
+    fakes = [FakeOllama(), FakeOllama()]
+    port = free_port()
+
+    async def scenario(urls, stop, restart):
+        async with _pool(ollama, urls) as backends:
+            await ollama.check_health()
+            assert [b.healthy for b in backends] == [True, True]
+            assert ollama.scheduler.healthy == 2
+
+            await stop()
+            await ollama.check_health()
+            assert [b.healthy for b in backends] == [False, True]
+            assert ollama.scheduler.healthy == 1
+            for _ in range(3):
+                await ollama.post("/api/generate", PAYLOAD)
+            assert _served(fakes) == [0, 3]
+
+            await restart()
+            await ollama.check_health()
+            assert [b.healthy for b in backends] == [True, True]
+            assert backends[0].last_error is None
+            assert ollama.scheduler.healthy == 2
+            await ollama.post("/api/generate", PAYLOAD) # De nuevo el nodo con menos peticiones en curso (empate: el primero)
+            assert _served(fakes) == [1, 3]
+
+    servers = [ServerThread(fakes[0].app, port=port)]
+    with ServerThread(fakes[1].app) as other:
+        servers[0].__enter__()
+
+        async def stop():
+            await asyncio.to_thread(servers[0].__exit__, None, None, None)
+
+        async def restart():
+            servers[0] = ServerThread(fakes[0].app, port=port)
+            await asyncio.to_thread(servers[0].__enter__)
+        try:
+            asyncio.run(scenario([f"http://127.0.0.1:{port}", other.url], stop, restart))
+        finally:
+            servers[0].__exit__(None, None, None)
+
+def test_outstanding_released_when_request_is_cancelled(ollama):
+    # Nodo colgado: acepta la conexión (backlog del socket) pero nunca responde
+    with socket.socket() as hung:
+        hung.bind(("127.0.0.1", 0))
+        hung.listen(8)
+        url = "http://127.0.0.1:%d" % hung.getsockname()[1]
+
+        async def scenario():
+            async with _pool(ollama, [url]) as backends:
+                request = asyncio.create_task(ollama.post("/api/generate", PAYLOAD))
+                while not backends[0].outstanding:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.1)
+                request.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await request
+                assert backends[0].outstanding == 0
+
+        asyncio.run(scenario())
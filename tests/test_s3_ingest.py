@@ -0,0 +1,133 @@
+# Ingesta de S3 contra moto (S3 simulado en memoria, en el mismo proceso que la API): paginación más
+# allá de 1.000 claves, re-sincronización incremental y reanudación desde el checkpoint tras un fallo.
+
+import time
+import uuid
+
+import boto3
+import httpx
+import pytest
+from moto import mock_aws
+
+from support import make_pdf
+
+REGION = "us-east-1"
+
+@pytest.fixture
+def s3(api):
+    with mock_aws():
+        yield boto3.client("s3", region_name=REGION)
+
+@pytest.fixture
+def bucket(s3):
+    name = f"test-{uuid.uuid4().hex[:12]}"
+    s3.create_bucket(Bucket=name)
+    return name
+
+def _put_pdf(s3, bucket: str, key: str, *pages: str):
+    s3.put_object(Bucket=bucket, Key=key, Body=make_pdf(list(pages)))
+
+def _sync(api: str, bucket: str) -> dict:
+    """Lanza /s3/sync y espera a que el job termine. Devuelve su estado final."""
+    credentials = {"aws_access_key_id": "test", "aws_secret_access_key": "test", "aws_region": REGION}
+    response = httpx.post(f"{api}/s3/sync", json={**credentials, "bucket_name": bucket}, timeout=30)
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    deadline = time.monotonic() + 120
+    while True:
+        status = httpx.get(f"{api}/s3/sync/{job_id}", timeout=30).json()
+        if status["status"] != "running":
+            return status
+        assert time.monotonic() < deadline, status
+        time.sleep(0.2)
+
+def _pages(bucket: str) -> dict:
+    """{clave del objeto: [contenido de cada página]} indexado para el bucket."""
+    from database import SessionLocal, KnowledgePage
+    prefix = f"s3://{bucket}/"
+    with SessionLocal() as db:
+        rows = (
+            db.query(KnowledgePage.s3_key, KnowledgePage.content)
+            .filter(KnowledgePage.s3_key.startswith(prefix))
+            .order_by(KnowledgePage.s3_key, KnowledgePage.page_number)
+        )
+        pages = {}
+        for key, content in rows:
+            pages.setdefault(key[len(prefix):], []).append(content)
+        return pages
+
+def test_sync_paginates_past_first_1000_keys(api, s3, bucket):
+    _put_pdf(s3, bucket, "docs/manual.pdf", "Manual pagina uno", "Manual pagina dos")
+    _put_pdf(s3, bucket, "docs/politica.pdf", "Politica de compras")
+    # Más de una página de list_objects_v2 (1.000 claves); el último PDF queda en la segunda
+    for i in range(1100):
+        s3.put_object(Bucket=bucket, Key=f"logs/{i:04d}.txt", Body=b"x")
+    _put_pdf(s3, bucket, "zz/ultimo.pdf", "Documento tras la primera pagina")
+
+    status = _sync(api, bucket)
+
+    assert status["status"] == "finished", status
+    assert status["listed"] == 1103
+    assert status["processed"] == 3
+    assert status["pages"] == 4
+    assert status["errors"] == 0
+    pages = _pages(bucket)
+    assert sorted(pages) == ["docs/manual.pdf", "docs/politica.pdf", "zz/ultimo.pdf"]
+    assert "Manual pagina dos" in pages["docs/manual.pdf"][1]
+    assert "primera pagina" in pages["zz/ultimo.pdf"][0]
+
+def test_resync_processes_only_changes(api, s3, bucket):
+    _put_pdf(s3, bucket, "a.pdf", "Version uno")
+    _put_pdf(s3, bucket, "b.pdf", "Se va a borrar")
+    _put_pdf(s3, bucket, "c.pdf", "Sin cambios")
+    assert _sync(api, bucket)["processed"] == 3
+
+    _put_pdf(s3, bucket, "a.pdf", "Version dos")
+    s3.delete_object(Bucket=bucket, Key="b.pdf")
+    _put_pdf(s3, bucket, "d.pdf", "Documento nuevo")
+    status = _sync(api, bucket)
+
+    assert status["status"] == "finished", status
+    assert status["processed"] == 2 # a.pdf modificado y d.pdf nuevo
+    assert status["skipped"] == 1   # c.pdf
+    assert status["removed"] == 1   # b.pdf
+    pages = _pages(bucket)
+    assert sorted(pages) == ["a.pdf", "c.pdf", "d.pdf"]
+    assert "Version dos" in pages["a.pdf"][0]
+
+def test_failed_sync_resumes_from_checkpoint(api, s3, bucket, monkeypatch):
+    import ingest
+    keys = [f"doc-{i}.pdf" for i in range(6)]
+    for key in keys:
+        _put_pdf(s3, bucket, key, f"Contenido de {key} en {bucket}")
+    monkeypatch.setattr(ingest, "INGEST_BATCH_SIZE", 2)
+
+    # El segundo lote falla: el primero ya quedó confirmado junto con su checkpoint
+    process_batch, batches = ingest._process_batch, []
+
+    def failing_batch(*args):
+        batches.append(args[4])
+        if len(batches) == 2:
+            raise RuntimeError("fallo simulado")
+        return process_batch(*args)
+    monkeypatch.setattr(ingest, "_process_batch", failing_batch)
+    failed = _sync(api, bucket)
+    assert failed["status"] == "failed"
+    assert failed["checkpoint"] == "doc-1.pdf"
+    assert sorted(_pages(bucket)) == keys[:2]
+
+    # Al reanudar solo se descargan los objetos posteriores al checkpoint
+    monkeypatch.setattr(ingest, "_process_batch", process_batch)
+    download, downloaded = ingest._download, []
+
+    def counting_download(s3_client, bucket_name, key):
+        downloaded.append(key)
+        return download(s3_client, bucket_name, key)
+    monkeypatch.setattr(ingest, "_download", counting_download)
+    resumed = _sync(api, bucket)
+
+    assert resumed["job_id"] == failed["job_id"]
+    assert resumed["status"] == "finished", resumed
+    assert sorted(downloaded) == keys[2:]
+    assert resumed["processed"] == 6
+    assert sorted(_pages(bucket)) == keys
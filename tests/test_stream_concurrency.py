@@ -0,0 +1,58 @@
+# Prueba de carga de /chat: un solo proceso de la API mantiene abiertos a la vez muchos más streams
+# que hilos tiene el threadpool de Starlette (40 por defecto). Con el /chat síncrono anterior cada
+# stream ocupaba un hilo durante toda la generación y el stream 41 esperaba a que terminara otro.
+
+import time
+import asyncio
+
+import anyio
+import httpx
+
+STREAMS = 200
+TOKENS = 20
+TOKEN_DELAY = 0.1 # Cada respuesta tarda ~2 s en generarse
+
+async def _open_streams(api: str, username: str) -> dict:
+    threads = anyio.to_thread.current_default_thread_limiter().total_tokens
+    limits = httpx.Limits(max_connections=STREAMS, max_keepalive_connections=STREAMS)
+    stats = {"threads": threads, "open": 0, "peak": 0, "first_byte": [], "bodies": []}
+    async with httpx.AsyncClient(base_url=api, limits=limits, timeout=120) as client:
+        async def one(i: int):
+            start = time.monotonic()
+            payload = {"username": username, "prompt": f"pregunta {i}"}
+            async with client.stream("POST", "/chat", json=payload) as response:
+                assert response.status_code == 200
+                chunks = response.aiter_bytes()
+                body = await chunks.__anext__()
+                stats["first_byte"].append(time.monotonic() - start)
+                stats["open"] += 1
+                stats["peak"] = max(stats["peak"], stats["open"])
+                async for chunk in chunks:
+                    body += chunk
+                stats["open"] -= 1
+            stats["bodies"].append(body.decode("utf-8"))
+
+        started = time.monotonic()
+        await asyncio.gather(*(one(i) for i in range(STREAMS)))
+        stats["elapsed"] = time.monotonic() - started
+    return stats
+
+def test_streams_scale_past_threadpool(api, username, fake_ollama):
+    previous = fake_ollama.tokens, fake_ollama.token_delay
+    fake_ollama.tokens, fake_ollama.token_delay = TOKENS, TOKEN_DELAY
+    try:
+        stats = asyncio.run(_open_streams(api, username))
+    finally:
+        fake_ollama.tokens, fake_ollama.token_delay = previous
+
+    generation = TOKENS * TOKEN_DELAY
+    first_byte = sorted(stats["first_byte"])
+    print(
+        f"\n{STREAMS} streams, threadpool de {stats['threads']} hilos: {stats['peak']} abiertos a la vez, "
+        f"total {stats['elapsed']:.1f} s (una generación: {generation:.1f} s), "
+        f"primer byte p50 {first_byte[len(first_byte) // 2]:.2f} s / máx {first_byte[-1]:.2f} s"
+    )
+    assert all(f"token{TOKENS - 1}" in body for body in stats["bodies"])
+    assert stats["peak"] > stats["threads"]
+    # Limitado por el threadpool tardaría al menos STREAMS / hilos generaciones seguidas
+    assert stats["elapsed"] < (STREAMS / stats["threads"]) * generation
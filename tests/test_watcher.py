@@ -0,0 +1,88 @@
+# Indexador continuo con inotify: las carpetas ignoradas de la raíz no se vigilan, las subcarpetas
+# nuevas sí, y si inotify se queda sin watches (fs.inotify.max_user_watches) se pasa al sondeo en vez
+# de dejar de ver cambios.
+
+import os
+import errno
+import asyncio
+
+import pytest
+
+@pytest.fixture
+def watcher(api, tmp_path, monkeypatch):
+    """Módulo watcher vigilando una carpeta temporal, sin la sincronización inicial contra la base de datos."""
+    import ingest
+    import watcher
+
+    async def no_catch_up():
+        pass
+    monkeypatch.setattr(ingest, "LOCAL_CONTEXT_PATH", str(tmp_path))
+    monkeypatch.setattr(watcher, "WATCHER_ENABLED", True)
+    monkeypatch.setattr(watcher, "WATCHER_MODE", "auto")
+    monkeypatch.setattr(watcher, "POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(watcher, "_catch_up", no_catch_up)
+    monkeypatch.setattr(watcher, "_pending", {})
+    return watcher
+
+@pytest.fixture
+def watch_limit(monkeypatch):
+    """Hace que inotify rechace vigilar las carpetas llamadas `big` como al agotar los watches."""
+    from watchdog.observers.api import BaseObserver
+    schedule = BaseObserver.schedule
+
+    def limited_schedule(self, handler, path, **kwargs):
+        if os.path.basename(path) == "big":
+            raise OSError(errno.ENOSPC, "inotify watch limit reached")
+        return schedule(self, handler, path, **kwargs)
+    monkeypatch.setattr(BaseObserver, "schedule", limited_schedule)
+
+async def _until(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "tiempo de espera agotado"
+        await asyncio.sleep(0.05)
+
+def _run(watcher, scenario):
+    async def main():
+        await watcher.start()
+        try:
+            await scenario()
+        finally:
+            await watcher.stop()
+    asyncio.run(main())
+
+def test_inotify_skips_ignored_dirs_and_watches_new_ones(watcher, tmp_path):
+    for folder in ("src", "node_modules/paquete", ".git/objects"):
+        (tmp_path / folder).mkdir(parents=True)
+
+    async def scenario():
+        assert {emitter.watch.path for emitter in watcher._observer.emitters} == {str(tmp_path), str(tmp_path / "src")}
+        (tmp_path / "docs").mkdir()
+        await _until(lambda: str(tmp_path / "docs") in {e.watch.path for e in watcher._observer.emitters})
+        (tmp_path / "docs" / "guia.md").write_text("# Guía\n")
+        (tmp_path / "src" / "app.py").write_text("print(1)\n")
+        await _until(lambda: {str(tmp_path / "docs" / "guia.md"), str(tmp_path / "src" / "app.py")} <= set(watcher._pending))
+
+    _run(watcher, scenario)
+
+def test_falls_back_to_polling_when_watch_limit_reached_at_start(watcher, watch_limit, tmp_path):
+    (tmp_path / "big").mkdir()
+
+    async def scenario():
+        assert watcher._observer is None
+        await asyncio.sleep(0.2) # Primer recorrido del sondeo
+        (tmp_path / "big" / "datos.json").write_text("{}")
+        await _until(lambda: str(tmp_path / "big" / "datos.json") in watcher._pending)
+
+    _run(watcher, scenario)
+
+def test_falls_back_to_polling_when_watch_limit_reached_later(watcher, watch_limit, tmp_path):
+    async def scenario():
+        assert watcher._observer is not None
+        (tmp_path / "big").mkdir()
+        await _until(lambda: watcher._observer is None)
+        await asyncio.sleep(0.2)
+        (tmp_path / "big" / "datos.json").write_text("{}")
+        await _until(lambda: str(tmp_path / "big" / "datos.json") in watcher._pending)
+
+    _run(watcher, scenario)